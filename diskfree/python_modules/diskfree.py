@@ -25,38 +25,136 @@
 # THE SOFTWARE.
 #
 
-import re
 import os
+import select
+import threading
+import time
 
 # Minimum disk size
 MIN_DISK_SIZE=1
 
 NAME_PREFIX = 'disk_free_'
 PARAMS = {
-    'mounts' : '/proc/mounts'
+    'mounts' : '/proc/mounts',
+    'refresh_rate' : 20,
+    'statvfs_timeout' : 5,
 }
 
+# (unit type, mount point) of every metric, by metric name
+NAME_TO_PATH = {}
 
-def get_value(name):
-    """Return a value for the requested metric"""
+# Latest value of every metric, replaced as a whole after each refresh
+VALUES = {}
+
+# statvfs calls that did not return within statvfs_timeout, by mount point
+HUNG = {}
+
+_Worker_Thread = None
+
+
+class MountTable(object):
+    """Local mount points listed in the mounts file, reread only when it
+    changes. /proc/mounts tells about changes through poll(), any other file
+    is reread when its size or mtime changes."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.poller = None
+        self.signature = None
+        self.mounts = []
+
+    def changed(self):
+        if self.poller is not None:
+            return bool(self.poller.poll(0))
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return self.signature != ()
+        return (st.st_size, st.st_mtime) != self.signature
+
+    def get_mounts(self):
+        if self.signature is not None and not self.changed():
+            return self.mounts
+
+        try:
+            if self.file is None:
+                self.file = open(self.path)
+                if self.path.startswith('/proc/'):
+                    self.poller = select.poll()
+                    self.poller.register(self.file, select.POLLPRI | select.POLLERR)
+            st = os.fstat(self.file.fileno())
+            self.file.seek(0)
+            lines = self.file.read().splitlines()
+            # a regular file may have been replaced, open it again next time
+            if self.poller is None:
+                self.file.close()
+                self.file = None
+        except (IOError, OSError):
+            self.file = None
+            self.poller = None
+            st = None
+            lines = []
+
+        self.signature = st and (st.st_size, st.st_mtime) or ()
+        self.mounts = parse_mounts(lines)
+        return self.mounts
+
+
+def parse_mounts(lines):
+    """Return the mount points of local file systems"""
+
+    mounts = []
+    for line in lines:
+        # We only want local file systems
+        if line.startswith('/') or line.startswith('tmpfs'):
+            mounts.append(line.split()[1])
+    return mounts
+
+
+def statvfs_into(path, results):
+    try:
+        results[path] = os.statvfs(path)
+    except OSError:
+        results[path] = None
+
+
+def statvfs_all(paths, timeout):
+    """statvfs every path in its own thread, waiting at most timeout seconds
+    for all of them. A path whose statvfs is still running (a hung NFS
+    server, say) is left out, and not tried again until that call returns."""
+
+    results = {}
+    threads = []
+    for path in paths:
+        if path in HUNG:
+            if HUNG[path].isAlive():
+                continue
+            del HUNG[path]
+        thread = threading.Thread(target=statvfs_into, args=(path, results))
+        thread.setDaemon(True)
+        thread.start()
+        threads.append((path, thread))
+
+    deadline = time.time() + timeout
+    for path, thread in threads:
+        thread.join(max(deadline - time.time(), 0))
+        if thread.isAlive():
+            HUNG[path] = thread
+
+    return dict(results)
 
-    # parse unit type and path from name
-    name_parser = re.match("^%s(absolute|percent)_(.*)$" % NAME_PREFIX, name)
-    unit_type = name_parser.group(1)
-    if name_parser.group(2) == 'rootfs':
-        path = '/'
-    else:
-        path = '/' + name_parser.group(2).replace('_', '/')
 
-    # get fs stats
+def disk_value(disk, unit_type):
+    """Free space in a statvfs result, in GB or percent"""
+
     try:
-        disk = os.statvfs(path)
         if unit_type == 'percent':
             result = (float(disk.f_bavail) / float(disk.f_blocks)) * 100
         else:
             result = (disk.f_bavail * disk.f_frsize) / float(2**30) # GB
 
-    except OSError:
+    except AttributeError:
         result = 0
 
     except ZeroDivisionError:
@@ -65,44 +163,99 @@ def get_value(name):
     return result
 
 
+def update_values(stats, mounted):
+    """Replace VALUES with the ones in stats. Metrics of file systems that
+    are no longer mounted read 0, those whose statvfs hung keep their value."""
+
+    global VALUES
+
+    values = dict(VALUES)
+    for name, (unit_type, path) in NAME_TO_PATH.iteritems():
+        if path not in mounted:
+            values[name] = 0
+        elif path in stats:
+            values[name] = disk_value(stats[path], unit_type)
+    VALUES = values
+
+
+class UpdateDiskfreeThread(threading.Thread):
+    """Refreshes VALUES every refresh_rate seconds, so the metric callbacks
+    never wait on statvfs"""
+
+    def __init__(self, mount_table, refresh_rate, timeout):
+        threading.Thread.__init__(self)
+        self.running = False
+        self.shuttingdown = False
+        self.mount_table = mount_table
+        self.refresh_rate = refresh_rate
+        self.timeout = timeout
+        self._wakeup = threading.Event()
+
+    def shutdown(self):
+        self.shuttingdown = True
+        self._wakeup.set()
+        if not self.running:
+            return
+        self.join()
+
+    def run(self):
+        self.running = True
+
+        while not self.shuttingdown:
+            self._wakeup.wait(self.refresh_rate)
+            if not self.shuttingdown:
+                self.refresh()
+
+        self.running = False
+
+    def refresh(self):
+        mounted = set(self.mount_table.get_mounts())
+        paths = set([path for (unit_type, path) in NAME_TO_PATH.itervalues() if path in mounted])
+        update_values(statvfs_all(paths, self.timeout), mounted)
+
+
+def get_value(name):
+    """Return a value for the requested metric"""
+
+    return VALUES.get(name, 0)
+
+
 def metric_init(lparams):
     """Initialize metric descriptors"""
 
-    global PARAMS, MIN_DISK_SIZE
+    global PARAMS, MIN_DISK_SIZE, _Worker_Thread
 
     # set parameters
     for key in lparams:
         PARAMS[key] = lparams[key]
 
-    # read mounts file
-    try:
-        f = open(PARAMS['mounts'])
-    except IOError:
-        f = []
+    mount_table = MountTable(PARAMS['mounts'])
+    mounts = mount_table.get_mounts()
+    timeout = float(PARAMS['statvfs_timeout'])
+    stats = statvfs_all(mounts, timeout)
 
     # parse mounts and create descriptors
     descriptors = []
-    for line in f:
-        # We only want local file systems
-        if line.startswith('/') or line.startswith('tmpfs'):
-            mount_info = line.split()
-
+    for mount in mounts:
             # create key from path
-            if mount_info[1] == '/':
+            if mount == '/':
                 path_key = 'rootfs'
             else:
-                path_key = mount_info[1][1:].replace('/', '_')
+                path_key = mount[1:].replace('/', '_')
                 
             # Calculate the size of the disk. We'll use it exclude small disks
-            disk = os.statvfs(mount_info[1])            
+            disk = stats.get(mount)
+            if disk is None:
+                continue
             disk_size = (disk.f_blocks * disk.f_frsize) / float(2**30)
 
-            if disk_size > MIN_DISK_SIZE and mount_info[1] != "/dev":
+            if disk_size > MIN_DISK_SIZE and mount != "/dev":
 	      for unit_type in ['absolute', 'percent']:
 		  if unit_type == 'percent': 
 			  units = '%'
 		  else:
 			  units = 'GB'
+		  NAME_TO_PATH[NAME_PREFIX + unit_type + '_' + path_key] = (unit_type, mount)
 		  descriptors.append({
 		      'name': NAME_PREFIX + unit_type + '_' + path_key,
 		      'call_back': get_value,
@@ -111,17 +264,23 @@ def metric_init(lparams):
 		      'units': units,
 		      'slope': 'both',
 		      'format': '%f',
-		      'description': "Disk space available (%s) on %s" % (units, mount_info[1]),
+		      'description': "Disk space available (%s) on %s" % (units, mount),
 		      'groups': 'disk'
 		  })
 
+    update_values(stats, set(mounts))
+
+    _Worker_Thread = UpdateDiskfreeThread(mount_table, float(PARAMS['refresh_rate']), timeout)
+    _Worker_Thread.start()
+
     return descriptors
 
 
 def metric_cleanup():
     """Cleanup"""
 
-    pass
+    if _Worker_Thread is not None:
+        _Worker_Thread.shutdown()
 
 
 # the following code is for debugging and testing
@@ -129,3 +288,4 @@ if __name__ == '__main__':
     descriptors = metric_init(PARAMS)
     for d in descriptors:
         print (('%s = %s') % (d['name'], d['format'])) % (d['call_back'](d['name']))
+    metric_cleanup()
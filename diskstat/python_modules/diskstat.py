@@ -47,6 +47,8 @@ import re
 import stat
 import time
 
+import procfs_snapshot
+
 descriptors = []
 
 logging.basicConfig(level=logging.ERROR, format="%(asctime)s - %(name)s - %(levelname)s\t Thread-%(thread)d - %(message)s")
@@ -256,6 +258,13 @@ def update_stats():
             logging.warning('error getting partitions')
             return False
 
+    # Get values from diskstats file, once for all devices
+    try:
+        diskstats = procfs_snapshot.get(DISKSTATS_FILE).data
+    except IOError:
+        logging.warning('error reading ' + DISKSTATS_FILE)
+        return False
+
     # Get values for each disk device
     for dev in PARTITIONS:
         logging.debug(" dev: " + dev)
@@ -271,12 +280,7 @@ def update_stats():
             olddev = dev
             dev = get_devname(dev)
 
-        # Get values from diskstats file
-        with open(DISKSTATS_FILE, 'r') as f:
-            lines = f.readlines()
-        for line in lines:
-            if dev in line:
-                vals = line.split()
+        vals = diskstats.get(dev)
 
         logging.debug('  vals: ' + str(vals))
 
@@ -284,21 +288,26 @@ def update_stats():
         if device_mapper == 'true':
             dev = olddev
 
-        get_diff(dev, 'reads', int(vals[3]))
-        get_diff(dev, 'writes', int(vals[7]))
+        if vals is None:
+            logging.warning('no diskstats entry for ' + dev)
+            continue
+
+        # The snapshot drops the major, minor and name columns
+        get_diff(dev, 'reads', vals[0])
+        get_diff(dev, 'writes', vals[4])
 
-        get_diff(dev, 'reads_merged', int(vals[4]))
-        get_diff(dev, 'writes_merged', int(vals[8]))
+        get_diff(dev, 'reads_merged', vals[1])
+        get_diff(dev, 'writes_merged', vals[5])
 
-        get_delta(dev, 'read_bytes_per_sec', int(vals[5]), float(BYTES_PER_SECTOR))
-        get_delta(dev, 'write_bytes_per_sec', int(vals[9]), float(BYTES_PER_SECTOR))
+        get_delta(dev, 'read_bytes_per_sec', vals[2], float(BYTES_PER_SECTOR))
+        get_delta(dev, 'write_bytes_per_sec', vals[6], float(BYTES_PER_SECTOR))
 
-        get_delta(dev, 'read_time', float(vals[6]), 0.001)
-        get_delta(dev, 'write_time', float(vals[10]), 0.001)
+        get_delta(dev, 'read_time', float(vals[3]), 0.001)
+        get_delta(dev, 'write_time', float(vals[7]), 0.001)
 
-        get_diff(dev, 'io_time', float(vals[12]), 0.001)
+        get_diff(dev, 'io_time', float(vals[9]), 0.001)
         get_percent_time(dev, 'percent_io_time', float(stats[dev]['io_time']))
-        get_delta(dev, 'weighted_io_time', float(vals[13]), 0.001)
+        get_delta(dev, 'weighted_io_time', float(vals[10]), 0.001)
 
     logging.debug('success refreshing stats')
     logging.debug('stats: ' + str(stats))
@@ -9,6 +9,10 @@
 ###  Changelog:
 ###    v1.0.1 - 2010-07-30
 ###      * Initial version taken from jmxsh.py v1.0.5
+###
+###    v1.1.0 - 2026-10-18
+###      * Keep one jmxsh running and connected between updates, needs
+###        jmxsh_session.py from jmxsh/python_modules next to this module
 
 ###  Copyright Jamie Isaacs. 2010
 ###  License to use, modify, and distribute under the GPL
@@ -19,6 +23,7 @@ import subprocess
 import traceback, sys, re
 import tempfile
 import logging
+from jmxsh_session import JmxshSession, JmxshError, get_command
 
 descriptors = []
 
@@ -39,6 +44,10 @@ NAME = PORT
 MAX_UPDATE_TIME = 15
 JMXSH = '/usr/share/java/jmxsh.jar'
 
+# seconds jmxsh gets to answer one update
+TIMEOUT = 30
+SESSION = None
+
 def update_stats():
 	logging.debug('updating stats')
 	global last_update, stats, last_val
@@ -50,38 +59,25 @@ def update_stats():
 		return True
 
 	#####
-	# Build jmxsh script into tmpfile
-	sh  = '# jmxsh\njmx_connect -h ' + HOST + ' -p ' + PORT + '\n'
-	sh += 'set obj [lindex [split [jmx_list net.sf.ehcache.hibernate] =] 2]\n'
+	# One script for all caches, run by the jmxsh kept connected
+	sh = ['catch {set obj [lindex [split [jmx_list net.sf.ehcache.hibernate] =] 2]}']
 	_mbean = 'net.sf.ehcache:type=SampledCache,SampledCacheManager=${obj},name='
 	for name,mbean_name in METRICS.items():
-		sh += 'puts "' + name + '_hit_count: [jmx_get -m ' + _mbean + mbean_name + ' CacheHitCount]"\n'
-		sh += 'puts "' + name + '_miss_count: [jmx_get -m ' + _mbean + mbean_name + ' CacheMissCount]"\n'
+		sh.append(get_command(name + '_hit_count', _mbean + mbean_name + ' CacheHitCount'))
+		sh.append(get_command(name + '_miss_count', _mbean + mbean_name + ' CacheMissCount'))
 
-	#logging.debug(sh)
-	
 	try:
-		# run jmxsh.jar with the temp file as a script
-		cmd = "java -jar " + JMXSH + " -q"
-		p = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-		out, err = p.communicate(sh)
-		#logging.debug('cmd: ' + cmd + '\nout:\n' + out + '\nerr: ' + err + '\ncode: ' + str(p.returncode))
-
-		if p.returncode:
-			logging.warning('failed executing jmxsh\n' + cmd + '\n' + err)
-			return False
-	except:
-		logging.warning('Error running jmx java\n' + traceback.print_exc(file=sys.stdout))
+		values, errors = SESSION.query(sh)
+	except JmxshError, e:
+		logging.warning('failed running jmxsh: ' + str(e))
+		return False
+	if not values:
 		return False
 
 	# Calculate diff for each metric
 	try:
 		# now parse out the values
-		for line in out.strip().split('\n'):
-			params = line.split(': ')
-			name = params[0]
-			val = params[1]
-
+		for name,val in values.items():
 			val = int(val)
 			if name in last_val:
 				if val > last_val[name]:
@@ -127,7 +123,7 @@ def get_stat(name):
 
 def metric_init(params):
 	global descriptors
-	global METRICS,HOST,PORT,NAME
+	global METRICS,HOST,PORT,NAME,TIMEOUT,SESSION
 
 	logging.debug('init: ' + str(params))
 
@@ -139,6 +135,9 @@ def metric_init(params):
 	except:
 		logging.warning('Incorrect parameters')
 
+	TIMEOUT = int(params.pop('timeout', TIMEOUT))
+	SESSION = JmxshSession(JMXSH, HOST, PORT, TIMEOUT)
+
 	METRICS = params
 
 	update_stats()
@@ -177,6 +176,8 @@ def metric_init(params):
 	return descriptors
 
 def metric_cleanup():
+	if SESSION is not None:
+		SESSION.close()
 	logging.shutdown()
 	# pass
 
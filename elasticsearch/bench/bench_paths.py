@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+#  Compares the ways of getting the metric values out of the node stats and
+#  _stats documents, per refresh:
+#
+#    dig_it_up  split every dotted path and walk the document, per metric
+#               read, as the module did before
+#    flatten    flatten both documents into one path -> value map, then
+#               one dict lookup per metric read
+#    compiled   read the configured paths out of both documents through
+#               accessors compiled once (compile_paths/extract), then one
+#               lookup per metric read
+#
+#  The node stats document in corpus/ is a 1.3 data node. The _stats
+#  document is built by repeating the per index entry in corpus/ for an
+#  increasing number of indices, all of them configured in the indices
+#  param.
+#
+#  Usage: python bench_paths.py [-n repeats]
+
+import json
+import os
+import sys
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python_modules'))
+
+from elasticsearch import keyToPath, indexStatPaths, compile_paths, extract
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+INDEX_COUNTS = (1, 10, 100, 500, 1000)
+
+
+def legacy_dig_it_up(obj, path):
+    try:
+        if type(path) in (str, unicode):
+            path = path.split('.')
+        return reduce(lambda x, y: x[y], path, obj)
+    except:
+        return False
+
+
+def flatten(obj, prefix='', values=None):
+    if values is None:
+        values = {}
+
+    for key, value in obj.iteritems():
+        path = prefix + key
+        if isinstance(value, dict):
+            flatten(value, path + '.', values)
+        else:
+            values[path] = value
+
+    return values
+
+
+def build_index_stats(index, count):
+    names = ['logstash-2014.%02d.%02d' % (i / 28 % 12 + 1, i % 28 + 1) + ('-%d' % (i / 336) if i >= 336 else '')
+             for i in range(count)]
+    entry = {'primaries': index['primaries'], 'total': index['primaries']}
+    return names, {
+        '_shards': {'total': count * 10, 'successful': count * 10, 'failed': 0},
+        '_all': entry,
+        'indices': dict([(name, entry) for name in names]),
+    }
+
+
+def run_dig_it_up(nodes, indices, names):
+    node = nodes['nodes'].keys()[0]
+    for name in keyToPath:
+        legacy_dig_it_up(nodes, keyToPath[name] % node)
+    # one _stats document per index, as when each index was fetched on its own
+    for index in names:
+        for path in indexStatPaths:
+            legacy_dig_it_up(indices['indices'][index], path)
+
+
+def run_flatten(nodes, indices, names):
+    node = nodes['nodes'].keys()[0]
+    values = flatten(nodes)
+    flatten(indices, '', values)
+    for name in keyToPath:
+        values.get(keyToPath[name] % node)
+    for index in names:
+        for path in indexStatPaths:
+            values.get('indices.%s.%s' % (index, path))
+
+
+def make_run_compiled():
+    paths = compile_paths(
+        [path % '*' for path in keyToPath.values()] +
+        ['_all.' + path for path in indexStatPaths] +
+        ['indices.*.' + path for path in indexStatPaths])
+
+    def run_compiled(nodes, indices, names):
+        node = nodes['nodes'].keys()[0]
+        values = extract(nodes, paths)
+        extract(indices, paths, values)
+        for name in keyToPath:
+            values.get(keyToPath[name] % node)
+        for index in names:
+            for path in indexStatPaths:
+                values.get('indices.%s.%s' % (index, path))
+
+    return run_compiled
+
+
+def timeit(func, args, repeats):
+    start = time.time()
+    for i in range(repeats):
+        func(*args)
+    return (time.time() - start) * 1000.0 / repeats
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option('-n', '--repeats', dest='repeats', type='int', default=50, help='refreshes per measurement')
+    (options, args) = parser.parse_args()
+
+    nodes = json.load(open(os.path.join(CORPUS_DIR, 'nodes_local_stats_1.3.json')))
+    index = json.load(open(os.path.join(CORPUS_DIR, 'index_stats_1.3.json')))
+    run_compiled = make_run_compiled()
+
+    for count in INDEX_COUNTS:
+        names, indices = build_index_stats(index, count)
+        args = (nodes, indices, names)
+        results = [(name, timeit(func, args, options.repeats)) for (name, func) in
+                   (('dig_it_up', run_dig_it_up), ('flatten', run_flatten), ('compiled', run_compiled))]
+        print '%5d indices  ' % count + '  '.join(['%s %8.3f ms' % r for r in results])
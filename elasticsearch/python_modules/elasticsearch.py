@@ -7,14 +7,19 @@ except ImportError:
     import json
 
 import logging
+import threading
 import time
-import urllib
+import traceback
+import urllib2
 import re
+import fnmatch
 from functools import partial
 
 logging.basicConfig(level=logging.ERROR, format="%(asctime)s - %(name)s - %(levelname)s\t Thread-%(thread)d - %(message)s")
 logging.debug('starting up')
 
+_Worker_Thread = None
+
 # short name to full path for stats
 keyToPath = dict()
 
@@ -110,44 +115,266 @@ keyToPath[
     'es_open_file_descriptors'] = "nodes.%s.process.open_file_descriptors"
 
 
-def dig_it_up(obj, path):
-    try:
-        if type(path) in (str, unicode):
-            path = path.split('.')
-        return reduce(lambda x, y: x[y], path, obj)
-    except:
-        return False
+# stats read from the _stats result for every entry of the indices param
+indexStatPaths = ['primaries.docs.count', 'primaries.store.size_in_bytes']
 
 
-def update_result(result, url):
-    logging.debug('[elasticsearch] Fetching ' + url)
-    result = json.load(urllib.urlopen(url))
-    return result
+def compile_paths(paths):
+    '''
+    Compile dotted paths into accessor tuples. A path may have one '*'
+    component matching every key at that level; those are grouped by the
+    part before the wildcard so each matching subtree is visited once:
 
+    ['_all.docs.count', 'indices.*.docs.count', 'indices.*.store.size']
+      -> ([('_all.docs.count', ('_all', 'docs', 'count'))],
+          [('indices.', ('indices',), [('docs.count', ('docs', 'count')),
+                                       ('store.size', ('store', 'size'))])])
+    '''
 
-def get_stat_index(result, url, path, name):
-    result = update_result(result, url)
-    val = dig_it_up(result, path)
+    fixed = []
+    wildcards = {}
+    for path in paths:
+        parts = path.split('.*.')
+        if len(parts) == 1:
+            fixed.append((path, tuple(path.split('.'))))
+        elif len(parts) == 2:
+            wildcards.setdefault(parts[0], []).append((parts[1], tuple(parts[1].split('.'))))
+        else:
+            raise ValueError('only one wildcard per path is supported: ' + path)
 
-    if not isinstance(val, bool):
-        return int(val)
-    else:
+    return fixed, [(base + '.', tuple(base.split('.')), leaves) for base, leaves in wildcards.iteritems()]
+
+
+def walk(obj, keys):
+    for key in keys:
+        obj = obj[key]
+    return obj
+
+
+def extract(obj, paths, values=None):
+    '''
+    Read the paths compiled by compile_paths out of obj and return them
+    keyed by their dotted path, with the wildcards filled in. Paths missing
+    from obj are left out.
+    '''
+
+    if values is None:
+        values = {}
+
+    fixed, wildcards = paths
+
+    for path, keys in fixed:
+        try:
+            values[path] = walk(obj, keys)
+        except (KeyError, IndexError, TypeError):
+            pass
+
+    for prefix, base, leaves in wildcards:
+        try:
+            children = walk(obj, base).iteritems()
+        except (KeyError, IndexError, TypeError, AttributeError):
+            continue
+
+        for name, child in children:
+            name = prefix + name + '.'
+            for path, keys in leaves:
+                try:
+                    values[name + path] = walk(child, keys)
+                except (KeyError, IndexError, TypeError):
+                    pass
+
+    return values
+
+
+def unresolved_aliases(indices, names):
+    '''
+    Names in the indices param that are neither wildcards nor index names
+    in the _stats result. _stats keys its indices by concrete index name,
+    so these are taken for aliases and looked up on their own.
+    '''
+
+    aliases = set()
+    for index in indices:
+        for pattern in index.split(','):
+            if pattern == '_all' or set('*?[') & set(pattern):
+                continue
+            if pattern not in names:
+                aliases.add(pattern)
+    return sorted(aliases)
+
+
+def resolve_indices(index, names, aliases={}):
+    '''
+    index names in the _stats result covered by an entry of the indices
+    param, which may be a comma separated group and may use wildcards.
+    Aliases are replaced by the indices they point to. None means all of
+    them, for which _stats already has the _all totals.
+    '''
+
+    patterns = index.split(',')
+    if '*' in patterns or '_all' in patterns:
         return None
 
+    matched = set()
+    for pattern in patterns:
+        if pattern in aliases:
+            matched.update(aliases[pattern])
+        else:
+            matched.update(fnmatch.filter(names, pattern))
+    return sorted(matched)
+
+
+class UpdateElasticsearchThread(threading.Thread):
+    '''
+    Fetches the node stats and the index stats every refresh_rate seconds
+    so the metric callbacks never wait on elasticsearch; they only read the
+    results of the last complete refresh.
+
+    Each refresh is one request for the local node's stats and one _stats
+    request covering every configured index, plus one _stats request per
+    configured alias to learn which indices it points to. Only the paths of the
+    configured metrics are read from both, through accessors compiled at
+    startup, into a single map of dotted path to value that all metrics
+    are served from.
+    '''
+
+    def __init__(self, params, url_nodes, url_indices, url_alias, indices):
+        threading.Thread.__init__(self)
+        self.running = False
+        self.shuttingdown = False
+        self.refresh_rate = int(params.get('refresh_rate', 15))
+        self.timeout = float(params.get('timeout', 10))
+        self.url_nodes = url_nodes
+        self.url_indices = url_indices
+        self.url_alias = url_alias
+        self.indices = indices
+        self.paths = compile_paths(
+            [path % '*' for path in keyToPath.values()] +
+            ['_all.' + path for path in indexStatPaths] +
+            ['indices.*.' + path for path in indexStatPaths])
+        # the _all totals of an alias must not replace those of '*'
+        self.alias_paths = compile_paths(
+            ['indices.*.' + path for path in indexStatPaths])
+        self.node = None
+        self.values = {}
+        self.groups = {}
+        self.started = time.time()
+        self.last_refresh = 0
+        self._results_lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def shutdown(self):
+        self.shuttingdown = True
+        self._wakeup.set()
+        if not self.running:
+            return
+        self.join()
+
+    def run(self):
+        self.running = True
+
+        while not self.shuttingdown:
+            self._wakeup.wait(self.refresh_rate)
+            if not self.shuttingdown:
+                self.refresh_metrics()
+
+        self.running = False
+
+    def fetch(self, url):
+        logging.debug('[elasticsearch] Fetching ' + url)
+        f = urllib2.urlopen(url, None, self.timeout)
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+
+    def refresh_metrics(self):
+        try:
+            r_nodes = self.fetch(self.url_nodes)
+            r_indices = self.fetch(self.url_indices)
+
+            node = r_nodes['nodes'].keys()[0]
+            values = extract(r_nodes, self.paths)
+            extract(r_indices, self.paths, values)
+
+            names = r_indices.get('indices', {}).keys()
+            aliases = {}
+            for alias in unresolved_aliases(self.indices, names):
+                try:
+                    r_alias = self.fetch(self.url_alias.format(alias))
+                except urllib2.HTTPError, e:
+                    # no such index or alias (any more), its metrics are
+                    # not reported
+                    logging.warning('[elasticsearch] %s: %s' % (alias, e))
+                    continue
+                extract(r_alias, self.alias_paths, values)
+                aliases[alias] = r_alias.get('indices', {}).keys()
+            groups = dict([(index, resolve_indices(index, names, aliases)) for index in self.indices])
+        except Exception:
+            # keep serving the previous results, es_stats_age shows how old
+            # they are
+            logging.warning('[elasticsearch] error refreshing metrics')
+            logging.warning(traceback.format_exc())
+            return False
+
+        self._results_lock.acquire()
+        try:
+            self.node = node
+            self.values = values
+            self.groups = groups
+            self.last_refresh = time.time()
+        finally:
+            self._results_lock.release()
+
+        return True
+
+    def snapshot(self):
+        self._results_lock.acquire()
+        try:
+            return self.node, self.values, self.groups
+        finally:
+            self._results_lock.release()
+
+    def stats_age(self):
+        return time.time() - (self.last_refresh or self.started)
+
+
+def validated(val):
+    # missing or non numeric values are not reported
+    if val is None or isinstance(val, bool):
+        return None
+    return int(val)
 
-def getStat(result, url, name):
-    result = update_result(result, url)
 
-    node = result['nodes'].keys()[0]
-    val = dig_it_up(result, keyToPath[name] % node)
+def get_stat_index(index, path, name):
+    node, values, groups = _Worker_Thread.snapshot()
 
-    # Check to make sure we have a valid result
-    # JsonPath returns False if no match found
-    if not isinstance(val, bool):
-        return int(val)
-    else:
+    if index not in groups:
         return None
 
+    names = groups[index]
+    if names is None:
+        return validated(values.get('_all.' + path))
+
+    vals = [values.get('indices.%s.%s' % (n, path)) for n in names]
+    vals = [v for v in vals if v is not None and not isinstance(v, bool)]
+    if not vals:
+        return None
+    return sum(map(int, vals))
+
+
+def getStat(name):
+    node, values, groups = _Worker_Thread.snapshot()
+
+    if node is None:
+        return None
+
+    return validated(values.get(keyToPath[name] % node))
+
+
+def get_stats_age(name):
+    return _Worker_Thread.stats_age()
+
 
 def create_desc(skel, prop):
     d = skel.copy()
@@ -156,19 +383,19 @@ def create_desc(skel, prop):
     return d
 
 
-def get_indices_descriptors(index, skel, result, url):
+def get_indices_descriptors(index, skel):
     metric_tpl = 'es_index_{0}_{{0}}'.format(index)
-    callback = partial(get_stat_index, result, url)
+    callback = partial(get_stat_index, index)
     _create_desc = partial(create_desc, skel)
 
     descriptors = [
         _create_desc({
-            'call_back': partial(callback, '_all.primaries.docs.count'),
+            'call_back': partial(callback, indexStatPaths[0]),
             'name': metric_tpl.format('docs_count'),
             'description': 'document count for index {0}'.format(index),
         }),
         _create_desc({
-            'call_back': partial(callback, '_all.primaries.store.size_in_bytes'),
+            'call_back': partial(callback, indexStatPaths[1]),
             'name': metric_tpl.format('size'),
             'description': 'size in bytes for index {0}'.format(index),
             'units': 'Bytes',
@@ -181,6 +408,7 @@ def get_indices_descriptors(index, skel, result, url):
 
 
 def metric_init(params):
+    global _Worker_Thread
     descriptors = []
 
     logging.debug('[elasticsearch] Received the following parameters')
@@ -195,17 +423,34 @@ def metric_init(params):
     if m and m.group('major') == '0':
         url_cluster = '{0}_cluster/nodes/_local/stats?all=true'.format(host)
     else:
-        url_cluster = '{0}_cluster/state/nodes'.format(host)
+        url_cluster = '{0}_nodes/_local/stats'.format(host)
 
-    # First iteration - Grab statistics
-    logging.debug('[elasticsearch] Fetching ' + url_cluster)
-    result = json.load(urllib.urlopen(url_cluster))
+    # One _stats request for all configured indices. Groups are split into
+    # their members here and summed up again from the per index stats.
+    indices = params.get('indices', '*').split()
+    patterns = set(','.join(indices).split(','))
+    if '*' in patterns or '_all' in patterns:
+        url_indices = '{0}_stats'.format(host)
+    elif m and m.group('major') == '0':
+        url_indices = '{0}{1}/_stats'.format(host, ','.join(sorted(patterns)))
+    else:
+        # a deleted index must not fail the stats of all the others
+        url_indices = '{0}{1}/_stats?ignore_unavailable=true'.format(host, ','.join(sorted(patterns)))
+
+    # _stats of a single alias, its indices are those of the alias
+    url_alias = '{0}{{0}}/_stats'.format(host)
+
+    # First iteration - Grab statistics, then keep refreshing them in the
+    # background
+    _Worker_Thread = UpdateElasticsearchThread(params, url_cluster, url_indices, url_alias, indices)
+    _Worker_Thread.refresh_metrics()
+    _Worker_Thread.start()
 
     metric_group = params.get('metric_group', 'elasticsearch')
 
     Desc_Skel = {
         'name': 'XXX',
-        'call_back': partial(getStat, result, url_cluster),
+        'call_back': getStat,
         'time_max': 60,
         'value_type': 'uint',
         'units': 'units',
@@ -215,19 +460,22 @@ def metric_init(params):
         'groups': metric_group,
     }
 
-    indices = params.get('indices', '*').split()
     for index in indices:
-        url_indices = '{0}{1}/_stats'.format(host, index)
-        logging.debug('[elasticsearch] Fetching ' + url_indices)
-
-        r_indices = json.load(urllib.urlopen(url_indices))
-        descriptors += get_indices_descriptors(index,
-                                               Desc_Skel,
-                                               r_indices,
-                                               url_indices)
+        descriptors += get_indices_descriptors(index, Desc_Skel)
 
     _create_desc = partial(create_desc, Desc_Skel)
 
+    descriptors.append(
+        _create_desc({
+            'call_back': get_stats_age,
+            'name': 'es_stats_age',
+            'units': 'seconds',
+            'format': '%.1f',
+            'description': 'Seconds since the stats were last refreshed',
+            'value_type': 'float'
+        })
+    )
+
     descriptors.append(
         _create_desc({
             'name': 'es_heap_committed',
@@ -720,7 +968,8 @@ def metric_init(params):
 
 
 def metric_cleanup():
-    pass
+    if _Worker_Thread is not None:
+        _Worker_Thread.shutdown()
 
 
 #This code is for debugging and unit testing
@@ -729,3 +978,4 @@ if __name__ == '__main__':
     for d in descriptors:
         v = d['call_back'](d['name'])
         logging.debug('value for %s is %s' % (d['name'], str(v)))
+    metric_cleanup()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+#  Times one interface table walk of a switch, the way runSnmp/buildDict
+#  used to do it (GETNEXT, then t.index(line) for every column of every
+#  row) against GETBULK with the ifIndex keyed assembleRows.
+#
+#  The switch is a stand-in agent in the style of an snmpsim recording: an
+#  ifTable of N "FC port" rows served through the same nextCmd/bulkCmd
+#  calls runSnmp makes. Every request/response pair (PDU) is charged a
+#  fixed round trip time instead of going over the network, so the wall
+#  time reported is  PDUs * rtt + the CPU time spent building the metrics.
+#  GETBULK responses run past the end of the table like a real agent's do.
+#
+#  Usage: python bench_ifwalk.py [--rtt ms] [-r max-repetitions,...]
+
+import os
+import sys
+import time
+import types
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+PORT_COUNTS = (48, 128, 384)
+
+
+class StandInAgent(object):
+    """ifTable of a director with `ports` FC ports, counts the PDUs it answers"""
+
+    def __init__(self, oidDict, ports):
+        self.oidDict = oidDict
+        self.pdus = 0
+        self.values = {}
+        for index in range(1, ports + 1):
+            self.values[index] = {
+                'ifIndex': index,
+                'ifDescr': 'FC port 0/%d' % (index - 1),
+                'ifInOctets': 1938172 * index,
+                'ifInUcastPkts': 31827 * index,
+                'ifInErrors': index % 3,
+                'ifOutOctets': 2918371 * index,
+                'ifOutUcastPkts': 41928 * index,
+                'ifOutErrors': index % 5,
+            }
+        self.indexes = sorted(self.values)
+
+    def column(self, oid):
+        for name, prefix in self.oidDict.items():
+            if tuple(prefix) == tuple(oid):
+                return name
+
+    def varbind(self, column, position):
+        # past the last row the agent answers with the next column's first
+        # row, that is what a GETNEXT or GETBULK off the end of a column gets
+        if position < len(self.indexes):
+            index = self.indexes[position]
+            return (tuple(self.oidDict[column]) + (index,), self.values[index][column])
+        return (tuple(self.oidDict[column][:-1]) + (self.oidDict[column][-1] + 1, 1), 0)
+
+    def nextCmd(self, authData, transport, *oids):
+        columns = [self.column(oid) for oid in oids]
+        table = []
+        for position in range(len(self.indexes) + 1):
+            self.pdus += 1
+            if position < len(self.indexes):
+                table.append([self.varbind(column, position) for column in columns])
+        return None, 0, 0, table
+
+    def bulkCmd(self, authData, transport, nonRepeaters, maxRepetitions, *oids):
+        columns = [self.column(oid) for oid in oids]
+        table = []
+        position = 0
+        while position < len(self.indexes):
+            self.pdus += 1
+            for repetition in range(maxRepetitions):
+                table.append([self.varbind(column, position) for column in columns])
+                position += 1
+        return None, 0, 0, table
+
+
+def standin_cmdgen(agent):
+    module = types.ModuleType('cmdgen')
+    module.CommunityData = lambda *args: args
+    module.UdpTransportTarget = lambda *args, **kwargs: args
+    module.CommandGenerator = lambda: agent
+    return module
+
+
+# runSnmp/buildDict before the assembler, for comparison
+def legacy_buildDict(oidDict, t, switch):
+    import re
+    builtdict = {}
+
+    for line in t:
+        string = str(t[t.index(line)][1][1])
+        match = re.search(r'FC port', string)
+        if match and t[t.index(line)][0][1] != '':
+            temp = str(t[t.index(line)][1][1])
+            name = ((temp.lower()).replace(' ', '_')).replace('/', '_')
+            inoct = str(t[t.index(line)][2][1])
+            builtdict[switch+'_'+name+'_bitsin'] = int(inoct) * 8
+            outoct = str(t[t.index(line)][5][1])
+            builtdict[switch+'_'+name+'_bitsout'] = int(outoct) * 8
+            inpkt = str(t[t.index(line)][4][1])
+            builtdict[switch+'_'+name+'_pktsin'] = int(inpkt)
+            outpkt = str(t[t.index(line)][7][1])
+            builtdict[switch+'_'+name+'_pktsout'] = int(outpkt)
+            inerrors = str(t[t.index(line)][3][1])
+            builtdict[switch+'_'+name+'_inerrors'] = int(inerrors)
+            outerrors = str(t[t.index(line)][6][1])
+            builtdict[switch+'_'+name+'_outerrors'] = int(outerrors)
+
+    return builtdict
+
+
+def legacy_walk(fc, agent):
+    errorIndication, errorStatus, errorIndex, varBindTable = agent.nextCmd(
+        None, None, *[fc.oidDict[column] for column in fc.COLUMNS])
+    return legacy_buildDict(fc.oidDict, varBindTable, 'switch1')
+
+
+def current_walk(fc, agent):
+    return fc.buildDict(fc.oidDict, fc.runSnmp(fc.oidDict, '127.0.0.1'), 'switch1')
+
+
+def measure(fc, walk, ports, rtt, repeats):
+    agent = StandInAgent(fc.oidDict, ports)
+    fc.cmdgen = standin_cmdgen(agent)
+    start = time.time()
+    for i in range(repeats):
+        result = walk(fc, agent)
+    cpu = (time.time() - start) / repeats
+    pdus = agent.pdus / repeats
+    return result, pdus, (cpu + pdus * rtt) * 1000.0, cpu * 1000.0
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option('--rtt', dest='rtt', type='float', default=2.0, help='milliseconds charged per PDU')
+    parser.add_option('-r', '--repetitions', dest='repetitions', default='10,25,50', help='GETBULK max-repetitions to try')
+    parser.add_option('-n', '--repeats', dest='repeats', type='int', default=5, help='walks per measurement')
+    (options, args) = parser.parse_args()
+
+    try:
+        import pysnmp
+    except ImportError:
+        # only cmdgen is used, and the bench replaces it with the stand-in
+        for name in ('pysnmp', 'pysnmp.entity', 'pysnmp.entity.rfc3413', 'pysnmp.entity.rfc3413.oneliner'):
+            sys.modules[name] = types.ModuleType(name)
+        sys.modules['pysnmp.entity.rfc3413.oneliner'].cmdgen = types.ModuleType('cmdgen')
+    import fibrechannel as fc
+
+    rtt = options.rtt / 1000.0
+    for ports in PORT_COUNTS:
+        expected, pdus, wall, cpu = measure(fc, legacy_walk, ports, rtt, options.repeats)
+        print '%4d ports  GETNEXT + t.index    %5d PDUs  cpu %8.2f ms  wall %8.2f ms' % (ports, pdus, cpu, wall)
+
+        fc.BULK_REPETITIONS = 0
+        result, pdus, wall, cpu = measure(fc, current_walk, ports, rtt, options.repeats)
+        print '%4d ports  GETNEXT + assembler  %5d PDUs  cpu %8.2f ms  wall %8.2f ms%s' % \
+            (ports, pdus, cpu, wall, result != expected and '  MISMATCH' or '')
+
+        for repetitions in [int(r) for r in options.repetitions.split(',')]:
+            fc.BULK_REPETITIONS = repetitions
+            result, pdus, wall, cpu = measure(fc, current_walk, ports, rtt, options.repeats)
+            print '%4d ports  GETBULK(%3d)         %5d PDUs  cpu %8.2f ms  wall %8.2f ms%s' % \
+                (ports, repetitions, pdus, cpu, wall, result != expected and '  MISMATCH' or '')
@@ -32,6 +32,7 @@
 
 import logging
 import os
+import select
 import time
 import subprocess
 
@@ -39,7 +40,6 @@ descriptions = {}
 descriptors = []
 last_update = 0
 cur_time = 0
-stats = {}
 last_val = {}
 
 MAX_UPDATE_TIME = 15
@@ -50,9 +50,125 @@ logging.debug('starting up')
 
 MMPMON='/usr/lpp/mmfs/bin/mmpmon'
 
+# seconds mmpmon gets to answer the requests of one update
+TIMEOUT = 30
+
+# Requests sent every update. io_s and nsd_ds are added by the params of
+# the same name.
+REQUESTS = ['fs_io_s']
+
+# Fields of an mmpmon -p line that name what it is about, not counters
+HEADER = ('n', 'nn', 'rc', 't', 'tu', 'cl', 'fs', 'd', 'dev')
+
+# Counters of each filesystem (or node, or NSD), by the key they are
+# reported under: the fields read, in order, and their last values and
+# rates in arrays allocated once
+COUNTERS = {}
+
+# metric name -> (counters, position)
+SLOTS = {}
+
+SESSION = None
+
+def is_key(token):
+	return len(token) > 2 and token[0] == '_' and token[-1] == '_'
+
+def parse_line(line):
+	"""Return the request and the fields of an mmpmon -p line, by their
+	names. A key followed by another key starts a section, whose name
+	prefixes the fields in it: "_r_ _ops_ 3" gives r_ops."""
+	tokens = line.split()
+	if not tokens or not is_key(tokens[0]):
+		return None, {}
+	values = {}
+	section = ''
+	i = 1
+	while i < len(tokens):
+		key = tokens[i].strip('_')
+		if i + 1 == len(tokens) or is_key(tokens[i + 1]):
+			section = key + '_'
+			i += 1
+			continue
+		values[section + key] = tokens[i + 1]
+		i += 2
+	return tokens[0].strip('_'), values
+
+class MmpmonSession(object):
+	"""mmpmon -p -s kept running, sent the requests of every update on its
+	stdin. Each batch of requests is followed by ver, whose reply marks the
+	end of the batch's output."""
+
+	def __init__(self, command, timeout):
+		self.command = command
+		self.timeout = timeout
+		self.process = None
+		self.buffer = ''
+
+	def start(self):
+		logging.debug(' starting ' + ' '.join(self.command))
+		self.process = subprocess.Popen(self.command,
+						stdin=subprocess.PIPE,
+						stdout=subprocess.PIPE,
+						stderr=open(os.devnull, 'w'),
+						close_fds=True)
+		self.buffer = ''
+
+	def close(self):
+		if self.process is not None:
+			try:
+				self.process.stdin.close()
+				self.process.terminate()
+				self.process.wait()
+			except (IOError, OSError):
+				pass
+			self.process = None
+
+	def query(self, requests):
+		"""Return the parsed lines answering requests"""
+		try:
+			if self.process is None or self.process.poll() is not None:
+				self.start()
+			self.process.stdin.write(''.join([r + '\n' for r in requests + ['ver']]))
+			self.process.stdin.flush()
+
+			fd = self.process.stdout.fileno()
+			deadline = time.time() + self.timeout
+			lines = []
+			while True:
+				while '\n' in self.buffer:
+					line, self.buffer = self.buffer.split('\n', 1)
+					request, values = parse_line(line)
+					if request == 'ver':
+						return lines
+					if request is not None:
+						lines.append((request, values))
+				remaining = deadline - time.time()
+				if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+					raise IOError('no answer from mmpmon within %s seconds' % self.timeout)
+				chunk = os.read(fd, 65536)
+				if not chunk:
+					raise IOError('mmpmon exited')
+				self.buffer += chunk
+		except (IOError, OSError):
+			# what it prints next may answer these requests
+			self.close()
+			raise
+
+def counter_key(request, values):
+	"""The key counters of a line are kept under, and the fields counted"""
+	if request == 'fs_io_s':
+		if FSYSTEMS and values['fs'] not in FSYSTEMS:
+			return None, None
+		return values['fs'], [descriptions[label]['field'] for label in sorted(descriptions)]
+	if request == 'io_s':
+		return 'io', [descriptions[label]['field'] for label in sorted(descriptions)]
+	if request == 'nsd_ds':
+		return 'nsd_' + values['dev'], sorted([f for f in values if f not in HEADER])
+	return None, None
+
 def update_stats():
 	logging.debug('updating stats')
-	global descriptions, last_update, stats, last_val, cur_time
+	global last_update, cur_time
 	global MAX_UPDATE_TIME
 
 	cur_time = time.time()
@@ -63,61 +179,63 @@ def update_stats():
 
 	#####
 	# Update stats
-	stats = {}
 	interval = cur_time - last_update
 
-	# Get data from mmpmon
-	p = subprocess.Popen(['/usr/bin/sudo','/usr/lpp/mmfs/bin/mmpmon','-p','-s'],stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=False)
-	out, err = p.communicate(input='fs_io_s\n')
-
-	for line in out.splitlines():
-		vals = line.split()
-		fs = vals[14]
-		logging.debug(' Parsing FS: ' + fs)
-		if fs not in stats:
-			stats[fs] = {}
-		if fs not in last_val:
-			last_val[fs] = {}
-		if fs not in FSYSTEMS:
-			FSYSTEMS.append(fs)
-		for label, content in descriptions.iteritems():
-			#logging.debug(' Setting value for: ' + label)
-			if label in last_val[fs]:
-				stats[fs][label] = (int(vals[content['field']]) - int(last_val[fs][label])) * float(1) / float(interval)	
+	# Get data from the running mmpmon
+	try:
+		lines = SESSION.query(REQUESTS)
+	except (IOError, OSError), e:
+		logging.warning(' mmpmon failed: ' + str(e))
+		return False
+
+	for request, values in lines:
+		if values.get('rc') != '0':
+			continue
+		key, fields = counter_key(request, values)
+		if key is None:
+			continue
+		logging.debug(' Parsing: ' + key)
+		if key not in COUNTERS:
+			COUNTERS[key] = {
+				'fields': fields,
+				'last': [None] * len(fields),
+				'rates': [0] * len(fields),
+			}
+		counters = COUNTERS[key]
+		last = counters['last']
+		rates = counters['rates']
+		for i, field in enumerate(counters['fields']):
+			try:
+				val = float(values[field])
+			except (KeyError, ValueError):
+				continue
+			if last[i] is not None:
+				rates[i] = (val - last[i]) / float(interval)
 			else:
-				#logging.debug(' New value for: ' + fs + '_' + label)
-				stats[fs][label] = 0
+				rates[i] = 0
 
 			# This should never be negative so set it to zero if it is
-			if stats[fs][label] < 0:
-				stats[fs][label] = 0
+			if rates[i] < 0:
+				rates[i] = 0
 
-			last_val[fs][label] = vals[content['field']]
+			last[i] = val
 
 	logging.debug(' success refreshing stats')
-	logging.debug(' stats: ' + str(stats))
-	logging.debug(' last_val: ' + str(stats))
 
 	last_update = cur_time
 	return True
 
 def get_stat(name):
 	logging.debug(' getting stat: ' + name)
-	global stats
 
 	ret = update_stats()
 
 	if ret:
-		fir = name.find('_')
-		sec = name.find('_', fir + 1)
-
-		fs = name[fir + 1:sec]
-		label = name[sec + 1:]
-
 		try:
-			return int(stats[fs][label])
+			counters, i = SLOTS[name]
+			return int(counters['rates'][i])
 		except:
-			logging.warning('failed to fetch [' + fs + '] ' + name)
+			logging.warning('failed to fetch ' + name)
 			return 0 
 	else:
 		return 0
@@ -126,61 +244,75 @@ def metric_init(params):
 	'''Initialize the module and return all metric descriptors'''
 	global descriptions
 	global descriptors
+	global FSYSTEMS, REQUESTS, TIMEOUT, SESSION
 	
 	descriptions = dict(
 		bytes_read={
 			'units': 'bytes/sec',
-			'field': 18,
+			'field': 'br',
 			'description': 'The number of bytes read'},
 		bytes_write={
 			'units': 'bytes/sec',
-			'field': 20,
+			'field': 'bw',
 			'description': 'The number of bytes written'},
 		open_req={
 			'units': 'requests/sec',
-			'field': 22,
+			'field': 'oc',
 			'description': 'The number of open/create requests'},
 		close_req={
 			'units': 'requests/sec',
-			'field': 24,
+			'field': 'cc',
 			'description': 'The number of close requests'},
 		read_req={
 			'units': 'requests/sec',
-			'field': 26,
+			'field': 'rdc',
 			'description': 'The number of application read requests'},
 		write_req={
 			'units': 'requests/sec',
-			'field': 28,
+			'field': 'wc',
 			'description': 'The number of application write requests'},
 		readdir_req={
 			'units': 'requests/sec',
-			'field': 30,
+			'field': 'dir',
 			'description': 'The number of application read directory requests'},
 		inode_updates={
 			'units': 'requests/sec',
-			'field': 32,
+			'field': 'iu',
 			'description': 'The number of inode update requests'},
 		)
 
+	FSYSTEMS = [fs.strip() for fs in params.get('fs', '').split(',') if fs.strip()]
+	REQUESTS = ['fs_io_s']
+	for request in ('io_s', 'nsd_ds'):
+		if str(params.get(request, 'no')).lower() in ('yes', 'true', '1'):
+			REQUESTS.append(request)
+	TIMEOUT = int(params.get('timeout', TIMEOUT))
+	SESSION = MmpmonSession(['/usr/bin/sudo', MMPMON, '-p', '-s'], TIMEOUT)
+
 	update_stats()
 
-	for label in descriptions:
-		logging.debug(' Parsing description: ' + label)
-		for fs in FSYSTEMS:
-			logging.debug(' Parsing fs: ' + fs)
+	labels = dict([(descriptions[label]['field'], label) for label in descriptions])
+	for key in sorted(COUNTERS):
+		logging.debug(' Parsing: ' + key)
+		counters = COUNTERS[key]
+		for i, field in enumerate(counters['fields']):
+			label = labels.get(field, field)
 			d = {
-				'name': 'gpfs_' + fs + '_' + label,
+				'name': 'gpfs_' + key + '_' + label,
 				'call_back': get_stat,
 				'time_max': MAX_UPDATE_TIME,
 				'value_type': 'uint',
-				'units': descriptions[label]['units'],
+				'units': 'count/sec',
 				'slope': 'both',
 				'format': '%u',
 				'description': label,
 				'groups': 'gpfs'
 			}
 
-			d.update(descriptions[label])
+			if label in descriptions:
+				d.update(descriptions[label])
+				del d['field']
+			SLOTS[d['name']] = (counters, i)
 			descriptors.append(d)
 		
 	return descriptors
@@ -188,10 +320,11 @@ def metric_init(params):
 def metric_cleanup():
 	'''Clean up the module
 	Called on shutdown'''
-	pass
+	if SESSION is not None:
+		SESSION.close()
 
 if __name__ == '__main__':
-	params = {'FSYSTEMS': ''}
+	params = {'fs': ''}
 	metric_init(params)
 	while True:
 		for d in descriptors:
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#  Compares one collection cycle (one callback per descriptor, as gmond
+#  does) through the sampler against the previous gpu_device_handler, which
+#  looked up the device handle and made its own NVML call(s) per callback.
+#  Runs on fake_nvml, so no GPU is needed; every NVML call is counted and
+#  costs --call-us microseconds.
+#
+#  Usage: python bench_sampler.py [--call-us us] [-n cycles]
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python_modules'))
+
+import fake_nvml
+sys.modules['pynvml'] = fake_nvml
+
+import nvidia
+from fake_nvml import *
+
+GPU_COUNTS = (1, 4, 8)
+
+legacy_violation_dur = [0] * 32
+
+def legacy_gpu_device_handler(name):
+    """gpu_device_handler as it was before the sampler, for comparison"""
+    (gpu, metric) = name.split('_', 1)
+    gpu_id = int(gpu.split('gpu')[1])
+    gpu_device = nvmlDeviceGetHandleByIndex(gpu_id)
+
+    if (metric == 'type'):
+        return nvmlDeviceGetName(gpu_device)
+    elif (metric == 'uuid'):
+        return nvmlDeviceGetUUID(gpu_device)
+    elif (metric == 'pci_id'):
+        return nvmlDeviceGetPciInfo(gpu_device).pciDeviceId
+    elif (metric == 'temp'):
+        return nvmlDeviceGetTemperature(gpu_device, NVML_TEMPERATURE_GPU)
+    elif (metric == 'mem_total'):
+        return int(nvmlDeviceGetMemoryInfo(gpu_device).total/(1024*1024))
+    elif (metric == 'fb_memory'):
+        return int(nvmlDeviceGetMemoryInfo(gpu_device).used/1048576)
+    elif (metric == 'util'):
+        return nvmlDeviceGetUtilizationRates(gpu_device).gpu
+    elif (metric == 'mem_util'):
+        return nvmlDeviceGetUtilizationRates(gpu_device).memory
+    elif (metric == 'fan'):
+        try:
+            return nvmlDeviceGetFanSpeed(gpu_device)
+        except NVMLError, nvmlError:
+            if NVML_ERROR_NOT_SUPPORTED == nvmlError.value:
+                return 0
+    elif (metric == 'ecc_mode'):
+        try:
+            ecc_mode = nvmlDeviceGetPendingEccMode(gpu_device)
+            if (NVML_FEATURE_DISABLED == ecc_mode):
+                return "OFF"
+            elif (NVML_FEATURE_ENABLED == ecc_mode):
+                return "ON"
+            else:
+                return "UNKNOWN"
+        except NVMLError, nvmlError:
+            if NVML_ERROR_NOT_SUPPORTED == nvmlError.value:
+                return 'N/A'
+    elif (metric == 'graphics_clock_report'):
+        return nvmlDeviceGetClockInfo(gpu_device, NVML_CLOCK_GRAPHICS)
+    elif (metric == 'sm_clock_report'):
+        return nvmlDeviceGetClockInfo(gpu_device, NVML_CLOCK_SM)
+    elif (metric == 'mem_clock_report'):
+        return nvmlDeviceGetClockInfo(gpu_device, NVML_CLOCK_MEM)
+    elif (metric == 'max_graphics_clock'):
+        return nvmlDeviceGetMaxClockInfo(gpu_device, NVML_CLOCK_GRAPHICS)
+    elif (metric == 'max_sm_clock'):
+        return nvmlDeviceGetMaxClockInfo(gpu_device, NVML_CLOCK_SM)
+    elif (metric == 'max_mem_clock'):
+        return nvmlDeviceGetMaxClockInfo(gpu_device, NVML_CLOCK_MEM)
+    elif (metric == 'power_usage_report'):
+        return nvmlDeviceGetPowerUsage(gpu_device)/1000
+    elif (metric == 'serial'):
+        return nvmlDeviceGetSerial(gpu_device)
+    elif (metric == 'power_man_limit'):
+        return nvmlDeviceGetPowerManagementLimit(gpu_device)/1000
+    elif (metric == 'ecc_db_error'):
+        return nvmlDeviceGetTotalEccErrors(gpu_device, 1, 1)
+    elif (metric == 'ecc_sb_error'):
+        return nvmlDeviceGetTotalEccErrors(gpu_device, 0, 1)
+    elif (metric == 'bar1_memory'):
+        return int(nvmlDeviceGetBAR1MemoryInfo(gpu_device).bar1Used/1000000)
+    elif (metric == 'bar1_max_memory'):
+        return int(nvmlDeviceGetBAR1MemoryInfo(gpu_device).bar1Total/1000000)
+    elif (metric == 'shutdown_temp'):
+        return nvmlDeviceGetTemperatureThreshold(gpu_device,0)
+    elif (metric == 'slowdown_temp'):
+        return nvmlDeviceGetTemperatureThreshold(gpu_device,1)
+    elif (metric == 'encoder_util'):
+        return int(nvmlDeviceGetEncoderUtilization(gpu_device)[0])
+    elif (metric == 'decoder_util'):
+        return int(nvmlDeviceGetDecoderUtilization(gpu_device)[0])
+    elif (metric == 'power_violation_report'):
+        newTime = nvmlDeviceGetViolationStatus(gpu_device, 0).violationTime
+        if (legacy_violation_dur[gpu_id] == 0):
+            legacy_violation_dur[gpu_id] = newTime
+        rate = (newTime - legacy_violation_dur[gpu_id]) / 100000000
+        legacy_violation_dur[gpu_id] = newTime
+        return rate
+
+def cycle(handler, names, repeats):
+    """collect every metric `repeats` times, returns the values of the last
+    cycle, NVML calls per cycle and milliseconds per cycle"""
+    calls = fake_nvml.CALLS
+    start = time.time()
+    for i in range(repeats):
+        # each gmond collection is a new sample
+        nvidia.sample_time = 0
+        values = dict([(name, handler(name)) for name in names])
+    elapsed = (time.time() - start) * 1000.0 / repeats
+    return values, (fake_nvml.CALLS - calls) / repeats, elapsed
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option('--call-us', dest='call_us', type='float', default=20, help='microseconds each NVML call takes')
+    parser.add_option('-n', '--repeats', dest='repeats', type='int', default=10, help='collection cycles per measurement')
+    (options, args) = parser.parse_args()
+
+    for count in GPU_COUNTS:
+        fake_nvml.CALL_COST = 0
+        fake_nvml.DEVICE_COUNT = count
+        del nvidia.descriptors[:]
+        nvidia.metric_init({})
+        names = [d['name'] for d in nvidia.descriptors if d['call_back'] == nvidia.gpu_device_handler]
+
+        fake_nvml.CALL_COST = options.call_us / 1000000.0
+        old, old_calls, old_ms = cycle(legacy_gpu_device_handler, names, options.repeats)
+        new, new_calls, new_ms = cycle(nvidia.gpu_device_handler, names, options.repeats)
+
+        print '%d GPUs  %3d metrics  legacy %4d calls %8.3f ms  sampler %4d calls %8.3f ms  (%.1fx)%s' % \
+            (count, len(names), old_calls, old_ms, new_calls, new_ms, old_ms / max(new_ms, 0.001),
+             old != new and '  MISMATCH' or '')
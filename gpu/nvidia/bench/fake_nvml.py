@@ -0,0 +1,157 @@
+#  Stand-in for pynvml, for running nvidia.py and bench_sampler.py on a
+#  machine without an NVIDIA GPU or driver. Install it before importing
+#  nvidia:
+#
+#    import sys, fake_nvml
+#    sys.modules['pynvml'] = fake_nvml
+#
+#  It has DEVICE_COUNT GPUs, the first one without a fan. Every NVML call is
+#  counted in CALLS and takes CALL_COST seconds, NVML calls into the driver
+#  and are nowhere near free.
+
+import time
+
+DEVICE_COUNT = 8
+CALL_COST = 0.0
+CALLS = 0
+
+NVML_SUCCESS = 0
+NVML_ERROR_NOT_SUPPORTED = 3
+NVML_FEATURE_DISABLED = 0
+NVML_FEATURE_ENABLED = 1
+NVML_TEMPERATURE_GPU = 0
+NVML_CLOCK_GRAPHICS = 0
+NVML_CLOCK_SM = 1
+NVML_CLOCK_MEM = 2
+
+
+class NVMLError(Exception):
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return 'fake NVML error %d' % self.value
+
+
+class Struct(object):
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def call(func):
+    def counted(*args):
+        global CALLS
+        CALLS += 1
+        if CALL_COST:
+            time.sleep(CALL_COST)
+        return func(*args)
+    return counted
+
+
+@call
+def nvmlInit():
+    pass
+
+@call
+def nvmlShutdown():
+    pass
+
+@call
+def nvmlSystemGetDriverVersion():
+    return '340.29'
+
+@call
+def nvmlDeviceGetCount():
+    return DEVICE_COUNT
+
+@call
+def nvmlDeviceGetHandleByIndex(index):
+    if index >= DEVICE_COUNT:
+        raise NVMLError(2)
+    return index
+
+@call
+def nvmlDeviceGetName(handle):
+    return 'Tesla K40m'
+
+@call
+def nvmlDeviceGetUUID(handle):
+    return 'GPU-5d9a43c1-8f2e-7b6a-21c4-0000000000%02d' % handle
+
+@call
+def nvmlDeviceGetSerial(handle):
+    return '03231140%05d' % handle
+
+@call
+def nvmlDeviceGetPciInfo(handle):
+    return Struct(pciDeviceId=0x102310de, busId='0000:%02x:00.0' % (handle + 2))
+
+@call
+def nvmlDeviceGetMemoryInfo(handle):
+    return Struct(total=12079595520, used=(1 + handle) * 1048576 * 100, free=0)
+
+@call
+def nvmlDeviceGetBAR1MemoryInfo(handle):
+    return Struct(bar1Total=268435456, bar1Used=(2 + handle) * 1000000, bar1Free=0)
+
+@call
+def nvmlDeviceGetUtilizationRates(handle):
+    return Struct(gpu=50 + handle, memory=20 + handle)
+
+@call
+def nvmlDeviceGetFanSpeed(handle):
+    if handle == 0:
+        raise NVMLError(NVML_ERROR_NOT_SUPPORTED)
+    return 30 + handle
+
+@call
+def nvmlDeviceGetTemperature(handle, sensor):
+    return 40 + handle
+
+@call
+def nvmlDeviceGetTemperatureThreshold(handle, threshold):
+    return (95, 90)[threshold]
+
+@call
+def nvmlDeviceGetPendingEccMode(handle):
+    return NVML_FEATURE_ENABLED
+
+@call
+def nvmlDeviceGetPerformanceState(handle):
+    return 0
+
+@call
+def nvmlDeviceGetClockInfo(handle, type):
+    return (745, 745, 3004)[type]
+
+@call
+def nvmlDeviceGetMaxClockInfo(handle, type):
+    return (875, 875, 3004)[type]
+
+@call
+def nvmlDeviceGetPowerUsage(handle):
+    return 62000 + handle * 1000
+
+@call
+def nvmlDeviceGetPowerManagementMode(handle):
+    return NVML_FEATURE_ENABLED
+
+@call
+def nvmlDeviceGetPowerManagementLimit(handle):
+    return 235000
+
+@call
+def nvmlDeviceGetTotalEccErrors(handle, bitType, counterType):
+    return bitType * 2 + handle
+
+@call
+def nvmlDeviceGetEncoderUtilization(handle):
+    return [0, 167000]
+
+@call
+def nvmlDeviceGetDecoderUtilization(handle):
+    return [0, 167000]
+
+@call
+def nvmlDeviceGetViolationStatus(handle, perfPolicyType):
+    return Struct(referenceTime=0, violationTime=0)
@@ -34,6 +34,16 @@ device = 0
 eventSet = 0
 violation_dur = [0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0]
 
+# All metrics of all GPUs are read together, once every sample_interval
+# seconds, through device handles opened at metric_init
+sample_interval = 5
+handles = []
+static_values = []
+samples = []
+sample_time = 0
+sampled_metrics = None
+driver_version = None
+
 '''Return the descriptor based on the name'''
 def find_descriptor(name):
     for d in descriptors:
@@ -67,132 +77,151 @@ def get_gpu_num():
     return int(nvmlDeviceGetCount())
 
 def gpu_num_handler(name):
-    return get_gpu_num()
+    return len(handles)
 
 def gpu_driver_version_handler(name):
-    return nvmlSystemGetDriverVersion()
+    return driver_version
 
-def gpu_get_device_by_name(name):
-    d = find_descriptor(name)
-    (gpu, metric) = name.split('_', 1)
-    gpu_id = int(gpu.split('gpu')[1])
-    gpu_device = nvmlDeviceGetHandleByIndex(gpu_id)
-    return gpu_device
+'''Values of a GPU that do not change while it is in use, read once'''
+def read_static(gpu_id, handle):
+    return {
+        'type': lambda: nvmlDeviceGetName(handle),
+        'uuid': lambda: nvmlDeviceGetUUID(handle),
+        'pci_id': lambda: nvmlDeviceGetPciInfo(handle).pciDeviceId,
+        'serial': lambda: nvmlDeviceGetSerial(handle),
+        'mem_total': lambda: int(nvmlDeviceGetMemoryInfo(handle).total/(1024*1024)),
+        'max_graphics_clock': lambda: nvmlDeviceGetMaxClockInfo(handle, NVML_CLOCK_GRAPHICS),
+        'max_sm_clock': lambda: nvmlDeviceGetMaxClockInfo(handle, NVML_CLOCK_SM),
+        'max_mem_clock': lambda: nvmlDeviceGetMaxClockInfo(handle, NVML_CLOCK_MEM),
+        'bar1_max_memory': lambda: int(nvmlDeviceGetBAR1MemoryInfo(handle).bar1Total/1000000),
+        'shutdown_temp': lambda: nvmlDeviceGetTemperatureThreshold(handle,0),
+        'slowdown_temp': lambda: nvmlDeviceGetTemperatureThreshold(handle,1),
+    }
+
+def read_fan(gpu_id, handle):
+    try:
+        return (nvmlDeviceGetFanSpeed(handle),)
+    except NVMLError, nvmlError:
+        # Not all GPUs have fans - a fatal error would not be appropriate
+        if NVML_ERROR_NOT_SUPPORTED == nvmlError.value:
+            return (0,)
+        raise
+
+def read_ecc_mode(gpu_id, handle):
+    try:
+        ecc_mode = nvmlDeviceGetPendingEccMode(handle)
+        if (NVML_FEATURE_DISABLED == ecc_mode):
+            return ("OFF",)
+        elif (NVML_FEATURE_ENABLED == ecc_mode):
+            return ("ON",)
+        else:
+            return ("UNKNOWN",)
+    except NVMLError, nvmlError:
+        if NVML_ERROR_NOT_SUPPORTED == nvmlError.value:
+            return ('N/A',)
+        raise
+
+def read_perf_state(gpu_id, handle):
+    state = nvmlDeviceGetPerformanceState(handle)
+    try:
+        int(state)
+        state = "P%s" % state
+    except ValueError:
+        pass
+    return (state, state)
+
+def read_power_man_mode(gpu_id, handle):
+    pow_man_mode = nvmlDeviceGetPowerManagementMode(handle)
+    if (NVML_FEATURE_DISABLED == pow_man_mode):
+        return ("OFF",)
+    elif (NVML_FEATURE_ENABLED == pow_man_mode):
+        return ("ON",)
+    else:
+        return ("UNKNOWN",)
+
+def read_power_violation(gpu_id, handle):
+    violationData = nvmlDeviceGetViolationStatus(handle, 0)
+    newTime = violationData.violationTime
+
+    if (violation_dur[gpu_id] == 0):
+        violation_dur[gpu_id] = newTime
+
+    diff = newTime - violation_dur[gpu_id]
+    # % calculation (diff/10)*100/10^9
+    rate = diff / 100000000
+    violation_dur[gpu_id] = newTime
+    return (rate,)
+
+'''Metrics read on every sample, with the NVML call (or calls) that reads them'''
+SAMPLE_READERS = [
+    (('temp',), lambda gpu_id, h: (nvmlDeviceGetTemperature(h, NVML_TEMPERATURE_GPU),)),
+    (('fb_memory',), lambda gpu_id, h: (int(nvmlDeviceGetMemoryInfo(h).used/1048576),)),
+    (('util', 'mem_util'), lambda gpu_id, h: (lambda u: (u.gpu, u.memory))(nvmlDeviceGetUtilizationRates(h))),
+    (('fan',), read_fan),
+    (('ecc_mode',), read_ecc_mode),
+    (('perf_state', 'performance_state'), read_perf_state),
+    (('graphics_clock_report',), lambda gpu_id, h: (nvmlDeviceGetClockInfo(h, NVML_CLOCK_GRAPHICS),)),
+    (('sm_clock_report',), lambda gpu_id, h: (nvmlDeviceGetClockInfo(h, NVML_CLOCK_SM),)),
+    (('mem_clock_report',), lambda gpu_id, h: (nvmlDeviceGetClockInfo(h, NVML_CLOCK_MEM),)),
+    (('power_usage_report',), lambda gpu_id, h: (nvmlDeviceGetPowerUsage(h)/1000,)),
+    (('power_man_mode',), read_power_man_mode),
+    (('power_man_limit',), lambda gpu_id, h: (nvmlDeviceGetPowerManagementLimit(h)/1000,)),
+    (('ecc_db_error',), lambda gpu_id, h: (nvmlDeviceGetTotalEccErrors(h, 1, 1),)),
+    (('ecc_sb_error',), lambda gpu_id, h: (nvmlDeviceGetTotalEccErrors(h, 0, 1),)),
+    (('bar1_memory',), lambda gpu_id, h: (int(nvmlDeviceGetBAR1MemoryInfo(h).bar1Used/1000000),)),
+    (('encoder_util',), lambda gpu_id, h: (int(nvmlDeviceGetEncoderUtilization(h)[0]),)),
+    (('decoder_util',), lambda gpu_id, h: (int(nvmlDeviceGetDecoderUtilization(h)[0]),)),
+    (('power_violation_report',), read_power_violation),
+]
+
+'''Read every metric of a GPU into a dict, a metric that could not be read
+holds the error instead, for gpu_device_handler to raise'''
+def sample_gpu(gpu_id):
+    handle = handles[gpu_id]
+    if static_values[gpu_id] is None:
+        values = {}
+        for (metric, reader) in read_static(gpu_id, handle).items():
+            try:
+                values[metric] = reader()
+            except (NVMLError, NameError), err:
+                values[metric] = err
+        static_values[gpu_id] = values
+
+    sample = dict(static_values[gpu_id])
+    for (metrics, reader) in SAMPLE_READERS:
+        # once the descriptors are built only the metrics they use are read
+        if sampled_metrics is not None and sampled_metrics.isdisjoint(metrics):
+            continue
+        try:
+            values = reader(gpu_id, handle)
+        except (NVMLError, NameError), err:
+            values = [err] * len(metrics)
+        sample.update(zip(metrics, values))
+    return sample
+
+'''Sample all GPUs, at most once every sample_interval seconds'''
+def sample_gpus():
+    global samples, sample_time
+    if time.time() - sample_time > sample_interval:
+        samples = [sample_gpu(i) for i in range(len(handles))]
+        sample_time = time.time()
+    return samples
 
 def gpu_device_handler(name):
-    global violation_dur, violation_rate
     (gpu, metric) = name.split('_', 1)
     gpu_id = int(gpu.split('gpu')[1])
-    gpu_device = gpu_get_device_by_name(name)
-
-    if (metric == 'type'):
-        return nvmlDeviceGetName(gpu_device)
-    elif (metric == 'uuid'):
-        return nvmlDeviceGetUUID(gpu_device)
-    elif (metric == 'pci_id'):
-        return nvmlDeviceGetPciInfo(gpu_device).pciDeviceId
-    elif (metric == 'temp'):
-        return nvmlDeviceGetTemperature(gpu_device, NVML_TEMPERATURE_GPU)
-    elif (metric == 'mem_total'):
-        return int(nvmlDeviceGetMemoryInfo(gpu_device).total/(1024*1024))
-    elif (metric == 'fb_memory'):
-        return int(nvmlDeviceGetMemoryInfo(gpu_device).used/1048576)
-    elif (metric == 'util'):
-        return nvmlDeviceGetUtilizationRates(gpu_device).gpu
-    elif (metric == 'mem_util'):
-        return nvmlDeviceGetUtilizationRates(gpu_device).memory
-    elif (metric == 'fan'):
-        try:
-            return nvmlDeviceGetFanSpeed(gpu_device)
-        except NVMLError, nvmlError:
-            # Not all GPUs have fans - a fatal error would not be appropriate
-            if NVML_ERROR_NOT_SUPPORTED == nvmlError.value:
-                return 0
-    elif (metric == 'ecc_mode'):
-        try:
-            ecc_mode = nvmlDeviceGetPendingEccMode(gpu_device)
-            if (NVML_FEATURE_DISABLED == ecc_mode):
-                return "OFF"
-            elif (NVML_FEATURE_ENABLED == ecc_mode):
-                return "ON"
-            else:
-                return "UNKNOWN"
-        except NVMLError, nvmlError:
-            if NVML_ERROR_NOT_SUPPORTED == nvmlError.value:
-                return 'N/A'
-    elif (metric == 'perf_state' or metric == 'performance_state'):
-        state = nvmlDeviceGetPerformanceState(gpu_device)
-        try:
-            int(state)
-            return "P%s" % state
-        except ValueError:
-            return state
-    elif (metric == 'graphics_clock_report'):
-        return nvmlDeviceGetClockInfo(gpu_device, NVML_CLOCK_GRAPHICS)
-    elif (metric == 'sm_clock_report'):
-        return nvmlDeviceGetClockInfo(gpu_device, NVML_CLOCK_SM)
-    elif (metric == 'mem_clock_report'):
-        return nvmlDeviceGetClockInfo(gpu_device, NVML_CLOCK_MEM)
-    elif (metric == 'max_graphics_clock'):
-        return nvmlDeviceGetMaxClockInfo(gpu_device, NVML_CLOCK_GRAPHICS)
-    elif (metric == 'max_sm_clock'):
-        return nvmlDeviceGetMaxClockInfo(gpu_device, NVML_CLOCK_SM)
-    elif (metric == 'max_mem_clock'):
-        return nvmlDeviceGetMaxClockInfo(gpu_device, NVML_CLOCK_MEM)
-    elif (metric == 'power_usage_report'):
-        return nvmlDeviceGetPowerUsage(gpu_device)/1000
-    elif (metric == 'serial'):
-        return nvmlDeviceGetSerial(gpu_device)
-    elif (metric == 'power_man_mode'):
-        pow_man_mode = nvmlDeviceGetPowerManagementMode(gpu_device)
-        if (NVML_FEATURE_DISABLED == pow_man_mode):
-           return "OFF"
-        elif (NVML_FEATURE_ENABLED == pow_man_mode):
-           return "ON"
-        else:
-            return "UNKNOWN"
-    elif (metric == 'power_man_limit'):
-        powerLimit = nvmlDeviceGetPowerManagementLimit(gpu_device)
-        return powerLimit/1000
-    elif (metric == 'ecc_db_error'):
-        eccCount =  nvmlDeviceGetTotalEccErrors(gpu_device, 1, 1) 
-        return eccCount
-    elif (metric == 'ecc_sb_error'):
-        eccCount =  nvmlDeviceGetTotalEccErrors(gpu_device, 0, 1)
-        return eccCount
-    elif (metric == 'bar1_memory'):
-	memory =  nvmlDeviceGetBAR1MemoryInfo(gpu_device)
-        return int(memory.bar1Used/1000000)
-    elif (metric == 'bar1_max_memory'):
-        memory =  nvmlDeviceGetBAR1MemoryInfo(gpu_device)
-        return int(memory.bar1Total/1000000)
-    elif (metric == 'shutdown_temp'):
-        return nvmlDeviceGetTemperatureThreshold(gpu_device,0)
-    elif (metric == 'slowdown_temp'):
-        return nvmlDeviceGetTemperatureThreshold(gpu_device,1)
-    elif (metric == 'encoder_util'):
-        return int(nvmlDeviceGetEncoderUtilization(gpu_device)[0])
-    elif (metric == 'decoder_util'):
-        return int(nvmlDeviceGetDecoderUtilization(gpu_device)[0])
-    elif (metric == 'power_violation_report'):
-       violationData = nvmlDeviceGetViolationStatus(gpu_device, 0)
-       newTime = violationData.violationTime
-       
-       if (violation_dur[gpu_id] == 0):
-          violation_dur[gpu_id] = newTime
-      
-       diff = newTime - violation_dur[gpu_id]
-       # % calculation (diff/10)*100/10^9
-       rate = diff / 100000000
-       violation_dur[gpu_id] = newTime
-       print rate
-       return rate
-    else:
+    sample = sample_gpus()[gpu_id]
+
+    if metric not in sample:
         print "Handler for %s not implemented, please fix in gpu_device_handler()" % metric
         os._exit(1)
+    value = sample[metric]
+    if isinstance(value, Exception):
+        raise value
+    return value
 
 def metric_init(params):
-    global descriptors
+    global descriptors, sample_interval, handles, static_values, sample_time, sampled_metrics, driver_version
 
     try:
         nvmlInit()
@@ -202,11 +231,17 @@ def metric_init(params):
         os._exit(1)
 
     default_time_max = 90
+    sample_interval = float(params.get('sample_interval', sample_interval))
+    handles = [nvmlDeviceGetHandleByIndex(i) for i in range(get_gpu_num())]
+    static_values = [None] * len(handles)
+    sample_time = 0
+    sampled_metrics = None
+    driver_version = nvmlSystemGetDriverVersion()
 
     build_descriptor('gpu_num', gpu_num_handler, default_time_max, 'uint', 'GPUs', 'zero', '%u', 'Total number of GPUs', 'gpu')
     build_descriptor('gpu_driver', gpu_driver_version_handler, default_time_max, 'string', '', 'zero', '%s', 'GPU Driver Version', 'gpu')
 
-    for i in range(get_gpu_num()):
+    for i in range(len(handles)):
         build_descriptor('gpu%s_type' % i, gpu_device_handler, default_time_max, 'string', '', 'zero', '%s', 'GPU%s Type' % i, 'gpu')
         build_descriptor('gpu%s_graphics_clock_report' % i, gpu_device_handler, default_time_max, 'uint', 'MHz', 'both', '%u', 'GPU%s Graphics Clock' % i, 'gpu')
         build_descriptor('gpu%s_sm_clock_report' % i, gpu_device_handler, default_time_max, 'uint', 'MHz', 'both', '%u', 'GPU%s SM Clock' % i, 'gpu')
@@ -241,6 +276,8 @@ def metric_init(params):
         build_descriptor('gpu%s_slowdown_temp' % i, gpu_device_handler, default_time_max, 'uint', 'C', 'zero', '%u', 'GPU%s Type' % i, 'gpu')
         build_descriptor('gpu%s_encoder_util' % i, gpu_device_handler, default_time_max, 'uint', '%', 'both', '%u', 'GPU%s Type' % i, 'gpu')
         build_descriptor('gpu%s_decoder_util' % i, gpu_device_handler, default_time_max, 'uint', '%', 'both', '%u', 'GPU%s Type' % i, 'gpu')
+
+    sampled_metrics = set([d['name'].split('_', 1)[1] for d in descriptors if d['call_back'] == gpu_device_handler])
     return descriptors
 
 def metric_cleanup():
@@ -29,13 +29,20 @@
 ###       * Code cleanup
 ###       * Removed CPU utilization
 ###
+###    v1.2.0 - 2026-10-18
+###       * Poll mod_status from a background thread, callbacks only read
+###         the last complete result
+###       * Add timeout for the status page request
+###       * Add httpd_stats_age metric
+###
 
 ###  Copyright Jamie Isaacs. 2010
 ###  License to use, modify, and distribute under the GPL
 ###  http://www.gnu.org/licenses/gpl.txt
 
 import time
-import urllib
+import threading
+import urllib2
 import subprocess
 import traceback
 
@@ -52,29 +59,61 @@ last_update_server = 0
 httpd_stats = {}
 httpd_stats_last = {}
 server_stats = {}
+_Worker_Thread = None
 
-MAX_UPDATE_TIME = 15
+REFRESH_RATE = 15
+TIMEOUT = 10
 
 #SCOREBOARD_KEY = ('_', 'S', 'R', 'W', 'K', 'D', 'C', 'L', 'G', 'I', '.')
 
+class UpdateHttpdThread(threading.Thread):
+	'''Refreshes httpd_stats and server_stats every refresh_rate seconds so
+	the metric callbacks never wait on Apache or ps'''
+
+	def __init__(self, refresh_rate):
+		threading.Thread.__init__(self)
+		self.running = False
+		self.shuttingdown = False
+		self.refresh_rate = refresh_rate
+		self.started = time.time()
+		self._wakeup = threading.Event()
+
+	def shutdown(self):
+		self.shuttingdown = True
+		self._wakeup.set()
+		if not self.running:
+			return
+		self.join()
+
+	def run(self):
+		self.running = True
+
+		while not self.shuttingdown:
+			self._wakeup.wait(self.refresh_rate)
+			if not self.shuttingdown:
+				self.refresh_stats()
+
+		self.running = False
+
+	def refresh_stats(self):
+		if update_stats():
+			update_server_stats()
+
+	def stats_age(self):
+		return time.time() - (last_update or self.started)
+
 def update_stats():
 	logging.debug('updating stats')
 	global last_update, httpd_stats, httpd_stats_last
-	
-	cur_time = time.time()
-
-	if cur_time - last_update < MAX_UPDATE_TIME:
-		logging.debug(' wait ' + str(int(MAX_UPDATE_TIME - (cur_time - last_update))) + ' seconds')
-		return True
-	else:
-		last_update = cur_time
 
 	#####
 	# Update Apache stats
+	# Built in a separate dict and swapped in at the end, the callbacks
+	# keep reading the previous stats until then
+	stats = {}
 	try:
-		httpd_stats = {}
 		logging.debug(' opening URL: ' + str(STATUS_URL))
-		f = urllib.urlopen(STATUS_URL, None, 2)
+		f = urllib2.urlopen(STATUS_URL, None, TIMEOUT)
 
 		for line in f.readlines():
 			diff = False
@@ -111,13 +150,13 @@ def update_stats():
 				if diff:
 					# Do we have an old value to calculate the delta?
 					if key in httpd_stats_last:
-						httpd_stats[key] = val - httpd_stats_last[key]
+						stats[key] = val - httpd_stats_last[key]
 					else:
-						httpd_stats[key] = 0
+						stats[key] = 0
 
 					httpd_stats_last[key] = val
 				else:
-					httpd_stats[key] = val
+					stats[key] = val
 
 		f.close()
 	except:
@@ -125,7 +164,7 @@ def update_stats():
 		logging.warning(traceback.print_exc(file=sys.stdout))
 		return False
 
-	if not httpd_stats:
+	if not stats:
 		logging.warning('error refreshing stats')
 		return False
 
@@ -138,11 +177,14 @@ def update_stats():
 		out, err = p.communicate()
 		logging.debug('  result: ' + out)
 
-		httpd_stats['avg_worker_size'] = int(out)
+		stats['avg_worker_size'] = int(out)
 	except:
 		logging.warning('error refreshing stats (avg_worker_size)')
 		return False
 
+	httpd_stats = stats
+	last_update = time.time()
+
 	logging.debug('success refreshing stats')
 	logging.debug('httpd_stats: ' + str(httpd_stats))
 
@@ -236,44 +278,38 @@ def update_server_stats():
 def get_stat(name):
 	logging.debug('getting stat: ' + name)
 
-	ret = update_stats()
-
-	if ret:
-		if name.startswith('httpd_'):
-			label = name[6:]
-		else:
-			label = name
-
-		try:
-			return httpd_stats[label]
-		except:
-			logging.warning('failed to fetch ' + name)
-			return 0
+	if name.startswith('httpd_'):
+		label = name[6:]
 	else:
+		label = name
+
+	try:
+		return httpd_stats[label]
+	except:
+		logging.warning('failed to fetch ' + name)
 		return 0
 
 def get_server_stat(name):
 	logging.debug('getting server stat: ' + name)
 
-	ret = update_server_stats()
-
-	if ret:
-		if name.startswith('httpd_'):
-			label = name[6:]
-		else:
-			label = name
-
-		try:
-			return server_stats[label]
-		except:
-			logging.warning('failed to fetch: ' + name)
-			return 0
+	if name.startswith('httpd_'):
+		label = name[6:]
 	else:
+		label = name
+
+	try:
+		return server_stats[label]
+	except:
+		logging.warning('failed to fetch: ' + name)
 		return 0
 
+def get_stats_age(name):
+	return _Worker_Thread.stats_age()
+
 def metric_init(params):
-	global descriptors
+	global descriptors, _Worker_Thread
 
+	global REFRESH_RATE, TIMEOUT
 	global STATUS_URL, APACHE_CONF, APACHE_CTL, APACHE_BIN, APACHE_USER
 	global REPORT_EXTENDED, REPORT_PREFORK
 
@@ -284,6 +320,8 @@ def metric_init(params):
 	APACHE_USER	= params.get('apache_user')
 	REPORT_EXTENDED = str(params.get('get_extended', True)) == 'True'
 	REPORT_PREFORK	 = str(params.get('get_prefork', True)) == 'True'
+	REFRESH_RATE	= int(params.get('refresh_rate', REFRESH_RATE))
+	TIMEOUT		= float(params.get('timeout', TIMEOUT))
 
 	logging.debug('init: ' + str(params))
 
@@ -360,8 +398,11 @@ def metric_init(params):
 				'slope': 'zero',
 				'description': 'The maximum number of requests that an individual child server will handle during its life'}
 
-	update_stats()
-	update_server_stats()
+	# First refresh is done here to find out which stats are available,
+	# the rest happen in the background
+	_Worker_Thread = UpdateHttpdThread(REFRESH_RATE)
+	_Worker_Thread.refresh_stats()
+	_Worker_Thread.start()
 
 	for label in descriptions:
 		if httpd_stats.has_key(label):
@@ -398,11 +439,25 @@ def metric_init(params):
 		d.update(descriptions[label])
 		descriptors.append(d)
 
+	descriptors.append({
+		'name': 'httpd_stats_age',
+		'call_back': get_stats_age,
+		'time_max': time_max,
+		'value_type': 'float',
+		'units': 'seconds',
+		'slope': 'both',
+		'format': '%.1f',
+		'description': 'Seconds since the stats were last refreshed',
+		'groups': 'httpd'
+	})
+
 	#logging.debug('descriptors: ' + str(descriptors))
 
 	return descriptors
 
 def metric_cleanup():
+	if _Worker_Thread is not None:
+		_Worker_Thread.shutdown()
 	logging.shutdown()
 	# pass
 
@@ -451,3 +506,5 @@ if __name__ == '__main__':
 				(options.gmetric_bin, options.gmond_conf, v, d['units'], value_type, d['name'], d['slope'])
 			os.system(cmd)
 
+	metric_cleanup()
+
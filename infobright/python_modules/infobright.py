@@ -26,6 +26,10 @@ THE SOFTWARE.
 ###    v1.0.0 - 2012-05-18
 ###       * Brighthouse columnar database "Infobright" module, derived from mysqld module
 ###
+###    v1.0.1 - 2026-10-18
+###       * Keep one connection open across updates, reconnect when it drops
+###       * Refresh SHOW VARIABLES only every variables_refresh seconds
+###
 
 ###  Requires:
 ###       * yum install Infobright-python
@@ -55,13 +59,59 @@ REPORT_MASTER = True
 REPORT_SLAVE  = True
 
 MAX_UPDATE_TIME = 15
+# SHOW VARIABLES rarely changes, so it is refreshed much less often than status
+VARIABLES_UPDATE_TIME = 300
+
+infobright_conn = None
+variables = {}
+variables_last_update = 0
+
+def get_connection():
+	"""
+	Return the long-lived connection, opening it if needed.
+
+	The gmetric-infobright lock is taken once per connection and held until it
+	closes, instead of a GET_LOCK/RELEASE_LOCK round-trip every update.
+	Returns None if another collector holds the lock.
+	"""
+	global infobright_conn, variables_last_update
+
+	if infobright_conn is None:
+		conn = MySQLdb.connect(**infobright_conn_opts)
+		conn.autocommit(True)
+
+		cursor = conn.cursor(MySQLdb.cursors.DictCursor)
+		cursor.execute("SELECT GET_LOCK('gmetric-infobright', 0) as ok")
+		lock_stat = cursor.fetchone()
+		cursor.close()
+
+		if lock_stat['ok'] == 0:
+			conn.close()
+			return None
+
+		infobright_conn = conn
+		# the server may have been restarted with different settings
+		variables_last_update = 0
+
+	return infobright_conn
+
+def close_connection():
+	global infobright_conn
+
+	if infobright_conn is not None:
+		try:
+			infobright_conn.close()
+		except MySQLdb.Error:
+			pass
+		infobright_conn = None
+
 
 def update_stats(get_brighthouse=True, get_brighthouse_engine=True, get_master=True, get_slave=True):
 	"""
 
 	"""
 	logging.debug('updating stats')
-	global last_update
+	global last_update, variables, variables_last_update
 	global infobright_stats, infobright_stats_last
 
 	cur_time = time.time()
@@ -80,25 +130,23 @@ def update_stats(get_brighthouse=True, get_brighthouse_engine=True, get_master=T
 	infobright_stats = {}
 
 	# Get info from DB
+	reused = infobright_conn is not None
 	try:
-		conn = MySQLdb.connect(**infobright_conn_opts)
-
-		cursor = conn.cursor(MySQLdb.cursors.DictCursor)
-		cursor.execute("SELECT GET_LOCK('gmetric-infobright', 0) as ok")
-		lock_stat = cursor.fetchone()
-		cursor.close()
-
-		if lock_stat['ok'] == 0:
+		conn = get_connection()
+		if conn is None:
 			return False
 
 		# infobright variables have 'brighthouse_ib_' or 'brighthouse_ini_' prefix
-		cursor = conn.cursor(MySQLdb.cursors.Cursor)
-		cursor.execute("SHOW VARIABLES")
-		#variables = dict(((k.lower(), v) for (k,v) in cursor))
-		variables = {}
-		for (k,v) in cursor:
-			variables[k.lower()] = v
-		cursor.close()
+		if cur_time - variables_last_update >= VARIABLES_UPDATE_TIME:
+			cursor = conn.cursor(MySQLdb.cursors.Cursor)
+			cursor.execute("SHOW VARIABLES")
+			#variables = dict(((k.lower(), v) for (k,v) in cursor))
+			variables = {}
+			for (k,v) in cursor:
+				variables[k.lower()] = v
+			cursor.close()
+
+			variables_last_update = cur_time
 
 		# infobright status values have 'bh_gdc_' or 'bh_mm_' prefix
 		cursor = conn.cursor(MySQLdb.cursors.Cursor)
@@ -138,14 +186,16 @@ def update_stats(get_brighthouse=True, get_brighthouse_engine=True, get_master=T
 				get_slave = False
 			cursor.close()
 
-		cursor = conn.cursor(MySQLdb.cursors.DictCursor)
-		cursor.execute("SELECT RELEASE_LOCK('gmetric-infobright') as ok")
-		cursor.close()
-
-		conn.close()
 	except MySQLdb.OperationalError, (errno, errmsg):
 		logging.error('error updating stats')
 		logging.error(errmsg)
+		close_connection()
+
+		# server has gone away / lost connection: the idle session was
+		# dropped, so reconnect once right away instead of skipping a cycle
+		if reused and errno in (2006, 2013):
+			last_update = cur_time - time_delta
+			return update_stats(get_brighthouse, get_brighthouse_engine, get_master, get_slave)
 		return False
 
 	# process variables
@@ -360,6 +410,7 @@ def get_stat(name):
 def metric_init(params):
 	global descriptors
 	global infobright_conn_opts
+	global VARIABLES_UPDATE_TIME
 	global infobright_stats
 	global delta_per_second
 
@@ -390,6 +441,9 @@ def metric_init(params):
 	if params.get("delta_per_second", '') != '':
 		delta_per_second = True
 
+	if params.get('variables_refresh', '') != '':
+		VARIABLES_UPDATE_TIME = int(params.get('variables_refresh'))
+
 	mysql_stats_descriptions = {}
 	master_stats_descriptions = {}
  	brighthouse_stats_descriptions = {}
@@ -1073,6 +1127,7 @@ def metric_init(params):
 	return descriptors
 
 def metric_cleanup():
+	close_connection()
 	logging.shutdown()
 	# pass
 
@@ -1,9 +1,12 @@
 import sys
+import os
 import re
 import time
 import copy
+import select
 import string
 import subprocess
+import threading
 
 METRICS = {
     'time' : 0,
@@ -14,55 +17,177 @@ METRICS_CACHE_MAX = 5
 
 stats_pos = {} 
 
-def get_metrics(params):
+PARAMS = {}
+
+# BMCs to poll, one dict each: its ip, the ipmitool command line, the shell
+# kept open to it and the sensor ids mapped to metric names
+BMCS = []
+
+# Seconds a BMC gets to answer one command, and to list all its sensors
+IPMI_TIMEOUT = 3
+LIST_TIMEOUT = 30
+
+class IpmitoolShell(object):
+    """An 'ipmitool shell' kept running, so that each poll is one command on
+    an open session instead of a new ipmitool process and session"""
+
+    PROMPT = 'ipmitool> '
+
+    def __init__(self, command, timeout):
+        self.command = command
+        self.timeout = timeout
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen(self.command + ['shell'],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT,
+                                        close_fds=True)
+        self.read_until_prompt(time.time() + self.timeout)
+
+    def read_until_prompt(self, deadline):
+        output = ''
+        fd = self.process.stdout.fileno()
+        while not output.endswith(self.PROMPT):
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                raise IOError('no answer from %s within %s seconds' % (self.command[2], self.timeout))
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                raise IOError('ipmitool shell for %s exited' % self.command[2])
+            output += chunk
+        return output[:-len(self.PROMPT)]
+
+    def run(self, line, timeout=None):
+        """Run one command, restarting the shell if it is not running. A
+        shell that fails or times out is killed, the next run starts over."""
+        try:
+            if self.process is None or self.process.poll() is not None:
+                self.start()
+            self.process.stdin.write(line + '\n')
+            self.process.stdin.flush()
+            return self.read_until_prompt(time.time() + (timeout or self.timeout))
+        except (IOError, OSError):
+            self.close()
+            raise
+
+    def close(self):
+        if self.process is not None:
+            try:
+                self.process.kill()
+                self.process.wait()
+            except OSError:
+                pass
+            self.process = None
+
+def parse_value(value):
+    """Return the float in an ipmitool sensor value, None for missing sensors"""
+
+    # Skip missing sensors
+    if re.search("(0x)", value ) or value == 'na':
+        return None
+
+    # Extract out a float value
+    vmatch = re.search("([0-9.]+)", value)
+    if not vmatch:
+        return None
+    return float(vmatch.group(1))
+
+def metric_name(sensor):
+    return sensor.lower().replace("+", "").replace(" ", "_")
+
+def parse_sensor_list(output):
+    """Parse the output of 'ipmitool sensor' into {sensor id: (value, units)}"""
+
+    sensors = {}
+    for v in output.split("\n"):
+        data = v.split("|")
+        try:
+            metric_value = parse_value(data[1].strip())
+            if metric_value is None:
+                continue
+            sensors[data[0].strip()] = (metric_value, data[2].strip().replace("degrees C", "C"))
+        except ValueError:
+            continue
+        except IndexError:
+            continue
+
+    return sensors
+
+def parse_sensor_reading(output):
+    """Parse the output of 'ipmitool sensor reading <id>...' into {sensor id: value}"""
+
+    readings = {}
+    for v in output.split("\n"):
+        data = v.split("|")
+        if len(data) != 2:
+            continue
+        try:
+            metric_value = parse_value(data[1].strip())
+        except ValueError:
+            continue
+        if metric_value is not None:
+            readings[data[0].strip()] = metric_value
+
+    return readings
+
+def run_ipmitool(bmc, args, timeout=None):
+    """Run an ipmitool command against a BMC, through its shell in shell mode
+    or as a new process (under timeout_bin) otherwise"""
+
+    if bmc['shell'] is not None:
+        return bmc['shell'].run(' '.join(args), timeout)
+
+    command = [ PARAMS['timeout_bin'], str(timeout or IPMI_TIMEOUT) ] + bmc['command'] + args
+    return subprocess.Popen(command,
+                            stdout=subprocess.PIPE).communicate()[0][:-1]
+
+def poll_bmc(bmc, new_metrics):
+    """Read the sensors of one BMC into new_metrics"""
+
+    try:
+        if bmc['shell'] is not None:
+            # only the sensors there are metrics for
+            args = ['sensor', 'reading'] + ['"%s"' % sensor for sensor in sorted(bmc['sensors'])]
+            readings = parse_sensor_reading(run_ipmitool(bmc, args))
+            if bmc['sensors'] and not readings:
+                # most likely the session was dropped, start a new one
+                bmc['shell'].close()
+        else:
+            readings = dict([(sensor, value) for (sensor, (value, units))
+                             in parse_sensor_list(run_ipmitool(bmc, ['sensor'])).items()])
+    except (IOError, OSError), e:
+        print '[ipmi] polling %s failed: %s' % (bmc['ip'], e)
+        return
+
+    for sensor, name in bmc['sensors'].items():
+        if sensor in readings:
+            new_metrics[name] = readings[sensor]
+
+def get_metrics():
     """Return all metrics"""
 
     global METRICS
 
     if (time.time() - METRICS['time']) > METRICS_CACHE_MAX:
 
-	new_metrics = {}
-	units = {}
-
-	command = [ params['timeout_bin'],
-	"3", params['ipmitool_bin'],
-	"-H", params['ipmi_ip'],
-	"-U", params['username'],
-	'-P', params['password'],
-	'-L', params['level'],
-	'sensor']	
+        new_metrics = {}
 
-        p = subprocess.Popen(command,
-                             stdout=subprocess.PIPE).communicate()[0][:-1]
+        # every BMC is polled from its own thread, each command is bounded
+        # by IPMI_TIMEOUT so the threads can simply be waited for
+        threads = []
+        for bmc in BMCS:
+            thread = threading.Thread(target=poll_bmc, args=(bmc, new_metrics))
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
 
-        for i, v in enumerate(p.split("\n")):
-            data = v.split("|")
-            try:
-                metric_name = data[0].strip().lower().replace("+", "").replace(" ", "_")
-                value = data[1].strip()
-
-                # Skip missing sensors
-                if re.search("(0x)", value ) or value == 'na':
-                    continue
-
-                # Extract out a float value
-                vmatch = re.search("([0-9.]+)", value)
-                if not vmatch:
-                    continue
-                metric_value = float(vmatch.group(1))
-
-                new_metrics[metric_name] = metric_value
-                units[metric_name] = data[2].strip().replace("degrees C", "C")
-		
-            except ValueError:
-                continue
-            except IndexError:
-                continue
-		
-	METRICS = {
+        METRICS = {
             'time': time.time(),
             'data': new_metrics,
-            'units': units
         }
 
     return [METRICS]
@@ -75,8 +200,6 @@ def get_value(name):
 
 	metrics = get_metrics()[0]
 
-	name = name.lstrip('ipmi_')
-
 	result = metrics['data'][name]
 
     except Exception:
@@ -90,10 +213,58 @@ def create_desc(skel, prop):
         d[k] = v
     return d
 
+def add_bmc(params, ip, prefix, spoof_host=None):
+    """Set up polling of one BMC, returns its descriptors"""
+
+    command = [ params['ipmitool_bin'],
+                "-H", ip,
+                "-U", params['username'],
+                '-P', params['password'],
+                '-L', params['level'] ]
+
+    bmc = {
+        'ip': ip,
+        'command': command,
+        'shell': None,
+        'sensors': {},
+    }
+    if params.get('mode', 'shell') == 'shell':
+        bmc['shell'] = IpmitoolShell(command, IPMI_TIMEOUT)
+
+    # the full listing, once, tells which sensors there are and their units
+    try:
+        sensors = parse_sensor_list(run_ipmitool(bmc, ['sensor'], LIST_TIMEOUT))
+    except (IOError, OSError), e:
+        print '[ipmi] listing sensors of %s failed: %s' % (ip, e)
+        sensors = {}
+
+    wanted = [s.strip() for s in params.get('sensors', '').split(',') if s.strip()]
+
+    descriptors = []
+    for sensor, (value, units) in sensors.items():
+        if wanted and sensor not in wanted:
+            continue
+        name = prefix + "_" + metric_name(sensor)
+        bmc['sensors'][sensor] = name
+        desc = create_desc(Desc_Skel, {
+		"name"       	: name,
+		'groups'	: params['metric_prefix'],
+		'units'		: units
+		})
+        if spoof_host:
+            desc['spoof_host'] = spoof_host
+        descriptors.append(desc)
+
+    BMCS.append(bmc)
+    return descriptors
+
 def metric_init(params):
-    global descriptors, metric_map, Desc_Skel
+    global descriptors, metric_map, Desc_Skel, PARAMS, BMCS, IPMI_TIMEOUT
 
     descriptors = []
+    PARAMS = params
+    BMCS = []
+    IPMI_TIMEOUT = int(params.get('timeout', IPMI_TIMEOUT))
 
     Desc_Skel = {
         'name'        : 'XXX',
@@ -107,21 +278,25 @@ def metric_init(params):
         'groups'      : 'XXX',
         }
 
-    metrics = get_metrics(params)[0]
-    
-    for item in metrics['data']:
-	descriptors.append(create_desc(Desc_Skel, {
-		"name"       	: params['metric_prefix'] + "_" + item,
-		'groups'	: params['metric_prefix'],
-		'units'		: metrics['units'][item]
-		}))
+    # The BMC of this host
+    if params.get('ipmi_ip'):
+        descriptors += add_bmc(params, params['ipmi_ip'], params['metric_prefix'])
 
+    # Other hosts' BMCs, bmc_<n> = "<hostname>:<bmc ip>", reported as
+    # <metric_prefix>_<hostname>_<sensor> on the spoofed host
+    for para in sorted(params.keys()):
+        if para.startswith('bmc_'):
+            hostname, ip = params[para].split(':')
+            descriptors += add_bmc(params, ip, params['metric_prefix'] + "_" + hostname,
+                                   ip + ':' + hostname)
 
     return descriptors
 
 def metric_cleanup():
     '''Clean up the metric module.'''
-    pass
+    for bmc in BMCS:
+        if bmc['shell'] is not None:
+            bmc['shell'].close()
 
 #This code is for debugging and unit testing
 if __name__ == '__main__':
@@ -27,6 +27,13 @@
 ###
 ###    v1.0.5 - 2010-08-11
 ###      * Fixed bug with value resets
+###
+###    v1.1.0 - 2026-10-18
+###      * Keep one jmxsh running and connected between updates
+###        (jmxsh_session.py), instead of a JVM per update
+###      * A failing MBean no longer loses the metrics after it
+###      * Bulk mode: an ObjectName pattern, or an MBean without attribute,
+###        reads all attributes of the matching MBeans, one call per MBean
 
 ###  Copyright Jamie Isaacs. 2010
 ###  License to use, modify, and distribute under the GPL
@@ -37,6 +44,7 @@ import subprocess
 import traceback, sys, re
 import tempfile
 import logging
+from jmxsh_session import JmxshSession, JmxshError, get_command, bulk_command
 
 descriptors = []
 
@@ -50,6 +58,9 @@ last_val = {}
 
 METRICS = {}
 COMP = {}
+# name -> (pattern, attributes, key properties fixed by the pattern) of the
+# metrics read in bulk
+BULK = {}
 HOST = 'localhost'
 PORT = '8887'
 NAME = PORT
@@ -58,6 +69,10 @@ METRIC_GROUP = 'jmx'
 MAX_UPDATE_TIME = 15
 JMXSH = '/usr/share/java/jmxsh.jar'
 
+# seconds jmxsh gets to answer one update
+TIMEOUT = 30
+SESSION = None
+
 def get_numeric(val):
 	'''Try to return the numeric value of the string'''
 
@@ -81,6 +96,36 @@ def get_gmond_format(val):
 	else:
 		return ('string', '%u')
 
+def parse_bulk(mbean):
+	'''Return (pattern, attributes, fixed key properties) if the metric is to
+	be read in bulk: an ObjectName pattern, an MBean without attribute or
+	with several, comma separated. None for a single attribute.'''
+
+	val = mbean.split()
+	pattern = val[0]
+	attributes = []
+	if len(val) > 1:
+		attributes = val[1].split(',')
+	if len(attributes) == 1 and '*' not in pattern and '?' not in pattern:
+		return None
+
+	fixed = [p for p in pattern.split(':', 1)[-1].split(',') if '=' in p]
+	return (pattern, attributes, fixed)
+
+def bulk_name(key):
+	'''Metric name of a bulk value, keyed by name, key properties and
+	attribute path: the name, the key properties not in the pattern and the
+	attribute path'''
+
+	fields = key.split('\t')
+	name, properties, path = fields[0], fields[1], fields[2:]
+	fixed = BULK[name][2]
+	parts = [name]
+	for p in properties.split(','):
+		if p not in fixed:
+			parts.append(p.split('=', 1)[-1].strip('"'))
+	return re.sub(r'[^\w.-]', '_', '_'.join(parts + path))
+
 def update_stats():
 	logging.debug('updating stats')
 	global last_update, stats, last_val
@@ -92,33 +137,31 @@ def update_stats():
 		return True
 
 	#####
-	# Build jmxsh script into tmpfile
-	sh  = '# jmxsh\njmx_connect -h ' + HOST + ' -p ' + PORT + '\n'
+	# One script for all metrics, run by the jmxsh kept connected
+	sh = []
 	for name,mbean in METRICS.items():
-		sh += 'puts "' + name + ': [jmx_get -m ' + mbean + ']"\n'
+		if name in BULK:
+			sh.append(bulk_command(name, BULK[name][0], BULK[name][1]))
+		else:
+			sh.append(get_command(name, mbean))
 
-	#logging.debug(sh)
-	
 	try:
-		# run jmxsh.jar with the temp file as a script
-		cmd = "java -jar " + JMXSH + " -q"
-		p = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-		out, err = p.communicate(sh)
-		#logging.debug('cmd: ' + cmd + '\nout: ' + out + '\nerr: ' + err + '\ncode: ' + str(p.returncode))
-
-		if p.returncode:
-			logging.warning('failed executing jmxsh\n' + cmd + '\n' + err)
-			return False
-	except:
-		logging.warning('Error running jmx java\n' + traceback.print_exc(file=sys.stdout))
+		values, errors = SESSION.query(sh)
+	except JmxshError, e:
+		logging.warning('failed running jmxsh: ' + str(e))
+		return False
+	if not values:
 		return False
 
 	try:
 		# now parse out the values
-		for line in out.strip().split('\n'):
-			params = line.split(': ')
-			name = params[0]
-			val = params[1]
+		for name,val in values.items():
+			if '\t' in name:
+				# one value of an MBean read in bulk
+				label = name.split('\t', 1)[0]
+				name = bulk_name(name)
+				if label in COMP:
+					COMP[name] = COMP[label]
 
 			if 'CompositeDataSupport' in val:
 				# break up the composite data into separate values
@@ -201,7 +244,7 @@ def get_stat(name):
 
 def metric_init(params):
 	global descriptors
-	global METRICS,HOST,PORT,NAME,METRIC_GROUP
+	global METRICS,HOST,PORT,NAME,METRIC_GROUP,TIMEOUT,SESSION
 
 	logging.debug('init: ' + str(params))
 
@@ -214,6 +257,8 @@ def metric_init(params):
 	except:
 		logging.warning('Incorrect parameters')
 
+	TIMEOUT = int(params.pop('timeout', TIMEOUT))
+
 	# Setup METRICS variable from parameters
 	for name,mbean in params.items():
 		val = mbean.split('##')
@@ -225,6 +270,12 @@ def metric_init(params):
 		except IndexError:
 			pass
 
+		bulk = parse_bulk(val[0])
+		if bulk:
+			BULK[name] = bulk
+
+	SESSION = JmxshSession(JMXSH, HOST, PORT, TIMEOUT, bulk=bool(BULK))
+
 	update_stats()
 
 	# dynamically build our descriptors based on the first run of update_stats()
@@ -265,6 +316,8 @@ def metric_init(params):
 	return descriptors
 
 def metric_cleanup():
+	if SESSION is not None:
+		SESSION.close()
 	logging.shutdown()
 	# pass
 
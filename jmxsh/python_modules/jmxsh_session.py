@@ -0,0 +1,207 @@
+###  jmxsh kept running between refreshes, shared by jmxsh.py and ehcache.py.
+###
+###  Notes:
+###    Running "java -jar jmxsh.jar -q" once per refresh pays for a JVM
+###    start and a new JMX/RMI connection every time. A JmxshSession starts
+###    jmxsh once, connects it once and then feeds it one Tcl script per
+###    refresh on its stdin. Each script ends by printing an end marker,
+###    which tells where its reply stops.
+###
+###    Every command of a script is wrapped in catch and prints one record:
+###      =<label><TAB><value>    or    !<label><TAB><error>
+###    so that one missing MBean does not end the script, or jmxsh.
+###
+###    Bulk commands (bulk_command) read all attributes of the MBeans
+###    matching an ObjectName pattern, one getAttributes call per MBean
+###    through the JMX API that jmxsh's Jacl gives access to, and print a
+###    record per numeric value, composite data broken up by key:
+###      +<label><TAB><key properties><TAB><attribute>[<TAB><key>...]<TAB><value>
+###
+###    This is not a metric module and has no metric_init; copy it next to
+###    the modules using it.
+
+import os
+import re
+import select
+import subprocess
+import time
+import logging
+
+# one record printed per command, anything else jmxsh prints is skipped
+RECORD = re.compile(r'([=!+])([\w.-]+)\t(.*)$')
+
+# Tcl to print the result of a command as a record on one line
+PRINT_RESULT = 'if {[catch {%s} v]} {puts "!%s\t[string map {\\n { } \\r {}} $v]"} else {puts "=%s\t[string map {\\n { } \\r {}} $v]"}'
+
+# Tcl run once per jmxsh for bulk commands. gmond_bulk connects its own
+# MBeanServerConnection on first use, and remembers the readable attributes
+# of each MBean so that later updates cost one getAttributes per MBean.
+BULK_PROCS = r'''
+proc gmond_print {record value} {
+    if {[java::isnull $value]} {
+        return
+    }
+    if {[java::instanceof $value javax.management.openmbean.CompositeData]} {
+        set cd [java::cast javax.management.openmbean.CompositeData $value]
+        set keys [[[$cd getCompositeType] keySet] toArray]
+        for {set i 0} {$i < [$keys length]} {incr i} {
+            set key [[$keys get $i] toString]
+            gmond_print "$record\t$key" [$cd get $key]
+        }
+    } elseif {[java::instanceof $value java.lang.Number]} {
+        puts "$record\t[$value toString]"
+    }
+}
+proc gmond_bulk {label pattern attributes} {
+    global gmond_host gmond_port gmond_connector gmond_mbsc gmond_attributes
+    if {![info exists gmond_mbsc]} {
+        set url [java::new javax.management.remote.JMXServiceURL "service:jmx:rmi:///jndi/rmi://$gmond_host:$gmond_port/jmxrmi"]
+        set gmond_connector [java::call javax.management.remote.JMXConnectorFactory connect $url]
+        set gmond_mbsc [$gmond_connector getMBeanServerConnection]
+    }
+    set it [[$gmond_mbsc queryNames [java::new javax.management.ObjectName $pattern] [java::null]] iterator]
+    while {[$it hasNext]} {
+        set on [java::cast javax.management.ObjectName [$it next]]
+        set name [$on getCanonicalName]
+        if {$attributes != {}} {
+            set gmond_attributes($name) $attributes
+        } elseif {![info exists gmond_attributes($name)]} {
+            set infos [[$gmond_mbsc getMBeanInfo $on] getAttributes]
+            set gmond_attributes($name) {}
+            for {set i 0} {$i < [$infos length]} {incr i} {
+                if {[[$infos get $i] isReadable]} {
+                    lappend gmond_attributes($name) [[$infos get $i] getName]
+                }
+            }
+        }
+        set names [java::new {String[]} [list [llength $gmond_attributes($name)]] $gmond_attributes($name)]
+        set list [$gmond_mbsc getAttributes $on $names]
+        for {set i 0} {$i < [$list size]} {incr i} {
+            set attribute [java::cast javax.management.Attribute [$list get $i]]
+            catch {gmond_print "+$label\t[$on getKeyPropertyListString]\t[$attribute getName]" [$attribute getValue]}
+        }
+    }
+}
+'''
+
+def one_line(tcl):
+	'''Tcl script as a single line, jmxsh -q may evaluate stdin line by line'''
+	return ' ; '.join([line.strip() for line in tcl.strip().splitlines()])
+
+class JmxshError(Exception):
+	pass
+
+def get_command(label, mbean):
+	'''Tcl reading "<mbean> <attribute>" into the record for label'''
+	return PRINT_RESULT % ('jmx_get -m ' + mbean, label, label)
+
+def bulk_command(label, pattern, attributes=[]):
+	'''Tcl reading the attributes, all readable ones if none are given, of
+	the MBeans matching pattern into + records for label'''
+	return 'if {[catch {gmond_bulk %s {%s} {%s}} v]} {puts "!%s\t[string map {\\n { } \\r {}} $v]"}' % \
+		(label, pattern, ' '.join(attributes), label)
+
+class JmxshSession(object):
+	'''jmxsh connected to one JMX server, restarted when it exits, hangs or
+	loses the connection'''
+
+	def __init__(self, jar, host, port, timeout=30, java='java', bulk=False):
+		self.command = [java, '-jar', jar, '-q']
+		self.host = host
+		self.port = port
+		self.timeout = timeout
+		self.bulk = bulk
+		self.process = None
+		self.serial = 0
+		self.buffer = ''
+
+	def start(self):
+		logging.debug('starting ' + ' '.join(self.command))
+		self.process = subprocess.Popen(self.command,
+						stdin=subprocess.PIPE,
+						stdout=subprocess.PIPE,
+						stderr=subprocess.STDOUT,
+						close_fds=True)
+		self.buffer = ''
+		values, errors = self.run([PRINT_RESULT % ('jmx_connect -h %s -p %s' % (self.host, self.port), 'connect', 'connect')])
+		if 'connect' not in values:
+			raise JmxshError('jmx_connect to %s:%s failed: %s' % (self.host, self.port, errors.get('connect')))
+		if self.bulk:
+			self.run(['set gmond_host {%s}' % self.host, 'set gmond_port {%s}' % self.port, one_line(BULK_PROCS)])
+
+	def close(self):
+		if self.process is not None:
+			try:
+				self.process.stdin.close()
+				self.process.kill()
+				self.process.wait()
+			except (IOError, OSError):
+				pass
+			self.process = None
+
+	def read_until(self, end, deadline):
+		'''Lines printed up to the end marker'''
+		fd = self.process.stdout.fileno()
+		lines = []
+		while True:
+			while '\n' in self.buffer:
+				line, self.buffer = self.buffer.split('\n', 1)
+				if end in line:
+					return lines
+				lines.append(line.rstrip('\r'))
+			remaining = deadline - time.time()
+			if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+				raise JmxshError('no answer from jmxsh within %s seconds' % self.timeout)
+			chunk = os.read(fd, 65536)
+			if not chunk:
+				raise JmxshError('jmxsh exited')
+			self.buffer += chunk
+
+	def run(self, commands):
+		'''Run one script, returns ({label: value}, {label: error}) of the
+		records it printed'''
+		self.serial += 1
+		end = '<<end %d>>' % self.serial
+		script = '\n'.join(commands + ['puts "%s"' % end, 'flush stdout']) + '\n'
+		try:
+			self.process.stdin.write(script)
+			self.process.stdin.flush()
+			lines = self.read_until(end, time.time() + self.timeout)
+		except (IOError, OSError, JmxshError):
+			# whatever it was doing, its next reply can not be trusted
+			self.close()
+			raise
+
+		values = {}
+		errors = {}
+		for line in lines:
+			record = RECORD.search(line)
+			if record is None:
+				logging.debug('jmxsh: ' + line)
+			elif record.group(1) == '=':
+				values[record.group(2)] = record.group(3)
+			elif record.group(1) == '+':
+				# keyed by label, key properties and attribute path
+				key, value = record.group(3).rsplit('\t', 1)
+				values[record.group(2) + '\t' + key] = value
+			else:
+				errors[record.group(2)] = record.group(3)
+		return values, errors
+
+	def query(self, commands):
+		'''Run a script of commands printing records, starting and
+		connecting jmxsh first if it is not running'''
+		try:
+			if self.process is None or self.process.poll() is not None:
+				self.start()
+			values, errors = self.run(commands)
+		except (IOError, OSError, JmxshError), e:
+			self.close()
+			raise JmxshError(str(e))
+
+		for label, error in errors.items():
+			logging.warning('jmxsh ' + label + ': ' + error)
+		if errors and not values:
+			# most likely the JMX connection is gone, reconnect next time
+			self.close()
+		return values, errors
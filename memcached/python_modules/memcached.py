@@ -7,7 +7,7 @@ import os
 import threading
 import time
 import socket
-import select
+import re
 
 descriptors = list()
 Desc_Skel   = {}
@@ -26,6 +26,37 @@ def floatable(str):
     except:
         return False
 
+# Lines that end the response to one command
+TERMINATORS = ("END", "ERROR")
+ERROR_PREFIXES = ("CLIENT_ERROR", "SERVER_ERROR")
+
+# Per slab class metrics, from "stats slabs" and "stats items"
+SLAB_METRICS = [
+    # (name, units, slope, description)
+    ("chunk_size",        "bytes",    "zero",     "Size of the chunks in slab class %s"),
+    ("total_pages",       "pages",    "both",     "Pages allocated to slab class %s"),
+    ("used_chunks",       "chunks",   "both",     "Chunks used by items in slab class %s"),
+    ("free_chunks",       "chunks",   "both",     "Chunks free in slab class %s"),
+    ("mem_requested",     "bytes",    "both",     "Bytes requested by the items in slab class %s"),
+    ("get_hits",          "items",    "positive", "Number of keys requested and found present in slab class %s"),
+    ("cmd_set",           "commands", "positive", "Cumulative number of storage reqs to slab class %s"),
+    ("items_number",      "items",    "both",     "Current number of items stored in slab class %s"),
+    ("items_age",         "seconds",  "both",     "Age of the oldest item in slab class %s"),
+    ("items_evicted",     "items",    "positive", "Number of items evicted from slab class %s"),
+    ("items_outofmemory", "items",    "positive", "Number of times slab class %s could not store an item"),
+    ]
+
+def stat_name(key):
+    """Metric name of a stats key, "<class>:<name>" from "stats slabs" and
+    "items:<class>:<name>" from "stats items" become slab<class>_<name>
+    and slab<class>_items_<name>"""
+    if ":" not in key:
+        return key
+    d = key.split(":")
+    if d[0] == "items" and len(d) == 3:
+        return "slab%s_items_%s" % (d[1], d[2])
+    return "slab%s_%s" % (d[0], d[-1])
+
 class UpdateMetricThread(threading.Thread):
 
     def __init__(self, params):
@@ -47,6 +78,12 @@ class UpdateMetricThread(threading.Thread):
             self.port = int(params["port"])
         self.type    = params["type"]
         self.mp      = params["metrix_prefix"]
+        self.sock    = None
+
+        # sent together in one write every refresh
+        self.commands = ["stats"]
+        if params.get("slab_stats", "no").lower() in ("yes", "true", "1"):
+            self.commands += ["stats slabs", "stats items"]
 
     def shutdown(self):
         self.shuttingdown = True
@@ -68,37 +105,53 @@ class UpdateMetricThread(threading.Thread):
 
         self.running = False
 
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+            self.sock = None
+
+    def query(self, commands):
+        """Send all commands in one write, over the connection kept open
+        between refreshes, and return the lines of their responses. Reads
+        until the response to each command has been terminated."""
+        if self.sock is None:
+            dprint("connect %s:%d", self.host, self.port)
+            self.sock = socket.create_connection((self.host, self.port), self.timeout)
+        self.sock.sendall("".join([c + "\r\n" for c in commands]))
+
+        lines = []
+        partial = ""
+        ended = 0
+        while ended < len(commands):
+            data = self.sock.recv(65536)
+            if not data:
+                raise socket.error("connection closed by %s:%d" % (self.host, self.port))
+            data = (partial + data).split("\r\n")
+            partial = data.pop()
+            for line in data:
+                if line in TERMINATORS or line.startswith(ERROR_PREFIXES):
+                    ended += 1
+                else:
+                    lines.append(line)
+        return lines
+
     def update_metric(self):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        msg  = ""
         self.last_metric = self.metric.copy()
         try:
-            dprint("connect %s:%d", self.host, self.port)
-            sock.connect((self.host, self.port))
-            sock.send("stats\r\n")
-
-            while True:
-                rfd, wfd, xfd = select.select([sock], [], [], self.timeout)
-                if not rfd:
-                    print >>sys.stderr, "ERROR: select timeout"
-                    break
-
-                for fd in rfd:
-                    if fd == sock:
-                        data = fd.recv(8192)
-                        msg += data
-
-                if msg.find("END"):
-                    break
-
-            sock.close()
+            lines = self.query(self.commands)
         except socket.error, e:
             print >>sys.stderr, "ERROR: %s" % e
+            # a half read response would be taken for the next one
+            self.close()
+            return
 
-        for m in msg.split("\r\n"):
+        for m in lines:
             d = m.split(" ")
             if len(d) == 3 and d[0] == "STAT" and floatable(d[2]):
-                self.metric[self.mp+"_"+d[1]] = float(d[2])
+                self.metric[self.mp+"_"+stat_name(d[1])] = float(d[2])
 
     def metric_of(self, name):
         val = 0
@@ -158,6 +211,9 @@ def metric_init(params):
     dprint("%s", "Debug mode on")
 
     _Worker_Thread = UpdateMetricThread(params)
+    if len(_Worker_Thread.commands) > 1:
+        # the slab classes in use are needed for the descriptors
+        _Worker_Thread.update_metric()
     _Worker_Thread.start()
 
     # IP:HOSTNAME
@@ -293,6 +349,23 @@ def metric_init(params):
                 "description": "Sets per second",
                 }))
 
+    # Slab classes in use at start up
+    slab_re = re.compile("^%s_slab(\d+)_" % re.escape(mp))
+    slabs = set()
+    for name in _Worker_Thread.metric:
+        m = slab_re.match(name)
+        if m:
+            slabs.add(int(m.group(1)))
+    for slab in sorted(slabs):
+        for (name, units, slope, description) in SLAB_METRICS:
+            if "%s_slab%d_%s" % (mp, slab, name) in _Worker_Thread.metric:
+                descriptors.append(create_desc(Desc_Skel, {
+                            "name"       : "%s_slab%d_%s" % (mp, slab, name),
+                            "units"      : units,
+                            "slope"      : slope,
+                            "description": description % slab,
+                            }))
+
     # Tokyo Tyrant
     if "type" in params and params["type"].lower().find("tokyo") == 0:
         dtmp = descriptors[:]
@@ -357,6 +430,7 @@ def metric_of(name):
 
 def metric_cleanup():
     _Worker_Thread.shutdown()
+    _Worker_Thread.close()
 
 if __name__ == '__main__':
     try:
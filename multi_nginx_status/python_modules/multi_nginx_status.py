@@ -7,34 +7,84 @@
 import pprint
 import time
 import socket
-import urllib2
+import httplib
+import threading
+import Queue
 import re
 
 descriptors = list()
 
 NIPARAMS = {}
 
+# Metric name -> value, replaced as a whole after every poll
 NIMETRICS = {
     'time' : 0,
     'data' : {}
 }
 
-LAST_NIMETRICS = {}
 NIMETRICS_CACHE_MAX = 10
 
-# status_request() makes the http request to the nginx status pages
-def status_request(srvname, port):
-    url = 'http://' + srvname + ':' + port + '/nginx_status'
-    c = urllib2.urlopen(url)
-    data = c.read()
-    c.close()
-
-    matchActive = re.search(r'Active connections:\s+(\d+)', data)
-    matchHistory = re.search(r'\s*(\d+)\s+(\d+)\s+(\d+)', data)
-    matchCurrent = re.search(r'Reading:\s*(\d+)\s*Writing:\s*(\d+)\s*'
-            'Waiting:\s*(\d+)', data)
+# Servers polled at once, and seconds each gets to connect and answer
+POLL_WORKERS = 16
+POLL_TIMEOUT = 5
+
+# Timeouts one server's poll may take at worst: a read on its kept open
+# connection, then connect and read on a new one
+SERVER_TIMEOUTS = 3
+
+# One dict per server: where it is, the HTTP connection kept open to it,
+# its counters at the previous poll and a lock held while it is polled
+SERVERS = []
+
+_Worker_Thread = None
+
+ACTIVE_RE = re.compile(r'Active connections:\s+(\d+)')
+HISTORY_RE = re.compile(r'\s*(\d+)\s+(\d+)\s+(\d+)')
+CURRENT_RE = re.compile(r'Reading:\s*(\d+)\s*Writing:\s*(\d+)\s*'
+        'Waiting:\s*(\d+)')
+
+#These ones are accumulative and are reported as a rate
+ACCUMULATIVE = ['_accepts', '_handled', '_requests']
+
+# Metrics read from the status page, a server that fails has none
+STATUS_METRICS = ['_activeConn', '_accepts', '_handled', '_requests',
+        '_reading', '_writing', '_waiting']
+
+# fetch() gets the status page over the server's kept open connection, and
+# does not start a retry that could run past the deadline
+def fetch(server, deadline):
+    for attempt in (0, 1):
+        reused = server['conn'] is not None
+        if not reused:
+            server['conn'] = httplib.HTTPConnection(server['srvname'], int(server['port']), timeout=POLL_TIMEOUT)
+        try:
+            server['conn'].request('GET', '/nginx_status')
+            response = server['conn'].getresponse()
+            data = response.read()
+            if response.will_close:
+                server['conn'].close()
+                server['conn'] = None
+            if response.status != 200:
+                raise Exception('HTTP status {0}'.format(response.status))
+            return data
+        except (httplib.HTTPException, socket.error):
+            server['conn'].close()
+            server['conn'] = None
+            # nginx may have closed an idle keepalive connection, retry
+            # once on a new one
+            if not reused or attempt or deadline - time.time() < 2 * POLL_TIMEOUT:
+                raise
+
+# status_request() reads the nginx status page of a server
+def status_request(server, deadline):
+    srvname = server['srvname']
+    data = fetch(server, deadline)
+
+    matchActive = ACTIVE_RE.search(data)
+    matchHistory = HISTORY_RE.search(data)
+    matchCurrent = CURRENT_RE.search(data)
     if not matchActive or not matchHistory or not matchCurrent:
-        raise Exception('Unable to parse {0}' . format(url))
+        raise Exception('Unable to parse {0}' . format(data[:80]))
     result = {}
     result[srvname + '_activeConn'] = float(matchActive.group(1))
 
@@ -49,35 +99,119 @@ def status_request(srvname, port):
 
     return result
 
-# get_metrics() is the callback metric handler, is called repeatedly by gmond
-def get_metrics(name):
-    global NIMETRICS,LAST_NIMETRICS
-    # if interval since last check > NIMETRICS_CACHE_MAX get metrics again
-    if (time.time() - NIMETRICS['time']) > NIMETRICS_CACHE_MAX:
-        metrics = {}
-        for para in NIPARAMS.keys():
-            srvname,port = NIPARAMS[para].split(':')
-            newmetrics = status_request(srvname,port)
-            metrics = dict(newmetrics, **metrics)
-                        
-        LAST_NIMETRICS = dict(NIMETRICS)
-        NIMETRICS = {
-            'time': time.time(),
-            'data': metrics
-            }
-    #For counter type metrics, return the delta instead:
-    accumulative = ['_accepts', '_handled', '_requests']
-    for m in accumulative:
-        if m in name:
-            try:
-                delta = float(NIMETRICS['data'][name] - LAST_NIMETRICS['data'][name])/(NIMETRICS['time'] - LAST_NIMETRICS['time'])
-                if delta < 0:
-                    delta = 0
-            except StandardError:
+# poll_server() returns the metrics of one server, with the counters turned
+# into rates since its previous poll
+def poll_server(server):
+    now = time.time()
+    result = status_request(server, now + SERVER_TIMEOUTS * POLL_TIMEOUT)
+    prev, server['prev'] = server['prev'], (now, dict(result))
+    for m in ACCUMULATIVE:
+        name = server['srvname'] + m
+        try:
+            delta = (result[name] - prev[1][name]) / (now - prev[0])
+            if delta < 0:
                 delta = 0
-            return delta
+        except (TypeError, KeyError, ZeroDivisionError):
+            delta = 0
+        result[name] = delta
+    return result
+
+def pollWorker(jobs, done):
+    while True:
+        try:
+            server = jobs.get_nowait()
+        except Queue.Empty:
+            return
+        # still busy from a poll that ran past its deadline, not tried
+        if not server['lock'].acquire(False):
+            continue
+        result = None
+        try:
+            try:
+                result = poll_server(server)
+            except Exception, e:
+                print '[multinginx] polling %s failed: %s' % (server['srvname'], e)
+        finally:
+            server['lock'].release()
+        done.put((server, result))
+
+# poll_servers() gets all status pages in parallel, at most POLL_WORKERS at
+# a time, and replaces NIMETRICS in one go. A server that was tried and
+# failed is reported down, with no other metrics. One that was not tried,
+# or had not answered when the poll ended, keeps its previous values.
+def poll_servers():
+    global NIMETRICS
+
+    jobs = Queue.Queue()
+    done = Queue.Queue()
+    for server in SERVERS:
+        jobs.put(server)
+
+    start = time.time()
+    workers = []
+    for i in range(min(POLL_WORKERS, len(SERVERS))):
+        worker = threading.Thread(target=pollWorker, args=(jobs, done))
+        # a hung request must not keep gmond from exiting
+        worker.setDaemon(True)
+        worker.start()
+        workers.append(worker)
 
-    return NIMETRICS['data'][name]
+    # every worker polls its share of the servers one after another, each
+    # taking SERVER_TIMEOUTS timeouts at worst
+    rounds = (len(SERVERS) + len(workers) - 1) / max(len(workers), 1)
+    deadline = start + rounds * SERVER_TIMEOUTS * POLL_TIMEOUT
+    for worker in workers:
+        worker.join(max(deadline - time.time(), 0))
+
+    # whatever workers still busy return now is dropped with the done queue
+    while True:
+        try:
+            jobs.get_nowait()
+        except Queue.Empty:
+            break
+
+    metrics = dict(NIMETRICS['data'])
+    while True:
+        try:
+            server, result = done.get_nowait()
+        except Queue.Empty:
+            break
+        if result is not None:
+            metrics.update(result)
+            metrics[server['srvname'] + '_up'] = 1
+        else:
+            for m in STATUS_METRICS:
+                metrics.pop(server['srvname'] + m, None)
+            metrics[server['srvname'] + '_up'] = 0
+
+    NIMETRICS = {
+        'time': time.time(),
+        'data': metrics
+        }
+
+class UpdateMetricThread(threading.Thread):
+
+    def __init__(self, refresh_rate):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.refresh_rate = refresh_rate
+        self.shuttingdown = False
+        self._wakeup = threading.Event()
+
+    def shutdown(self):
+        self.shuttingdown = True
+        self._wakeup.set()
+        self.join()
+
+    def run(self):
+        while not self.shuttingdown:
+            self._wakeup.wait(self.refresh_rate)
+            if not self.shuttingdown:
+                poll_servers()
+
+# get_metrics() is the callback metric handler, is called repeatedly by gmond
+def get_metrics(name):
+    return NIMETRICS['data'].get(name, 0)
         
 # create_desc() builds the descriptors from passed skeleton and additional properties
 def create_desc(skel, prop):
@@ -133,17 +267,27 @@ def define_metrics(Desc_Skel, srvname, port):
                 "description" : "Current connections in waiting state",
                 "spoof_host"  : spoof_str,
                 }))
+    descriptors.append(create_desc(Desc_Skel, {
+                "name"        : srvname + '_up',
+                "units"       : "up/down",
+                "description" : "1 if the status page answered the last poll, 0 if not",
+                "spoof_host"  : spoof_str,
+                }))
 
     return descriptors
 # Called once by gmond to setup the metrics.
 def metric_init(params):
-    global descriptors, Desc_Skel
+    global descriptors, Desc_Skel, SERVERS, POLL_WORKERS, POLL_TIMEOUT, NIMETRICS_CACHE_MAX, _Worker_Thread
     print '[multinginx] Recieved the following parameters'
     print params
 
     for key in params:
         NIPARAMS[key] = params[key]
 
+    POLL_WORKERS = int(params.get('poll_workers', POLL_WORKERS))
+    POLL_TIMEOUT = float(params.get('timeout', POLL_TIMEOUT))
+    NIMETRICS_CACHE_MAX = float(params.get('refresh_rate', NIMETRICS_CACHE_MAX))
+
     Desc_Skel = {
         'name'        : 'XXX',
         #'call_back'   : 'XXX',
@@ -158,13 +302,33 @@ def metric_init(params):
         #'spoof_host'  : spoof_string
         }  
 
+    SERVERS = []
     for para in params.keys():
         if para.startswith('server_'):
             srvname,port = params[para].split(':')
             descriptors = define_metrics(Desc_Skel, srvname, port)
+            SERVERS.append({
+                'srvname': srvname,
+                'port': port,
+                'conn': None,
+                'prev': None,
+                'lock': threading.Lock(),
+                })
+
+    # first poll now, the rates start at the next one
+    poll_servers()
+    _Worker_Thread = UpdateMetricThread(NIMETRICS_CACHE_MAX)
+    _Worker_Thread.start()
 
     return descriptors
 
+def metric_cleanup():
+    if _Worker_Thread is not None:
+        _Worker_Thread.shutdown()
+    for server in SERVERS:
+        if server['conn'] is not None:
+            server['conn'].close()
+
 # Below section is for debugging from the CLI.
 if __name__ == '__main__':
     params = {
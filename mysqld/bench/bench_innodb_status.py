@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+#  Times DBUtil.parse_innodb_status against the previous line-by-line parser
+#  on SHOW ENGINE INNODB STATUS outputs of increasing size, and checks that
+#  both produce the same values.
+#
+#  The corpus directory holds captured outputs. Larger inputs are made by
+#  repeating the transaction entries of each capture (a waiting transaction
+#  with its lock dump, and an idle one) inside its TRANSACTIONS section,
+#  which is what grows on servers with thousands of open transactions.
+#
+#  Usage: python bench_innodb_status.py [-n repeats] [corpus files...]
+
+import glob
+import os
+import sys
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python_modules'))
+
+# DBUtil imports MySQLdb at module level but the parser does not need it
+try:
+	import MySQLdb
+except ImportError:
+	import types
+	sys.modules['MySQLdb'] = types.ModuleType('MySQLdb')
+
+from DBUtil import parse_innodb_status, defaultdict, longish, hexlongish
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+TRANSACTION_COUNTS = (0, 100, 1000, 5000)
+
+def legacy_parse_innodb_status(innodb_status_raw, innodb_version="1.0"):
+	"""the parser as it was before section tracking, for comparison"""
+	def sumof(status):
+		def new(*idxs):
+			return sum(map(lambda x: longish(status[x]), idxs))
+		return new
+
+	innodb_status = defaultdict(int)
+	innodb_status['active_transactions']
+	individual_buffer_pool_info = False
+
+	for line in innodb_status_raw:
+		istatus = line.split()
+
+		isum = sumof(istatus)
+
+		if "Mutex spin waits" in line:
+			innodb_status['spin_waits'] += longish(istatus[3])
+			innodb_status['spin_rounds'] += longish(istatus[5])
+			innodb_status['os_waits'] += longish(istatus[8])
+		elif "RW-shared spins" in line:
+			if innodb_version == 1.0:
+				innodb_status['spin_waits'] += isum(2,8)
+				innodb_status['os_waits'] += isum(5,11)
+			elif innodb_version >= 5.5:
+				innodb_status['spin_waits'] += longish(istatus[2])
+				innodb_status['os_waits'] += longish(istatus[7])
+		elif "RW-excl spins" in line and innodb_version >= 5.5:
+			innodb_status['spin_waits'] += longish(istatus[2])
+			innodb_status['os_waits'] += longish(istatus[7])
+		elif "Trx id counter" in line:
+			if innodb_version >= 5.6:
+				innodb_status['transactions'] += longish(istatus[3])
+			elif innodb_version == 5.5:
+				innodb_status['transactions'] += hexlongish(istatus[3])
+			else:
+				innodb_status['transactions'] += isum(3,4)
+		elif "Purge done for trx" in line:
+			if innodb_version >= 5.6:
+				innodb_status['transactions_purged'] += longish(istatus[6])
+			elif innodb_version == 5.5:
+				innodb_status['transactions_purged'] += hexlongish(istatus[6])
+			else:
+				innodb_status['transactions_purged'] += isum(6,7)
+		elif "History list length" in line:
+			innodb_status['history_list'] = longish(istatus[3])
+		elif "---TRANSACTION" in line and innodb_status['transactions']:
+			innodb_status['current_transactions'] += 1
+			if "ACTIVE" in line:
+				innodb_status['active_transactions'] += 1
+		elif "LOCK WAIT" in line and innodb_status['transactions']:
+			innodb_status['locked_transactions'] += 1
+		elif 'read views open inside' in line:
+			innodb_status['read_views'] = longish(istatus[0])
+		elif 'OS file reads' in line:
+			innodb_status['data_reads'] = longish(istatus[0])
+			innodb_status['data_writes'] = longish(istatus[4])
+			innodb_status['data_fsyncs'] = longish(istatus[8])
+		elif 'Pending normal aio' in line:
+			innodb_status['pending_normal_aio_reads'] = longish(istatus[4])
+			innodb_status['pending_normal_aio_writes'] = longish(istatus[7])
+		elif 'ibuf aio reads' in line:
+			innodb_status['pending_ibuf_aio_reads'] = longish(istatus[3])
+			innodb_status['pending_aio_log_ios'] = longish(istatus[6])
+			innodb_status['pending_aio_sync_ios'] = longish(istatus[9])
+		elif 'Pending flushes (fsync)' in line:
+			innodb_status['pending_log_flushes'] = longish(istatus[4])
+			innodb_status['pending_buffer_pool_flushes'] = longish(istatus[7])
+		elif 'merged recs' in line and innodb_version == 1.0:
+			innodb_status['ibuf_inserts'] = longish(istatus[0])
+			innodb_status['ibuf_merged'] = longish(istatus[2])
+			innodb_status['ibuf_merges'] = longish(istatus[5])
+		elif 'Ibuf: size' in line and innodb_version >= 5.5:
+			innodb_status['ibuf_merges'] = longish(istatus[10])
+		elif 'merged operations' in line and innodb_version >= 5.5:
+			in_merged = 1
+		elif 'delete mark' in line and 'in_merged' in vars() and innodb_version >= 5.5:
+			innodb_status['ibuf_inserts'] = longish(istatus[1])
+			innodb_status['ibuf_merged'] = 0
+			del in_merged
+		elif "log i/o's done" in line:
+			innodb_status['log_writes'] = longish(istatus[0])
+		elif "pending log writes" in line:
+			innodb_status['pending_log_writes'] = longish(istatus[0])
+			innodb_status['pending_chkp_writes'] = longish(istatus[4])
+		elif "Log sequence number" in line:
+			if innodb_version >= 5.5:
+				innodb_status['log_bytes_written'] = longish(istatus[3])
+			else:
+				innodb_status['log_bytes_written'] = isum(3,4)
+		elif "Log flushed up to" in line:
+			if innodb_version >= 5.5:
+				innodb_status['log_bytes_flushed'] = longish(istatus[4])
+			else:
+				innodb_status['log_bytes_flushed'] = isum(4,5)
+		elif "INDIVIDUAL BUFFER POOL INFO" in line:
+			individual_buffer_pool_info = True
+		elif "Buffer pool size, bytes" in line and not individual_buffer_pool_info:
+			innodb_status['buffer_pool_pages_bytes'] = longish(istatus[4])
+		elif "Buffer pool size" in line and not individual_buffer_pool_info:
+			innodb_status['buffer_pool_pages_total'] = longish(istatus[3])
+		elif "Free buffers" in line and not individual_buffer_pool_info:
+			innodb_status['buffer_pool_pages_free'] = longish(istatus[2])
+		elif "Database pages" in line and not individual_buffer_pool_info:
+			innodb_status['buffer_pool_pages_data'] = longish(istatus[2])
+		elif "Modified db pages" in line and not individual_buffer_pool_info:
+			innodb_status['buffer_pool_pages_dirty'] = longish(istatus[3])
+		elif "Pages read" in line and "ahead" not in line and not individual_buffer_pool_info:
+			innodb_status['pages_read'] = longish(istatus[2])
+			innodb_status['pages_created'] = longish(istatus[4])
+			innodb_status['pages_written'] = longish(istatus[6])
+		elif 'Number of rows inserted' in line:
+			innodb_status['rows_inserted'] = longish(istatus[4])
+			innodb_status['rows_updated'] = longish(istatus[6])
+			innodb_status['rows_deleted'] = longish(istatus[8])
+			innodb_status['rows_read'] = longish(istatus[10])
+		elif "queries inside InnoDB" in line:
+			innodb_status['queries_inside'] = longish(istatus[0])
+			innodb_status['queries_queued'] = longish(istatus[4])
+
+	innodb_status['transactions_unpurged'] = innodb_status['transactions'] - innodb_status['transactions_purged']
+	innodb_status['log_bytes_unflushed'] = innodb_status['log_bytes_written'] - innodb_status['log_bytes_flushed']
+
+	return innodb_status
+
+def inflate(text, transactions):
+	"""repeat the ---TRANSACTION entries of a capture until there are
+	about `transactions` of them"""
+	lines = text.split('\n')
+	start = lines.index('LIST OF TRANSACTIONS FOR EACH SESSION:') + 1
+	end = lines.index('FILE I/O') - 1
+	entries = lines[start:end]
+	if not transactions or not entries:
+		return text
+
+	count = len([l for l in entries if l.startswith('---TRANSACTION')])
+	copies = max(transactions / count, 1)
+	return '\n'.join(lines[:start] + entries * copies + lines[end:])
+
+def timeit(func, text, repeats):
+	start = time.time()
+	for i in range(repeats):
+		result = func(text, 5.5)
+	return result, (time.time() - start) * 1000.0 / repeats
+
+if __name__ == '__main__':
+	parser = OptionParser()
+	parser.add_option('-n', '--repeats', dest='repeats', type='int', default=20, help='parses per measurement')
+	(options, args) = parser.parse_args()
+
+	for path in args or sorted(glob.glob(os.path.join(CORPUS_DIR, '*.txt'))):
+		capture = open(path).read()
+		for transactions in TRANSACTION_COUNTS:
+			text = inflate(capture, transactions)
+
+			# mysql.py used to split the text before handing it over
+			old, old_ms = timeit(lambda t, v: legacy_parse_innodb_status(t.split('\n'), v), text, options.repeats)
+			new, new_ms = timeit(parse_innodb_status, text, options.repeats)
+
+			if dict(old) != dict(new):
+				print 'MISMATCH %s (%d transactions):' % (os.path.basename(path), transactions)
+				for key in sorted(set(old) | set(new)):
+					if old.get(key) != new.get(key):
+						print '  %s: %s != %s' % (key, old.get(key), new.get(key))
+
+			print '%-28s %6d trx %8d bytes  legacy %8.3f ms  streaming %8.3f ms  (%.1fx)' % \
+				(os.path.basename(path), transactions, len(text), old_ms, new_ms, old_ms / max(new_ms, 0.001))
@@ -64,6 +64,8 @@ except:
             return 'defaultdict(%s, %s)' % (self.default_factory,
                                             dict.__repr__(self))
 
+import re
+
 import MySQLdb
 
 def is_hex(s):
@@ -96,162 +98,223 @@ def hexlongish(x):
 	else:
 		raise ValueError
 
+# Sections of SHOW ENGINE INNODB STATUS that carry nothing we report. On busy
+# servers these (deadlock and lock dumps in particular) are most of the text.
+SKIP_SECTIONS = frozenset((
+	'BACKGROUND THREAD',
+	'LATEST FOREIGN KEY ERROR',
+	'LATEST DETECTED DEADLOCK',
+	'INDIVIDUAL BUFFER POOL INFO',
+))
+
+# Sections that can grow with the number of threads or transactions. Only
+# lines starting with one of these prefixes are parsed there, so the
+# per-transaction query text and lock dumps are never split or matched.
+SECTION_PREFIXES = {
+	'SEMAPHORES': ('Mutex spin waits', 'RW-shared spins', 'RW-excl spins'),
+	'TRANSACTIONS': ('Trx id counter', 'Purge done for trx', 'History list length', '---TRANSACTION', 'LOCK WAIT'),
+}
+SECTION_LINES = dict([
+	(section, re.compile('\n((?:%s)[^\n]*)' % '|'.join([re.escape(p) for p in prefixes])))
+	for (section, prefixes) in SECTION_PREFIXES.items()
+])
+
+# a section title between two lines of dashes. Anchored on the newline rather
+# than with re.M, which is several times slower on large outputs; the match
+# stops before the newline ending the second dashes line so the first line of
+# the section still starts with one, as SECTION_LINES expects.
+SECTION_HEADER = re.compile('\n-{3,}[ \t]*\n([A-Z][A-Z0-9 /]*[A-Z])[ \t]*\n-{3,}[ \t]*(?=\n)')
+
+def _sumof(status):
+	def new(*idxs):
+		return sum(map(lambda x: longish(status[x]), idxs))
+	return new
+
+def _parse_status_line(line, innodb_status, innodb_version, state):
+	istatus = line.split()
+
+	isum = _sumof(istatus)
+
+	# SEMAPHORES
+	if "Mutex spin waits" in line:
+		innodb_status['spin_waits'] += longish(istatus[3])
+		innodb_status['spin_rounds'] += longish(istatus[5])
+		innodb_status['os_waits'] += longish(istatus[8])
+
+	elif "RW-shared spins" in line:
+		if innodb_version == 1.0:
+			innodb_status['spin_waits'] += isum(2,8)
+			innodb_status['os_waits'] += isum(5,11)
+		elif innodb_version >= 5.5:
+			innodb_status['spin_waits'] += longish(istatus[2])
+			innodb_status['os_waits'] += longish(istatus[7])
+
+	elif "RW-excl spins" in line and innodb_version >= 5.5:
+		innodb_status['spin_waits'] += longish(istatus[2])
+		innodb_status['os_waits'] += longish(istatus[7])
+
+	# TRANSACTIONS
+	elif "Trx id counter" in line:
+		if innodb_version >= 5.6:
+			innodb_status['transactions'] += longish(istatus[3])
+		elif innodb_version == 5.5:
+			innodb_status['transactions'] += hexlongish(istatus[3])
+		else:
+			innodb_status['transactions'] += isum(3,4)
+
+	elif "Purge done for trx" in line:
+		if innodb_version >= 5.6:
+			innodb_status['transactions_purged'] += longish(istatus[6])
+		elif innodb_version == 5.5:
+			innodb_status['transactions_purged'] += hexlongish(istatus[6])
+		else:
+			innodb_status['transactions_purged'] += isum(6,7)
+
+	elif "History list length" in line:
+		innodb_status['history_list'] = longish(istatus[3])
+
+	elif "---TRANSACTION" in line and innodb_status['transactions']:
+		innodb_status['current_transactions'] += 1
+		if "ACTIVE" in line:
+			innodb_status['active_transactions'] += 1
+
+	elif "LOCK WAIT" in line and innodb_status['transactions']:
+		innodb_status['locked_transactions'] += 1
+
+	elif 'read views open inside' in line:
+		innodb_status['read_views'] = longish(istatus[0])
+
+	# FILE I/O
+	elif 'OS file reads' in line:
+		innodb_status['data_reads'] = longish(istatus[0])
+		innodb_status['data_writes'] = longish(istatus[4])
+		innodb_status['data_fsyncs'] = longish(istatus[8])
+
+	elif 'Pending normal aio' in line:
+		innodb_status['pending_normal_aio_reads'] = longish(istatus[4])
+		innodb_status['pending_normal_aio_writes'] = longish(istatus[7])
+
+	elif 'ibuf aio reads' in line:
+		innodb_status['pending_ibuf_aio_reads'] = longish(istatus[3])
+		innodb_status['pending_aio_log_ios'] = longish(istatus[6])
+		innodb_status['pending_aio_sync_ios'] = longish(istatus[9])
+
+	elif 'Pending flushes (fsync)' in line:
+		innodb_status['pending_log_flushes'] = longish(istatus[4])
+		innodb_status['pending_buffer_pool_flushes'] = longish(istatus[7])
+
+	# INSERT BUFFER AND ADAPTIVE HASH INDEX
+	elif 'merged recs' in line and innodb_version == 1.0:
+		innodb_status['ibuf_inserts'] = longish(istatus[0])
+		innodb_status['ibuf_merged'] = longish(istatus[2])
+		innodb_status['ibuf_merges'] = longish(istatus[5])
+
+	elif 'Ibuf: size' in line and innodb_version >= 5.5:
+		innodb_status['ibuf_merges'] = longish(istatus[10])
+
+	elif 'merged operations' in line and innodb_version >= 5.5:
+		state['in_merged'] = True
+
+	elif 'delete mark' in line and state['in_merged'] and innodb_version >= 5.5:
+		innodb_status['ibuf_inserts'] = longish(istatus[1])
+		innodb_status['ibuf_merged'] = 0
+		state['in_merged'] = False
+
+	# LOG
+	elif "log i/o's done" in line:
+		innodb_status['log_writes'] = longish(istatus[0])
+
+	elif "pending log writes" in line:
+		innodb_status['pending_log_writes'] = longish(istatus[0])
+		innodb_status['pending_chkp_writes'] = longish(istatus[4])
+	
+	elif "Log sequence number" in line:
+		if innodb_version >= 5.5:
+			innodb_status['log_bytes_written'] = longish(istatus[3])
+		else:
+			innodb_status['log_bytes_written'] = isum(3,4)
+	
+	elif "Log flushed up to" in line:
+		if innodb_version >= 5.5:
+			innodb_status['log_bytes_flushed'] = longish(istatus[4])
+		else:
+			innodb_status['log_bytes_flushed'] = isum(4,5)
+
+	# BUFFER POOL AND MEMORY
+	elif "INDIVIDUAL BUFFER POOL INFO" in line:
+		# individual pools section.  We only want to record the totals 
+		# rather than each individual pool clobbering the totals
+		state['individual_buffer_pool_info'] = True
+
+	elif "Buffer pool size, bytes" in line and not state['individual_buffer_pool_info']:
+		innodb_status['buffer_pool_pages_bytes'] = longish(istatus[4])
+
+	elif "Buffer pool size" in line and not state['individual_buffer_pool_info']:
+		innodb_status['buffer_pool_pages_total'] = longish(istatus[3])
+	
+	elif "Free buffers" in line and not state['individual_buffer_pool_info']:
+		innodb_status['buffer_pool_pages_free'] = longish(istatus[2])
+	
+	elif "Database pages" in line and not state['individual_buffer_pool_info']:
+		innodb_status['buffer_pool_pages_data'] = longish(istatus[2])
+	
+	elif "Modified db pages" in line and not state['individual_buffer_pool_info']:
+		innodb_status['buffer_pool_pages_dirty'] = longish(istatus[3])
+	
+	elif "Pages read" in line and "ahead" not in line and not state['individual_buffer_pool_info']:
+			innodb_status['pages_read'] = longish(istatus[2])
+			innodb_status['pages_created'] = longish(istatus[4])
+			innodb_status['pages_written'] = longish(istatus[6])
+
+	# ROW OPERATIONS
+	elif 'Number of rows inserted' in line:
+		innodb_status['rows_inserted'] = longish(istatus[4])
+		innodb_status['rows_updated'] = longish(istatus[6])
+		innodb_status['rows_deleted'] = longish(istatus[8])
+		innodb_status['rows_read'] = longish(istatus[10])
+	
+	elif "queries inside InnoDB" in line:
+		innodb_status['queries_inside'] = longish(istatus[0])
+		innodb_status['queries_queued'] = longish(istatus[4])
+
 def parse_innodb_status(innodb_status_raw, innodb_version="1.0"):
-	def sumof(status):
-		def new(*idxs):
-			return sum(map(lambda x: longish(status[x]), idxs))
-		return new
+	"""
+	Parse the text of SHOW ENGINE INNODB STATUS, given as a string or as a
+	sequence of lines.
+
+	The text is cut into sections at their headers first. Sections in
+	SKIP_SECTIONS are dropped without looking at their lines, sections in
+	SECTION_PREFIXES only hand the lines matching their prefixes to the line
+	parser, and everything else (including text before the first header)
+	goes through every check as it always did.
+	"""
+	if not isinstance(innodb_status_raw, basestring):
+		innodb_status_raw = '\n'.join(innodb_status_raw)
 
 	innodb_status = defaultdict(int)
 	innodb_status['active_transactions']
-	individual_buffer_pool_info = False
-	
-	for line in innodb_status_raw:
-		istatus = line.split()
-
-		isum = sumof(istatus)
-
-		# SEMAPHORES
-		if "Mutex spin waits" in line:
-			innodb_status['spin_waits'] += longish(istatus[3])
-			innodb_status['spin_rounds'] += longish(istatus[5])
-			innodb_status['os_waits'] += longish(istatus[8])
-
-		elif "RW-shared spins" in line:
-			if innodb_version == 1.0:
-				innodb_status['spin_waits'] += isum(2,8)
-				innodb_status['os_waits'] += isum(5,11)
-			elif innodb_version >= 5.5:
-				innodb_status['spin_waits'] += longish(istatus[2])
-				innodb_status['os_waits'] += longish(istatus[7])
-
-		elif "RW-excl spins" in line and innodb_version >= 5.5:
-			innodb_status['spin_waits'] += longish(istatus[2])
-			innodb_status['os_waits'] += longish(istatus[7])
-
-		# TRANSACTIONS
-		elif "Trx id counter" in line:
-			if innodb_version >= 5.6:
-				innodb_status['transactions'] += longish(istatus[3])
-			elif innodb_version == 5.5:
-				innodb_status['transactions'] += hexlongish(istatus[3])
-			else:
-				innodb_status['transactions'] += isum(3,4)
-
-		elif "Purge done for trx" in line:
-			if innodb_version >= 5.6:
-				innodb_status['transactions_purged'] += longish(istatus[6])
-			elif innodb_version == 5.5:
-				innodb_status['transactions_purged'] += hexlongish(istatus[6])
-			else:
-				innodb_status['transactions_purged'] += isum(6,7)
-
-		elif "History list length" in line:
-			innodb_status['history_list'] = longish(istatus[3])
-
-		elif "---TRANSACTION" in line and innodb_status['transactions']:
-			innodb_status['current_transactions'] += 1
-			if "ACTIVE" in line:
-				innodb_status['active_transactions'] += 1
-
-		elif "LOCK WAIT" in line and innodb_status['transactions']:
-			innodb_status['locked_transactions'] += 1
-
-		elif 'read views open inside' in line:
-			innodb_status['read_views'] = longish(istatus[0])
-
-		# FILE I/O
-		elif 'OS file reads' in line:
-			innodb_status['data_reads'] = longish(istatus[0])
-			innodb_status['data_writes'] = longish(istatus[4])
-			innodb_status['data_fsyncs'] = longish(istatus[8])
-
-		elif 'Pending normal aio' in line:
-			innodb_status['pending_normal_aio_reads'] = longish(istatus[4])
-			innodb_status['pending_normal_aio_writes'] = longish(istatus[7])
-
-		elif 'ibuf aio reads' in line:
-			innodb_status['pending_ibuf_aio_reads'] = longish(istatus[3])
-			innodb_status['pending_aio_log_ios'] = longish(istatus[6])
-			innodb_status['pending_aio_sync_ios'] = longish(istatus[9])
-
-		elif 'Pending flushes (fsync)' in line:
-			innodb_status['pending_log_flushes'] = longish(istatus[4])
-			innodb_status['pending_buffer_pool_flushes'] = longish(istatus[7])
-
-		# INSERT BUFFER AND ADAPTIVE HASH INDEX
-		elif 'merged recs' in line and innodb_version == 1.0:
-			innodb_status['ibuf_inserts'] = longish(istatus[0])
-			innodb_status['ibuf_merged'] = longish(istatus[2])
-			innodb_status['ibuf_merges'] = longish(istatus[5])
-
-		elif 'Ibuf: size' in line and innodb_version >= 5.5:
-			innodb_status['ibuf_merges'] = longish(istatus[10])
-
-		elif 'merged operations' in line and innodb_version >= 5.5:
-			in_merged = 1
-
-		elif 'delete mark' in line and 'in_merged' in vars() and innodb_version >= 5.5:
-			innodb_status['ibuf_inserts'] = longish(istatus[1])
-			innodb_status['ibuf_merged'] = 0
-			del in_merged
-
-		# LOG
-		elif "log i/o's done" in line:
-			innodb_status['log_writes'] = longish(istatus[0])
-
-		elif "pending log writes" in line:
-			innodb_status['pending_log_writes'] = longish(istatus[0])
-			innodb_status['pending_chkp_writes'] = longish(istatus[4])
-		
-		elif "Log sequence number" in line:
-			if innodb_version >= 5.5:
-				innodb_status['log_bytes_written'] = longish(istatus[3])
-			else:
-				innodb_status['log_bytes_written'] = isum(3,4)
-		
-		elif "Log flushed up to" in line:
-			if innodb_version >= 5.5:
-				innodb_status['log_bytes_flushed'] = longish(istatus[4])
-			else:
-				innodb_status['log_bytes_flushed'] = isum(4,5)
-
-		# BUFFER POOL AND MEMORY
-		elif "INDIVIDUAL BUFFER POOL INFO" in line:
-			# individual pools section.  We only want to record the totals 
-			# rather than each individual pool clobbering the totals
-			individual_buffer_pool_info = True
-
-		elif "Buffer pool size, bytes" in line and not individual_buffer_pool_info:
-			innodb_status['buffer_pool_pages_bytes'] = longish(istatus[4])
-
-		elif "Buffer pool size" in line and not individual_buffer_pool_info:
-			innodb_status['buffer_pool_pages_total'] = longish(istatus[3])
-		
-		elif "Free buffers" in line and not individual_buffer_pool_info:
-			innodb_status['buffer_pool_pages_free'] = longish(istatus[2])
-		
-		elif "Database pages" in line and not individual_buffer_pool_info:
-			innodb_status['buffer_pool_pages_data'] = longish(istatus[2])
-		
-		elif "Modified db pages" in line and not individual_buffer_pool_info:
-			innodb_status['buffer_pool_pages_dirty'] = longish(istatus[3])
-		
-		elif "Pages read" in line and "ahead" not in line and not individual_buffer_pool_info:
-				innodb_status['pages_read'] = longish(istatus[2])
-				innodb_status['pages_created'] = longish(istatus[4])
-				innodb_status['pages_written'] = longish(istatus[6])
-
-		# ROW OPERATIONS
-		elif 'Number of rows inserted' in line:
-			innodb_status['rows_inserted'] = longish(istatus[4])
-			innodb_status['rows_updated'] = longish(istatus[6])
-			innodb_status['rows_deleted'] = longish(istatus[8])
-			innodb_status['rows_read'] = longish(istatus[10])
-		
-		elif "queries inside InnoDB" in line:
-			innodb_status['queries_inside'] = longish(istatus[0])
-			innodb_status['queries_queued'] = longish(istatus[4])
+	state = {'in_merged': False, 'individual_buffer_pool_info': False}
+
+	sections = []
+	section = None
+	pos = 0
+	for header in SECTION_HEADER.finditer(innodb_status_raw):
+		sections.append((section, innodb_status_raw[pos:header.start()]))
+		section = header.group(1)
+		pos = header.end()
+	sections.append((section, innodb_status_raw[pos:]))
+
+	for (section, text) in sections:
+		if section in SKIP_SECTIONS:
+			continue
+
+		if section in SECTION_LINES:
+			lines = SECTION_LINES[section].findall(text)
+		else:
+			lines = text.split('\n')
+
+		for line in lines:
+			_parse_status_line(line, innodb_status, innodb_version, state)
 
 	# Some more stats
 	innodb_status['transactions_unpurged'] = innodb_status['transactions'] - innodb_status['transactions_purged']
@@ -33,6 +33,12 @@ THE SOFTWARE.
 ###    v1.0.3 - 2011-12-02
 ###       * Support custom UNIX sockets
 ###
+###    v1.0.4 - 2026-10-18
+###       * Keep one connection open across updates, reconnect when it drops
+###       * Refresh SHOW VARIABLES only every variables_refresh seconds
+###       * Parse SHOW ENGINE INNODB STATUS by section, skipping lock and
+###         deadlock dumps
+###
 ###  Requires:
 ###       * yum install MySQL-python
 ###       * DBUtil.py
@@ -64,13 +70,60 @@ REPORT_MASTER = True
 REPORT_SLAVE  = True
 
 MAX_UPDATE_TIME = 15
+# SHOW VARIABLES rarely changes, so it is refreshed much less often than status
+VARIABLES_UPDATE_TIME = 300
+
+mysql_conn = None
+variables = {}
+variables_last_update = 0
+innodb_plugin_version = None
+
+def get_connection():
+	"""
+	Return the long-lived connection, opening it if needed.
+
+	The gmetric-mysql lock is taken once per connection and held until it
+	closes, instead of a GET_LOCK/RELEASE_LOCK round-trip every update.
+	Returns None if another collector holds the lock.
+	"""
+	global mysql_conn, variables_last_update
+
+	if mysql_conn is None:
+		conn = MySQLdb.connect(**mysql_conn_opts)
+		conn.autocommit(True)
+
+		cursor = conn.cursor(MySQLdb.cursors.DictCursor)
+		cursor.execute("SELECT GET_LOCK('gmetric-mysql', 0) as ok")
+		lock_stat = cursor.fetchone()
+		cursor.close()
+
+		if lock_stat['ok'] == 0:
+			conn.close()
+			return None
+
+		mysql_conn = conn
+		# the server may have been restarted with different settings
+		variables_last_update = 0
+
+	return mysql_conn
+
+def close_connection():
+	global mysql_conn
+
+	if mysql_conn is not None:
+		try:
+			mysql_conn.close()
+		except MySQLdb.Error:
+			pass
+		mysql_conn = None
+
 
 def update_stats(get_innodb=True, get_master=True, get_slave=True):
 	"""
 
 	"""
 	logging.debug('updating stats')
-	global last_update
+	global last_update, variables, variables_last_update, innodb_plugin_version
 	global mysql_stats, mysql_stats_last
 
 	cur_time = time.time()
@@ -89,24 +142,32 @@ def update_stats(get_innodb=True, get_master=True, get_slave=True):
 	mysql_stats = {}
 
 	# Get info from DB
+	reused = mysql_conn is not None
 	try:
-		conn = MySQLdb.connect(**mysql_conn_opts)
+		conn = get_connection()
+		if conn is None:
+			return False
 
-		cursor = conn.cursor(MySQLdb.cursors.DictCursor)
-		cursor.execute("SELECT GET_LOCK('gmetric-mysql', 0) as ok")
-		lock_stat = cursor.fetchone()
-		cursor.close()
+		if cur_time - variables_last_update >= VARIABLES_UPDATE_TIME:
+			cursor = conn.cursor(MySQLdb.cursors.Cursor)
+			cursor.execute("SHOW VARIABLES")
+			#variables = dict(((k.lower(), v) for (k,v) in cursor))
+			variables = {}
+			for (k,v) in cursor:
+				variables[k.lower()] = v
+			cursor.close()
 
-		if lock_stat['ok'] == 0:
-			return False
+			# the storage engine plugin is as static as the variables
+			cursor = conn.cursor(MySQLdb.cursors.Cursor)
+			cursor.execute("SELECT PLUGIN_STATUS, PLUGIN_VERSION FROM `information_schema`.Plugins WHERE PLUGIN_NAME LIKE '%innodb%' AND PLUGIN_TYPE LIKE 'STORAGE ENGINE';")
+			row = cursor.fetchone()
+			if row and row[0] == "ACTIVE":
+				innodb_plugin_version = row[1]
+			else:
+				innodb_plugin_version = None
+			cursor.close()
 
-		cursor = conn.cursor(MySQLdb.cursors.Cursor)
-		cursor.execute("SHOW VARIABLES")
-		#variables = dict(((k.lower(), v) for (k,v) in cursor))
-		variables = {}
-		for (k,v) in cursor:
-			variables[k.lower()] = v
-		cursor.close()
+			variables_last_update = cur_time
 
 		cursor = conn.cursor(MySQLdb.cursors.Cursor)
 		cursor.execute("SHOW /*!50002 GLOBAL */ STATUS")
@@ -116,17 +177,8 @@ def update_stats(get_innodb=True, get_master=True, get_slave=True):
 			global_status[k.lower()] = v
 		cursor.close()
 		
-		cursor = conn.cursor(MySQLdb.cursors.Cursor)
-		cursor.execute("SELECT PLUGIN_STATUS, PLUGIN_VERSION FROM `information_schema`.Plugins WHERE PLUGIN_NAME LIKE '%innodb%' AND PLUGIN_TYPE LIKE 'STORAGE ENGINE';")
-		
-		have_innodb = False
-		innodb_version = 1.0
-		row = cursor.fetchone()
-		
-		if row[0] == "ACTIVE":
-			have_innodb = True
-			innodb_version = row[1]
-		cursor.close()
+		have_innodb = innodb_plugin_version is not None
+		innodb_version = innodb_plugin_version or 1.0
 
 		# try not to fail ?
 		get_innodb = get_innodb and have_innodb
@@ -136,7 +188,7 @@ def update_stats(get_innodb=True, get_master=True, get_slave=True):
 		if get_innodb:
 			cursor = conn.cursor(MySQLdb.cursors.Cursor)
 			cursor.execute("SHOW /*!50000 ENGINE*/ INNODB STATUS")
-			innodb_status = parse_innodb_status(cursor.fetchone()[2].split('\n'), innodb_version)
+			innodb_status = parse_innodb_status(cursor.fetchone()[2], innodb_version)
 			cursor.close()
 			logging.debug('innodb_status: ' + str(innodb_status))
 
@@ -159,14 +211,16 @@ def update_stats(get_innodb=True, get_master=True, get_slave=True):
 				get_slave = False
 			cursor.close()
 
-		cursor = conn.cursor(MySQLdb.cursors.DictCursor)
-		cursor.execute("SELECT RELEASE_LOCK('gmetric-mysql') as ok")
-		cursor.close()
-
-		conn.close()
 	except MySQLdb.OperationalError, (errno, errmsg):
 		logging.error('error updating stats')
 		logging.error(errmsg)
+		close_connection()
+
+		# server has gone away / lost connection: the idle session was
+		# dropped, so reconnect once right away instead of skipping a cycle
+		if reused and errno in (2006, 2013):
+			last_update = cur_time - time_delta
+			return update_stats(get_innodb, get_master, get_slave)
 		return False
 
 	# process variables
@@ -361,6 +415,7 @@ def get_stat(name):
 def metric_init(params):
 	global descriptors
 	global mysql_conn_opts
+	global VARIABLES_UPDATE_TIME
 	global mysql_stats
 	global delta_per_second
 
@@ -387,6 +442,9 @@ def metric_init(params):
 	if params.get("delta_per_second", '') != '':
 		delta_per_second = True
 
+	if params.get('variables_refresh', '') != '':
+		VARIABLES_UPDATE_TIME = int(params.get('variables_refresh'))
+
 	master_stats_descriptions = {}
 	innodb_stats_descriptions = {}
 	slave_stats_descriptions  = {}
@@ -1125,6 +1183,7 @@ def metric_init(params):
 	return descriptors
 
 def metric_cleanup():
+	close_connection()
 	logging.shutdown()
 	# pass
 
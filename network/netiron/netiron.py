@@ -9,6 +9,8 @@ import sys
 import os
 import re
 import time
+import threading
+import Queue
 from pysnmp.entity.rfc3413.oneliner import cmdgen
 NIPARAMS = {}
 
@@ -18,6 +20,20 @@ NIMETRICS = {
 }
 LAST_NIMETRICS = dict(NIMETRICS)
 NIMETRICS_CACHE_MAX = 5
+SNMPTABLE = {}
+
+# SNMP request timeout (seconds) and retries per switch
+SNMP_TIMEOUT = 1
+SNMP_RETRIES = 1
+# max-repetitions of the GETBULK requests used to walk the interface
+# table, 0 walks it with GETNEXT one row at a time instead
+BULK_REPETITIONS = 25
+# switches walked in parallel, and how long a refresh waits for all of them
+POLL_WORKERS = 8
+POLL_TIMEOUT = 30
+# ipaddr -> seconds the last walk took, metric name -> ipaddr
+POLL_LATENCY = {}
+LATENCY_METRICS = {}
 
 descriptors = list()
 
@@ -31,6 +47,9 @@ oidDict = {
     'ifOutUcastPkts' : (1,3,6,1,2,1,2,2,1,17),
     }
 
+# columns walked, the order that oid's are passed determines the order in the results
+COLUMNS = ['ifAlias', 'ifIndex', 'ifName', 'ifHCInOctets', 'ifHCOutOctets', 'ifInUcastPkts', 'ifOutUcastPkts']
+
 def get_metrics():
     """Return all metrics"""
 
@@ -39,11 +58,11 @@ def get_metrics():
     # if interval since last check > NIMETRICS_CACHE_MAX get metrics again
     if (time.time() - NIMETRICS['time']) > NIMETRICS_CACHE_MAX:
         metrics = {}
-        for para in NIPARAMS.keys():
-            if para.startswith('netiron_'):
-                ipaddr,name = NIPARAMS[para].split(':')
-                snmpTable = runSnmp(oidDict,ipaddr)
-                newmetrics = buildDict(oidDict,snmpTable,name)
+        switches = get_switches()
+        pollSwitches([ipaddr for (ipaddr, name) in switches])
+        for ipaddr,name in switches:
+            if ipaddr in SNMPTABLE:
+                newmetrics = buildDict(oidDict,SNMPTABLE[ipaddr],name)
                 metrics = dict(newmetrics, **metrics)
 
         # update cache
@@ -71,6 +90,74 @@ def get_delta(name):
 
     return delta
 
+def get_latency(name):
+    """Return how long the last SNMP walk of the switch took"""
+    return POLL_LATENCY.get(LATENCY_METRICS[name], 0)
+
+def get_switches():
+    """Return [(ipaddr, name)] for the switches in the params"""
+    return [tuple(NIPARAMS[para].split(':')) for para in sorted(NIPARAMS.keys()) if para.startswith('netiron_')]
+
+def pollWorker(jobs, done):
+    while True:
+        try:
+            ipaddr = jobs.get_nowait()
+        except Queue.Empty:
+            return
+        start = time.time()
+        try:
+            snmpTable = runSnmp(oidDict,ipaddr)
+        except Exception, e:
+            print '[netiron] polling %s failed: %s' % (ipaddr, e)
+            snmpTable = None
+        done.put((ipaddr, snmpTable, time.time() - start))
+
+# Walks all switches in parallel, at most POLL_WORKERS at a time, and
+# replaces SNMPTABLE with the results in one go. Switches that fail or do
+# not answer within POLL_TIMEOUT keep their previous table.
+def pollSwitches(ipaddrs):
+    global SNMPTABLE, POLL_LATENCY
+
+    jobs = Queue.Queue()
+    done = Queue.Queue()
+    for ipaddr in ipaddrs:
+        jobs.put(ipaddr)
+
+    start = time.time()
+    workers = []
+    for i in range(min(POLL_WORKERS, len(ipaddrs))):
+        worker = threading.Thread(target=pollWorker, args=(jobs, done))
+        # a hung walk must not keep gmond from exiting
+        worker.setDaemon(True)
+        worker.start()
+        workers.append(worker)
+
+    deadline = start + POLL_TIMEOUT
+    for worker in workers:
+        worker.join(max(deadline - time.time(), 0))
+
+    # stop workers still busy past the deadline from picking up more
+    # switches, whatever they return now is dropped with the done queue
+    while True:
+        try:
+            jobs.get_nowait()
+        except Queue.Empty:
+            break
+
+    table = dict(SNMPTABLE)
+    latency = dict([(ipaddr, POLL_TIMEOUT) for ipaddr in ipaddrs])
+    while True:
+        try:
+            ipaddr, snmpTable, elapsed = done.get_nowait()
+        except Queue.Empty:
+            break
+        latency[ipaddr] = elapsed
+        if snmpTable is not None:
+            table[ipaddr] = snmpTable
+
+    SNMPTABLE = table
+    POLL_LATENCY = latency
+
 # Separate routine to perform SNMP queries and returns table (dict)
 def runSnmp(oidDict,ip):
     
@@ -82,18 +169,16 @@ def runSnmp(oidDict,ip):
 #    ifHCOutOctets = (1,3,6,1,2,1,31,1,1,1,10)
 
     #Runs the SNMP query, The order that oid's are passed determines the order in the results
-    errorIndication, errorStatus, errorIndex, varBindTable = cmdgen.CommandGenerator().nextCmd(
-        # SNMP v2
-        cmdgen.CommunityData('test-agent', 'public'),
-        cmdgen.UdpTransportTarget((ip, 161)),
-        oidDict['ifAlias'],
-        oidDict['ifIndex'],
-        oidDict['ifName'],
-        oidDict['ifHCInOctets'],
-        oidDict['ifHCOutOctets'],
-        oidDict['ifInUcastPkts'],
-        oidDict['ifOutUcastPkts'],
-        )
+    # SNMP v2
+    authData = cmdgen.CommunityData('test-agent', 'public')
+    transport = cmdgen.UdpTransportTarget((ip, 161), timeout=SNMP_TIMEOUT, retries=SNMP_RETRIES)
+    oids = [oidDict[column] for column in COLUMNS]
+    if BULK_REPETITIONS:
+        errorIndication, errorStatus, errorIndex, varBindTable = cmdgen.CommandGenerator().bulkCmd(
+            authData, transport, 0, BULK_REPETITIONS, *oids)
+    else:
+        errorIndication, errorStatus, errorIndex, varBindTable = cmdgen.CommandGenerator().nextCmd(
+            authData, transport, *oids)
     # Check for SNMP errors
     if errorIndication:
         print errorIndication
@@ -103,36 +188,55 @@ def runSnmp(oidDict,ip):
                 errorStatus.prettyPrint(), errorIndex and varBindTable[-1][int(errorIndex)-1] or '?'
                 )
         else:
-            return(varBindTable)
+            return(assembleRows(varBindTable))
+
+# Turns the rows of a walk into {ifIndex: {column: value}} in one pass. The
+# value for a column is only taken if its oid is inside that column, GETBULK
+# responses run past the end of the table.
+def assembleRows(varBindTable):
+    columns = [(column, tuple(oidDict[column]), len(oidDict[column])) for column in COLUMNS]
+    rows = {}
+    for varBinds in varBindTable:
+        for (column, prefix, size), (oid, value) in zip(columns, varBinds):
+            oid = tuple(oid)
+            if len(oid) == size + 1 and oid[:size] == prefix:
+                rows.setdefault(oid[size], {})[column] = value
+    return rows
 
-def buildDict(oidDict,t,netiron): # passed a list of tuples, build's a dict based on the alias name
+def buildDict(oidDict,rows,netiron): # passed the rows from assembleRows, build's a dict based on the alias name
     builtdict = {}
     
-    for line in t:
-        #        if t[t.index(line)][2][1] != '':
-        string = str(t[t.index(line)][2][1])
+    for index in sorted(rows.keys()):
+        row = rows[index]
+        if len(row) < len(COLUMNS):
+            # walk ended before this row was complete
+            continue
+        string = str(row['ifName'])
         match = re.search(r'ethernet', string)
-        if match and t[t.index(line)][0][1] != '':
-            alias = str(t[t.index(line)][0][1])
-            index = str(t[t.index(line)][1][1])
-            name = str(t[t.index(line)][2][1])
-            hcinoct = str(t[t.index(line)][3][1])
-            builtdict[netiron+'_'+alias+'_bitsin'] = int(hcinoct) * 8
-            hcoutoct = str(t[t.index(line)][4][1])
-            builtdict[netiron+'_'+alias+'_bitsout'] = int(hcoutoct) * 8
-            hcinpkt = str(t[t.index(line)][5][1])
-            builtdict[netiron+'_'+alias+'_pktsin'] = int(hcinpkt)
-            hcoutpkt = str(t[t.index(line)][6][1])
-            builtdict[netiron+'_'+alias+'_pktsout'] = int(hcoutpkt)
+        if match and str(row['ifAlias']) != '':
+            alias = str(row['ifAlias'])
+            builtdict[netiron+'_'+alias+'_bitsin'] = int(row['ifHCInOctets']) * 8
+            builtdict[netiron+'_'+alias+'_bitsout'] = int(row['ifHCOutOctets']) * 8
+            builtdict[netiron+'_'+alias+'_pktsin'] = int(row['ifInUcastPkts'])
+            builtdict[netiron+'_'+alias+'_pktsout'] = int(row['ifOutUcastPkts'])
             
     return builtdict
 
-# define_metrics will run an snmp query on an ipaddr, find interfaces, build descriptors and set spoof_host
-# define_metrics is called from metric_init
+# define_metrics will find interfaces in the snmp table of an ipaddr, build descriptors and set spoof_host
+# define_metrics is called from metric_init, after all netirons have been polled
 def define_metrics(Desc_Skel, ipaddr, netiron):
-    snmpTable = runSnmp(oidDict,ipaddr)
-    aliasdict = buildDict(oidDict,snmpTable,netiron)
+    aliasdict = buildDict(oidDict,SNMPTABLE.get(ipaddr, {}),netiron)
     spoof_string = ipaddr + ':' + netiron
+
+    LATENCY_METRICS[netiron+'_poll_latency'] = ipaddr
+    descriptors.append(create_desc(Desc_Skel, {
+                "name"        : netiron+'_poll_latency',
+                "call_back"   : get_latency,
+                "units"       : "seconds",
+                "format"      : "%.3f",
+                "description" : "time taken by the last SNMP poll",
+                "spoof_host"  : spoof_string,
+                }))
     #print newdict
 
     for key in aliasdict.keys():
@@ -174,6 +278,7 @@ def define_metrics(Desc_Skel, ipaddr, netiron):
 
 def metric_init(params):
     global descriptors, Desc_Skel, _Worker_Thread, Debug, newdict
+    global SNMP_TIMEOUT, SNMP_RETRIES, BULK_REPETITIONS, POLL_WORKERS, POLL_TIMEOUT
 
     print '[netiron] Received the following parameters'
     print params
@@ -182,6 +287,12 @@ def metric_init(params):
     for key in params:
         NIPARAMS[key] = params[key]
 
+    SNMP_TIMEOUT = float(params.get('snmp_timeout', SNMP_TIMEOUT))
+    SNMP_RETRIES = int(params.get('snmp_retries', SNMP_RETRIES))
+    BULK_REPETITIONS = int(params.get('bulk_repetitions', BULK_REPETITIONS))
+    POLL_WORKERS = int(params.get('poll_workers', POLL_WORKERS))
+    POLL_TIMEOUT = float(params.get('poll_timeout', POLL_TIMEOUT))
+
     Desc_Skel = {
         'name'        : 'XXX',
         'call_back'   : get_delta,
@@ -194,13 +305,12 @@ def metric_init(params):
         'groups'      : 'netiron',
         }  
 
-    # Find all the netiron's passed in params    
-    for para in params.keys():
-         if para.startswith('netiron_'):
-             #Get ipaddr + name of netirons from params
-             ipaddr,name = params[para].split(':')
-             # pass skel, ip and name to define_metrics to create descriptors
-             descriptors = define_metrics(Desc_Skel, ipaddr, name)
+    # Find all the netiron's passed in params and poll them all at once
+    netirons = get_switches()
+    pollSwitches([ipaddr for (ipaddr, name) in netirons])
+    for ipaddr,name in netirons:
+        # pass skel, ip and name to define_metrics to create descriptors
+        descriptors = define_metrics(Desc_Skel, ipaddr, name)
     #Return the descriptors back to gmond
     return descriptors
 
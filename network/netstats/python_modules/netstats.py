@@ -4,6 +4,8 @@ import time
 import copy
 import string
 
+import procfs_snapshot
+
 PARAMS = {}
 
 METRICS = {
@@ -25,34 +27,18 @@ def get_metrics():
 
     if (time.time() - METRICS['time']) > METRICS_CACHE_MAX:
 
-	new_metrics = {}
-
-	for file in stats_files:
-	    try:
-		file = open(file, 'r')
-	
-	    except IOError:
-		return 0
-    
-	    # convert to dict
-	    metrics = {}
-	    for line in file:
-		if re.match("(.*): [0-9]", line):
-		    count = 0
-		    metrics = re.split("\s+", line)
-		    metric_group = metrics[0].replace(":", "").lower()
-		    new_metrics[metric_group] = dict()
-		    for value in metrics:
-			# Skip first
-			if count > 0 and value >= 0 and count in stats_pos[metric_group]:
-			    metric_name = stats_pos[metric_group][count]
-			    new_metrics[metric_group][metric_name] = value
-			count += 1
-
-	    file.close()
-
-        # update cache
-        LAST_METRICS = copy.deepcopy(METRICS)
+        new_metrics = {}
+
+        for file in stats_files:
+            try:
+                snapshot = procfs_snapshot.get(file)
+            except IOError:
+                return 0
+
+            new_metrics.update(snapshot.data)
+
+        # update cache, snapshots are immutable so no copy is needed
+        LAST_METRICS = METRICS
         METRICS = {
             'time': time.time(),
             'data': new_metrics
@@ -170,39 +156,24 @@ def metric_init(params):
     ####################################################################################
     # Let's figure out what metrics are available
     #
-    # Read /proc/net/netstat
+    # Read /proc/net/netstat and /proc/net/snmp
     ####################################################################################
     for file in stats_files:
-	try:
-	    file = open(file, 'r')
-    
-	except IOError:
-	    return 0
-	
-	# Find mapping
-	for line in file:
-	    # Lines with 
-	    if not re.match("(.*): [0-9]", line):
-		count = 0
-		mapping = re.split("\s+", line)
-		metric_group = mapping[0].replace(":", "").lower()
-		stats_pos[metric_group] = dict()
-		for metric in mapping:
-		    # Skip first 
-		    if count > 0 and metric != "":
-			lowercase_metric = metric.lower()
-			stats_pos[metric_group][count] = lowercase_metric
-		    count += 1
-    
-	file.close()
+        try:
+            snapshot = procfs_snapshot.get(file)
+        except IOError:
+            return 0
+
+        for metric_group in snapshot.data:
+            stats_pos[metric_group] = sorted(snapshot.data[metric_group])
 
     for group in stats_pos:
-	for item in stats_pos[group]:
-	    descriptors.append(create_desc(Desc_Skel, {
-		    "name"       : group + "_" + stats_pos[group][item],
-		    "description": stats_pos[group][item],
-		    'groups'	 : group
-		    }))
+        for item in stats_pos[group]:
+            descriptors.append(create_desc(Desc_Skel, {
+                "name"       : group + "_" + item,
+                "description": item,
+                'groups'     : group
+                }))
 
     descriptors.append(create_desc(Desc_Skel, {
 	"name"       : "tcpext_tcploss_percentage",
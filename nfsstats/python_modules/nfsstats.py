@@ -30,6 +30,13 @@ def test_proc( p_file, p_string ):
 verboselevel = 0
 descriptors = [ ]
 old_values = { }
+rates = { }
+#  name -> descriptor, and file -> descriptors reading from that file
+descriptor_index = { }
+file_index = { }
+last_update = 0
+#  All counters are read and their rates computed at most this often
+STATS_CACHE_MAX = 5
 #  What we want ganglia to monitor, where to find it, how to extract it, ...
 configtable = [
     {
@@ -309,12 +316,14 @@ def metric_init(params):
                 'file': file_str,
                 're': configtable[i]['names'][name]['re']
             })
-            #  And get current value cached as previous value, for future comparisons.
-            (ts, value) =  get_value(configtable[i]['prefix'] + name)
-            old_values[configtable[i]['prefix'] + name] = { 
-                'time':ts,
-                'value':value
-            }
+            #  Turn the extractor RE into a line label and field position once,
+            #  so values can be picked out of a single parse of the file.
+            descriptors[-1].update(compile_extractor(descriptors[-1]['re']))
+            descriptor_index[descriptors[-1]['name']] = descriptors[-1]
+            file_index.setdefault(file_str, []).append(descriptors[-1])
+
+    #  And get current values cached as previous values, for future comparisons.
+    update_stats()
 
     #  Pass ganglia the complete list of dictionaries.
     return descriptors
@@ -325,48 +334,91 @@ def metric_cleanup():
 
 #  metric_init() registered this as the callback function.
 def call_back(name):
-    global old_values
+    update_stats()
+    return rates.get(name, 0.0)
 
-    #  Get new value
-    (new_time, new_value) = get_value(name)
- 
-    #  Calculate rate of change 
-    try:
-        rate = (new_value - old_values[name]['value'])/(new_time - old_values[name]['time'])
-    except ZeroDivisionError:
-        rate = 0.0
+def compile_extractor(regex):
+    """
+    Split an extractor RE like ".*proc3 (?:\S*\s){7}(\S*)" into the line label
+    ('proc3') and the position of the wanted field after the label (7). REs
+    capturing "(\d+.*\d)" sum every field from that position on.
+    """
 
-    #  Stash values for comparison next time round.
-    old_values[name]['value'] = new_value
-    old_values[name]['time'] = new_time
-    return rate
+    return {
+        'line': re.match("\.\*(\S+) ", regex).group(1),
+        'pos': int(re.search("{(\d+)\}", regex).group(1)),
+        'total': regex.endswith("(\d+.*\d)\n")
+    }
 
-def get_value(name):
-    global descriptors
+def read_rpc_stats(path):
+    """
+    Read an rpc stats file once and return { line label: [fields] }
+    """
 
-    #  Search descriptors array for this name's file and extractor RE
-    for i in range(0, len(descriptors)):
-        if descriptors[i]['name'] == name:
-            break
-    contents = file(descriptors[i]['file']).read()
-    m = re.search(descriptors[i]['re'], contents, flags=re.MULTILINE)
+    stats = { }
+    p_fd = open( path )
+    for line in p_fd:
+        fields = line.split()
+        if fields:
+            stats[fields[0]] = fields[1:]
+    p_fd.close()
+    return stats
 
-    m_value = m.group(1)
+def extract_value(stats, descriptor):
+    fields = stats[descriptor['line']]
 
     #RB: multiple (space seperated) values: calculate sum
-    if string.count( m_value, ' ' ) > 0:
-        m_fields = string.split( m_value, ' ' )
+    if descriptor['total']:
+        return sum([int(f) for f in fields[descriptor['pos']:]])
 
-        sum_value = 0
+    return int(fields[descriptor['pos']])
 
-        for f in m_fields:
-            sum_value = sum_value + int(f)
+def update_stats():
+    """
+    Read each rpc stats file once and recompute the rates of all its counters
+    """
+    global last_update
+
+    now = time.time()
+    if now - last_update < STATS_CACHE_MAX:
+        return
+
+    for path in file_index:
+        try:
+            stats = read_rpc_stats(path)
+        except IOError:
+            continue
+        ts = time.time()
+
+        for d in file_index[path]:
+            name = d['name']
+            try:
+                value = extract_value(stats, d)
+            except (KeyError, IndexError, ValueError):
+                continue
+
+            #  Calculate rate of change
+            if name in old_values:
+                try:
+                    rates[name] = (value - old_values[name]['value'])/(ts - old_values[name]['time'])
+                except ZeroDivisionError:
+                    rates[name] = 0.0
+
+            #  Stash values for comparison next time round.
+            old_values[name] = {
+                'time':ts,
+                'value':value
+            }
+
+    last_update = now
+
+def get_value(name):
+    d = descriptor_index[name]
+    value = extract_value(read_rpc_stats(d['file']), d)
 
-        m_value = sum_value
-    
     #  Return time and value.
     ts = time.time()
-    return (ts, int(m_value))
+    return (ts, value)
 
 def debug(level, text):
     global verboselevel
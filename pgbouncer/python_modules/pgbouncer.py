@@ -3,7 +3,10 @@ import functools
 import time
 import copy
 
+import pg_keepalive
+
 _DSN = None
+_CONN = None
 _DATABASES = None
 _DATABASE_KEY = '.%s'
 _POOLS = None
@@ -33,9 +36,11 @@ class Cache(object):
         return deco
 
 def get_cursor():
-    conn = psycopg2.connect(_DSN)
-    conn.autocommit = True
-    return conn.cursor()
+    '''
+    cursor on the long-lived admin console session
+    '''
+
+    return _CONN.cursor()
 
 @Cache(30)
 def get_metrics():
@@ -191,7 +196,7 @@ def _init_dsn(params):
     initialize the data source name
     '''
 
-    global _DSN
+    global _DSN, _CONN
 
     dsn = dict(
         host=None,
@@ -212,6 +217,12 @@ def _init_dsn(params):
         if val is not None
     ])
 
+    # the admin console does not accept SET, so no statement_timeout here
+    _CONN = pg_keepalive.KeepaliveConnection(
+        _DSN,
+        connect_timeout=params.get('connect_timeout', None)
+    )
+
 def _init_databases(params):
 
     global _DATABASES
@@ -474,7 +485,8 @@ def metric_init(params):
 # ganglia requires metric cleanup
 def metric_cleanup():
     '''Clean up the metric module.'''
-    pass
+    if _CONN is not None:
+        _CONN.close()
 
 # this code is for debugging and unit testing    
 if __name__ == '__main__':
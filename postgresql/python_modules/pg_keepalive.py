@@ -0,0 +1,119 @@
+'''
+Long-lived psycopg2 connection shared by the postgres, pgbouncer and
+redis-queue modules.
+
+Instead of connecting on every cache expiry, each module keeps one
+KeepaliveConnection and asks it for a cursor. The session is reused as long
+as it is healthy; once psycopg2 reports it closed or broken it is replaced on
+the next poll. Failed connection attempts back off exponentially so a down
+server is not hammered with connects (and auth attempts) on every callback.
+
+This is not a metric module and has no metric_init; copy it next to the
+modules using it.
+'''
+
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+# libpq TCP keepalives so a silently dropped session is noticed
+KEEPALIVES_IDLE = 60
+KEEPALIVES_INTERVAL = 10
+KEEPALIVES_COUNT = 3
+
+class KeepaliveConnection(object):
+    '''
+    psycopg2 connection that is opened once, reused between polls and
+    reopened with exponential backoff when it breaks
+    '''
+
+    def __init__(self, dsn, statement_timeout=None, connect_timeout=None,
+            backoff_min=1, backoff_max=60):
+        '''
+        dsn: libpq connection string
+        statement_timeout: milliseconds, set on the session after connecting.
+            Leave as None for pgbouncer's admin console, which does not
+            accept SET statement_timeout
+        connect_timeout: seconds, passed to libpq
+        backoff_min, backoff_max: seconds to wait after a failed connect
+        '''
+
+        dsn_parts = [
+            dsn,
+            'keepalives=1',
+            'keepalives_idle=%d' % KEEPALIVES_IDLE,
+            'keepalives_interval=%d' % KEEPALIVES_INTERVAL,
+            'keepalives_count=%d' % KEEPALIVES_COUNT
+        ]
+        if connect_timeout:
+            dsn_parts.append('connect_timeout=%d' % int(connect_timeout))
+
+        self.dsn = ' '.join([part for part in dsn_parts if part])
+        self.statement_timeout = statement_timeout
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+
+        self.conn = None
+        self.backoff = 0
+        self.next_attempt = 0
+
+    def healthy(self):
+        '''
+        check the session without a round-trip to the server
+        '''
+
+        if self.conn is None or self.conn.closed:
+            return False
+
+        status = self.conn.get_transaction_status()
+        return status not in (
+            psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN,
+            psycopg2.extensions.TRANSACTION_STATUS_INERROR
+        )
+
+    def connect(self):
+        '''
+        open a new session, honouring the reconnect backoff
+        '''
+
+        self.close()
+
+        now = time.time()
+        if now < self.next_attempt:
+            raise psycopg2.OperationalError(
+                'not reconnecting for another %.1f seconds' % (self.next_attempt - now))
+
+        try:
+            conn = psycopg2.connect(self.dsn)
+            conn.autocommit = True
+            if self.statement_timeout:
+                cursor = conn.cursor()
+                cursor.execute('SET statement_timeout = %d' % int(self.statement_timeout))
+                cursor.close()
+        except psycopg2.Error:
+            self.backoff = min(max(self.backoff * 2, self.backoff_min), self.backoff_max)
+            self.next_attempt = time.time() + self.backoff
+            raise
+
+        self.conn = conn
+        self.backoff = 0
+        self.next_attempt = 0
+
+    def cursor(self):
+        '''
+        cursor on the existing session, reconnecting first if it is unhealthy
+        '''
+
+        if not self.healthy():
+            self.connect()
+
+        return self.conn.cursor()
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except psycopg2.Error:
+                pass
+            self.conn = None
@@ -4,6 +4,11 @@ import syslog
 import functools
 import time
 
+import pg_keepalive
+
+# milliseconds, keeps a stuck query from blocking gmond
+STATEMENT_TIMEOUT = 10000
+
 # Cache for postgres query values, this prevents opening db connections for each metric_handler callback
 class Cache(object):
     def __init__(self, expiry):
@@ -26,8 +31,7 @@ class Cache(object):
 @Cache(60)
 def pg_metrics_queries():
     pg_metrics = {}
-    db_conn = psycopg2.connect(pgdsn)
-    db_curs = db_conn.cursor()
+    db_curs = pg_conn.cursor()
 
     # single session state query avoids multiple scans of pg_stat_activity
     # state is a different column name in postgres 9.2, previous versions will have to update this query accordingly
@@ -184,6 +188,14 @@ def metric_init(params):
         if val is not None
     ])
 
+    # one session, reused for every poll
+    global pg_conn
+    pg_conn = pg_keepalive.KeepaliveConnection(
+        pgdsn,
+        statement_timeout=params.get('statement_timeout', STATEMENT_TIMEOUT),
+        connect_timeout=params.get('connect_timeout', None)
+    )
+
     descriptors = [
         {'name':'Pypg_idle_sessions','units':'Sessions','slope':'both','description':'PG Idle Sessions'},
         {'name':'Pypg_active_sessions','units':'Sessions','slope':'both','description':'PG Active Sessions'},
@@ -223,7 +235,7 @@ def metric_init(params):
 # ganglia requires metric cleanup
 def metric_cleanup():
     '''Clean up the metric module.'''
-    pass
+    pg_conn.close()
 
 # this code is for debugging and unit testing    
 if __name__ == '__main__':
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#  Compares one refresh plus one read of every queue metric, the old way
+#  and the current one:
+#
+#    legacy   decode the full /api/queues document, index the entries by
+#             name, then split the metric name and the '?' separated
+#             keyToPath entry on every read
+#    compact  decode the document as returned with columns=, keep only the
+#             reported metrics in arrays (compactEntries), then read them
+#             through the metricPaths built at metric_init
+#
+#  The queue entry in corpus/ is a mirrored queue from a 3.3 broker, it is
+#  repeated under different names for an increasing number of queues. Every
+#  queue gets all of QUEUE_METRICS, as buildQueueDescriptors does.
+#
+#  Usage: python bench_paths.py [-n repeats]
+
+import json
+import os
+import sys
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python_modules'))
+
+import rabbitmq
+from rabbitmq import JSON_PATH_SEPARATOR, METRIC_TOKEN_SEPARATOR, QUEUE_METRICS, keyToPath, compile_path
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+QUEUE_COUNTS = (10, 100, 1000, 5000, 20000)
+
+
+def legacy_dig_it_up(obj, path):
+    try:
+        path = path.split(JSON_PATH_SEPARATOR)
+        return reduce(lambda x, y: x[y], path, obj)
+    except:
+        return False
+
+
+def only_columns(entry):
+    # what the management API sends back for columnsFor(QUEUE_METRICS)
+    columns = {'name': entry['name']}
+    for metric in QUEUE_METRICS:
+        path = compile_path(keyToPath[metric])
+        if path[0] in entry:
+            if len(path) == 1:
+                columns[path[0]] = entry[path[0]]
+            else:
+                columns.setdefault(path[0], {})[path[1]] = entry[path[0]][path[1]]
+    if 'idle_since' in entry:
+        columns['idle_since'] = entry['idle_since']
+    return columns
+
+
+def build(entry, count):
+    entries = []
+    names = []
+    metric_paths = {}
+    for i in range(count):
+        queue = 'orders.events.%d' % i
+        entries.append(dict(entry, name=queue))
+        for metric in QUEUE_METRICS:
+            name = METRIC_TOKEN_SEPARATOR.join((metric, queue, '-'))
+            names.append(name)
+            metric_paths[name] = (metric, queue, '/')
+    full = json.dumps(entries)
+    columns = json.dumps([only_columns(e) for e in entries])
+    return full, columns, names, metric_paths
+
+
+def run_legacy(full, columns, names):
+    compiled_results = {('queues', '/'): dict([(e['name'], e) for e in json.loads(full)])}
+    for name in names:
+        stat_name, queue_name, vhost = name.split(METRIC_TOKEN_SEPARATOR)
+        vhost = vhost.replace('-', '/')
+        result = compiled_results[('queues', vhost)]
+        legacy_dig_it_up(result, keyToPath[stat_name] % queue_name)
+
+
+def run_compact(full, columns, names):
+    rabbitmq.compiled_results = {('queues', '/'): rabbitmq.compactEntries(json.loads(columns), QUEUE_METRICS)}
+    for name in names:
+        rabbitmq.getQueueStat(name)
+
+
+def timeit(func, args, repeats):
+    start = time.time()
+    for i in range(repeats):
+        func(*args)
+    return (time.time() - start) * 1000.0 / repeats
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option('-n', '--repeats', dest='repeats', type='int', default=5, help='refreshes per measurement')
+    (options, args) = parser.parse_args()
+
+    entry = json.load(open(os.path.join(CORPUS_DIR, 'queue_3.3.json')))
+    rabbitmq.zero_rates_when_idle = True
+
+    for count in QUEUE_COUNTS:
+        full, columns, names, rabbitmq.metricPaths = build(entry, count)
+        args = (full, columns, names)
+        old_ms = timeit(run_legacy, args, options.repeats)
+        new_ms = timeit(run_compact, args, options.repeats)
+        print '%5d queues  json %8d -> %8d bytes  legacy %9.3f ms  compact %9.3f ms  (%.1fx)' % \
+            (count, len(full), len(columns), old_ms, new_ms, old_ms / max(new_ms, 0.001))
@@ -2,11 +2,19 @@
 import sys
 import os
 import json
+import urllib
 import urllib2
 import time
+from array import array
 from string import Template
 import itertools
 import threading
+import traceback
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 global url, descriptors, last_update, vhost, username, password, url_template, result, result_dict, keyToPath
 
@@ -14,7 +22,11 @@ global url, descriptors, last_update, vhost, username, password, url_template, r
 JSON_PATH_SEPARATOR = "?"
 METRIC_TOKEN_SEPARATOR = "___"
  
-INTERVAL = 10
+REFRESH_RATE = 15
+TIMEOUT = 10
+# report only the N deepest queues of each vhost instead of every queue, 0 to disable
+TOP_QUEUES = 0
+_Worker_Thread = None
 descriptors = list()
 username, password = "guest", "guest"
 stats = {}
@@ -22,6 +34,8 @@ keyToPath = {}
 last_update = None
 #last_update = {}
 compiled_results = {"nodes" : None, "queues" : None, "connections" : None}
+# metric name -> (stat name, queue or node name or rank, vhost), filled in by metric_init
+metricPaths = {}
 #Make initial stat test time dict
 #for stat_type in ('queues', 'connections','exchanges', 'nodes'):
 #    last_update[stat_type] = None
@@ -81,45 +95,150 @@ NODE_METRICS = ['rmq_disk_free', 'rmq_mem_used', 'rmq_disk_free_alarm', 'rmq_run
 def metric_cleanup():
     pass
 
+def compile_path(path):
+    ''' Turn a keyToPath entry into the tuple of keys below the queue or node entry '''
+    return tuple(path.split(JSON_PATH_SEPARATOR)[1:])
+
 def dig_it_up(obj,path):
+    ''' Walk obj along a path compiled by compile_path '''
     try:
-	path = path.split(JSON_PATH_SEPARATOR)
-        return reduce(lambda x,y:x[y],path,obj)
-    except:
-        print "Exception"
+        for key in path:
+            obj = obj[key]
+        return obj
+    except (KeyError, IndexError, TypeError):
         return False
 
+def toFloat(value):
+    #Convert Booleans, missing values are reported as 0
+    if value is True:
+        return 1.0
+    try:
+        return float(value or 0)
+    except ValueError:
+        return 0.0
+
+def columnsFor(metrics, extra = ()):
+    ''' columns= parameter asking the management API for just these metrics '''
+    columns = ['name'] + list(extra)
+    for metric in metrics:
+        columns.append('.'.join(compile_path(keyToPath[metric])))
+    return ','.join(columns)
+
+def iterEntries(f):
+    ''' Decode a JSON list one entry at a time when ijson is installed '''
+    if ijson is not None:
+        return ijson.items(f, 'item')
+    return json.load(f)
+
+def compactEntries(entries, metrics):
+    ''' Keep only the given metrics of each entry, in one array of doubles
+    per metric, and an index of entry name to position in the arrays '''
+
+    paths = [(metric, compile_path(keyToPath[metric]), metric in RATE_METRICS) for metric in metrics]
+    names = []
+    values = dict([(metric, array('d')) for metric in metrics])
+
+    for entry in entries:
+        names.append(entry['name'])
+        idle = zero_rates_when_idle and 'idle_since' in entry
+        for metric, path, rate in paths:
+            if idle and rate:
+                values[metric].append(0.0)
+            else:
+                values[metric].append(toFloat(dig_it_up(entry, path)))
+
+    return {
+        'names': names,
+        'index': dict([(name, i) for (i, name) in enumerate(names)]),
+        'values': values,
+    }
+
+def topEntries(result, metric, count):
+    ''' Positions of the count entries with the highest value of metric '''
+    column = result['values'][metric]
+    return sorted(range(len(column)), key = column.__getitem__, reverse = True)[:count]
+
 def refreshStats(stats = ('nodes', 'queues'), vhosts = ['/']):
+    ''' Fetch the stats from the management API and return them keyed by
+    (stat, vhost). Only the columns of the reported metrics are requested
+    and kept, see compactEntries. '''
 
     global url_template
-    global last_update, url, compiled_results
 
-    now = time.time()
+    results = {}
+    for stat in stats:
+        if stat == 'nodes':
+            metrics, extra = NODE_METRICS, ()
+        else:
+            metrics, extra = QUEUE_METRICS, ('idle_since',)
+
+        for vhost in vhosts:
+            if stat in ('nodes'):
+                vhost = '/'
+                urlstring = url_template.safe_substitute(stats = stat, vhost = '')
+            else:
+                urlstring = url_template.safe_substitute(stats = stat, vhost = urllib.quote(vhost, ''))
+            urlstring += '?columns=' + columnsFor(metrics, extra)
+            print urlstring
+            f = urllib2.urlopen(urlstring, None, TIMEOUT)
+            try:
+                result = compactEntries(iterEntries(f), metrics)
+            finally:
+                f.close()
+            if TOP_QUEUES and stat == 'queues':
+                result['top'] = topEntries(result, 'rmq_messages', TOP_QUEUES)
+            results[(stat, vhost)] = result
+
+    return results
+
+
+class UpdateRabbitThread(threading.Thread):
+    ''' Refreshes compiled_results every refresh_rate seconds so the metric
+    callbacks only read the last complete set of stats and never wait on
+    the management API '''
+
+    def __init__(self, refresh_rate):
+        threading.Thread.__init__(self)
+        self.running = False
+        self.shuttingdown = False
+        self.refresh_rate = refresh_rate
+        self.started = time.time()
+        self._wakeup = threading.Event()
+
+    def shutdown(self):
+        self.shuttingdown = True
+        self._wakeup.set()
+        if not self.running:
+            return
+        self.join()
+
+    def run(self):
+        self.running = True
+
+        while not self.shuttingdown:
+            self._wakeup.wait(self.refresh_rate)
+            if not self.shuttingdown:
+                self.refresh_metrics()
+
+        self.running = False
+
+    def refresh_metrics(self):
+        global compiled_results, last_update
+
+        try:
+            results = refreshStats(stats = STATS, vhosts = vhosts)
+        except Exception:
+            # keep serving the previous results, rmq_stats_age shows how old they are
+            traceback.print_exc()
+            return False
+
+        # replaced in one assignment, callbacks see either the old or the new stats
+        compiled_results = results
+        last_update = time.time()
+        return True
 
-    if not last_update:
-        diff = INTERVAL
-    else:
-        diff = now - last_update
-
-    if diff >= INTERVAL or not last_update:
-	print "Fetching Results after %d seconds" % INTERVAL
-	last_update = now
-        for stat in stats:
-            for vhost in vhosts:
-                if stat in ('nodes'):
-                    vhost = '/'
-		result_dict = {}
-                urlstring = url_template.safe_substitute(stats = stat, vhost = vhost)
-                print urlstring
-                result = json.load(urllib2.urlopen(urlstring))
-		# Rearrange results so entry is held in a dict keyed by name - queue name, host name, etc.
-		if stat in ("queues", "nodes", "exchanges"):
-		    for entry in result:
-		        name = entry['name']
-			result_dict[name] = entry
-		    compiled_results[(stat, vhost)] = result_dict
-
-    return compiled_results
+    def stats_age(self):
+        return time.time() - (last_update or self.started)
 
 
 def validatedResult(value):
@@ -130,56 +249,46 @@ def validatedResult(value):
 
 def list_queues(vhost):
     global compiled_results
-    queues = compiled_results[('queues', vhost)].keys()
+    queues = compiled_results[('queues', vhost)]['names']
     return queues
 
 def list_nodes():
     global compiled_results
-    nodes = compiled_results[('nodes', '/')].keys()
+    nodes = compiled_results[('nodes', '/')]['names']
     return nodes
 
-def getQueueStat(name):
-    refreshStats(stats = STATS, vhosts = vhosts)
-    #Split a name like "rmq_backing_queue_ack_egress_rate.access"
-    
-    #handle queue names with . in them
-    print name
-    stat_name, queue_name, vhost = name.split(METRIC_TOKEN_SEPARATOR)
-    
-    vhost = vhost.replace('-', '/') #decoding vhost from metric name
-    # Run refreshStats to get the result object
-    result = compiled_results[('queues', vhost)]
-    
-    value = dig_it_up(result, keyToPath[stat_name] % queue_name)
-    
-    if zero_rates_when_idle and stat_name in RATE_METRICS  and 'idle_since' in result[queue_name].keys():
-        value = 0
+def getEntryStat(stat, name):
+    stat_name, entry_name, vhost = metricPaths[name]
 
-    #Convert Booleans
-    if value is True:
-        value = 1
-    elif value is False:
-        value = 0
+    result = compiled_results.get((stat, vhost))
+    if not result or entry_name not in result['index']:
+        return 0.0
+    return result['values'][stat_name][result['index'][entry_name]]
 
-    return float(value)
+def getQueueStat(name):
+    return getEntryStat('queues', name)
 
 def getNodeStat(name):
-    refreshStats(stats = STATS, vhosts = vhosts)
-    #Split a name like "rmq_backing_queue_ack_egress_rate.access"
-    stat_name, node_name, vhost = name.split(METRIC_TOKEN_SEPARATOR)
-    vhost = vhost.replace('-', '/') #decoding vhost from metric name
+    return getEntryStat('nodes', name)
 
-    result = compiled_results[('nodes', '/')]
-    value = dig_it_up(result, keyToPath[stat_name] % node_name)
+def getTopQueueStat(name):
+    stat_name, rank, vhost = metricPaths[name]
 
-    print name,value
-    #Convert Booleans
-    if value is True:
-        value = 1
-    elif value is False:
-        value = 0
+    result = compiled_results.get(('queues', vhost))
+    if not result or rank >= len(result['top']):
+        return 0.0
+    return result['values'][stat_name][result['top'][rank]]
+
+def getTopQueueName(name):
+    stat_name, rank, vhost = metricPaths[name]
 
-    return float(value)
+    result = compiled_results.get(('queues', vhost))
+    if not result or rank >= len(result['top']):
+        return ''
+    return result['names'][result['top'][rank]].encode('ascii', 'ignore')
+
+def getStatsAge(name):
+    return _Worker_Thread.stats_age()
 
 def product(*args, **kwds):
     # replacement for itertools.product
@@ -201,6 +310,7 @@ def str2bool(string):
 def metric_init(params):
     ''' Create the metric definition object '''
     global descriptors, stats, vhost, username, password, urlstring, url_template, compiled_results, STATS, vhosts, zero_rates_when_idle
+    global REFRESH_RATE, TIMEOUT, TOP_QUEUES, _Worker_Thread
     print 'received the following params:'
     #Set this globally so we can refresh stats
     if 'host' not in params:
@@ -215,6 +325,10 @@ def metric_init(params):
     port = params['port']
 
     zero_rates_when_idle = str2bool(params['zero_rates_when_idle'])
+
+    REFRESH_RATE = int(params.get('refresh_rate', REFRESH_RATE))
+    TIMEOUT = float(params.get('timeout', TIMEOUT))
+    TOP_QUEUES = int(params.get('top_queues', TOP_QUEUES))
     
     url = 'http://%s:%s/api/$stats/$vhost' % (host,port)
     base_url = 'http://%s:%s/api' % (host,port)
@@ -222,19 +336,17 @@ def metric_init(params):
     password_mgr.add_password(None, base_url, username, password)
     handler = urllib2.HTTPBasicAuthHandler(password_mgr)
     opener = urllib2.build_opener(handler)
-    opener.open(base_url)
+    opener.open(base_url, None, TIMEOUT)
     urllib2.install_opener(opener)
     url_template = Template(url)
     print params
 
-    refreshStats(stats = STATS, vhosts = vhosts)
-
-    def metric_handler(name):
-        if 15 < time.time() - metric_handler.timestamp:
-            metric_handler.timestamp = time.time()
-            return refreshStats(stats = STATS, vhosts = vhosts)
+    # First fetch is done here to discover the queues and nodes, after
+    # that the stats are refreshed in the background
+    _Worker_Thread = UpdateRabbitThread(REFRESH_RATE)
+    _Worker_Thread.refresh_metrics()
+    _Worker_Thread.start()
 
-            
 
     def create_desc(prop):
 	d = {
@@ -258,9 +370,11 @@ def metric_init(params):
         for vhost, metric in product(vhosts, QUEUE_METRICS):
             queues = list_queues(vhost)
             for queue in queues:
-                name = "{1}{0}{2}{0}{3}".format(METRIC_TOKEN_SEPARATOR, metric, queue, vhost.replace('/', '-'))
+                name = "{1}{0}{2}{0}{3}".format(METRIC_TOKEN_SEPARATOR, metric, queue, vhost.replace('/', '-')).encode('ascii','ignore')
+                # resolved once here instead of splitting the name on every read
+                metricPaths[name] = (metric, queue, vhost)
 		print name
-		d1 = create_desc({'name': name.encode('ascii','ignore'),
+		d1 = create_desc({'name': name,
 		    'call_back': getQueueStat,
                     'value_type': 'float',
 		    'units': 'N',
@@ -274,9 +388,10 @@ def metric_init(params):
     def buildNodeDescriptors():
         for metric in NODE_METRICS:
             for node in list_nodes():
-                name = "{1}{0}{2}{0}-".format(METRIC_TOKEN_SEPARATOR, metric, node)
+                name = "{1}{0}{2}{0}-".format(METRIC_TOKEN_SEPARATOR, metric, node).encode('ascii','ignore')
+                metricPaths[name] = (metric, node, '/')
                 print name
-                d2 = create_desc({'name': name.encode('ascii','ignore'),
+                d2 = create_desc({'name': name,
 		    'call_back': getNodeStat,
                     'value_type': 'float',
 		    'units': 'N',
@@ -287,14 +402,54 @@ def metric_init(params):
                 print d2
                 descriptors.append(d2)
 
-    buildQueueDescriptors()
+    def buildTopQueueDescriptors():
+        # queues change rank between refreshes, so the name of the queue
+        # at each rank is reported as a string metric next to its stats
+        for vhost in vhosts:
+            for rank in range(TOP_QUEUES):
+                top = 'top%d' % (rank + 1)
+                name = "{1}{0}{2}{0}{3}".format(METRIC_TOKEN_SEPARATOR, 'rmq_queue_name', top, vhost.replace('/', '-'))
+                metricPaths[name] = ('rmq_queue_name', rank, vhost)
+                descriptors.append(create_desc({'name': name,
+                    'call_back': getTopQueueName,
+                    'value_type': 'string',
+                    'units': '',
+                    'slope': 'zero',
+                    'format': '%s',
+                    'description': 'Queue_Name',
+                    'groups' : 'rabbitmq,queue'}))
+                for metric in QUEUE_METRICS:
+                    name = "{1}{0}{2}{0}{3}".format(METRIC_TOKEN_SEPARATOR, metric, top, vhost.replace('/', '-'))
+                    metricPaths[name] = (metric, rank, vhost)
+                    descriptors.append(create_desc({'name': name,
+                        'call_back': getTopQueueStat,
+                        'value_type': 'float',
+                        'units': 'N',
+                        'slope': 'both',
+                        'format': '%f',
+                        'description': 'Queue_Metric',
+                        'groups' : 'rabbitmq,queue'}))
+
+    if TOP_QUEUES:
+        buildTopQueueDescriptors()
+    else:
+        buildQueueDescriptors()
     buildNodeDescriptors()
+    descriptors.append(create_desc({'name': 'rmq_stats_age',
+        'call_back': getStatsAge,
+        'value_type': 'float',
+        'units': 'seconds',
+        'slope': 'both',
+        'format': '%.1f',
+        'description': 'Seconds since the stats were last refreshed',
+        'groups' : 'rabbitmq'}))
     # buildTestNodeStat()
 	
     return descriptors
 
 def metric_cleanup():
-    pass
+    if _Worker_Thread is not None:
+        _Worker_Thread.shutdown()
   
 
 if __name__ == "__main__":
@@ -306,6 +461,6 @@ if __name__ == "__main__":
     metric_init(parameters)
     result = refreshStats(stats = ('queues', 'nodes'), vhosts = ('/'))
     print '***'*20
-    getQueueStat('rmq_backing_queue_ack_egress_rate___nfl_client___-')
-    getNodeStat('rmq_disk_free___rmqone@inrmq01d1___-')
-    getNodeStat('rmq_mem_used___rmqone@inrmq01d1___-')
+    for d in descriptors:
+        print d['name'], d['call_back'](d['name'])
+    metric_cleanup()
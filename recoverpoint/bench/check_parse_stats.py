@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+#  Checks that parse_stats reads the get_system_statistics/
+#  get_group_statistics output into the nesting define_metrics and
+#  get_metrics walk, the one yaml.safe_load gave after the ':N' and
+#  'Compression' string replaces the module used to make.
+#
+#  corpus/get_statistics_3.5.txt is laid out the way RecoverPoint 3.5
+#  prints it, two RPAs and two consistency groups, with both quirks:
+#  "Status:Normal" with no space after the colon, and "Compression" run on
+#  from the value of the line before it.
+#
+#  The metrics are compared to values worked out by hand from the sample.
+#  If python YAML is installed, the parsed dict is also compared to what
+#  the old replace + yaml.safe_load made of it.
+#
+#  Usage: python check_parse_stats.py
+
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus', 'get_statistics_3.5.txt')
+
+MB = 1024 * 1024
+
+EXPECTED = {
+    'site_1_rpa_1_latency': 12,
+    'site_1_rpa_1_san': 0.0,
+    'site_1_rpa_1_wan': 432.0,
+    'site_1_rpa_2_latency': 9,
+    'site_1_rpa_2_san': 1.82,
+    'site_1_rpa_2_wan': 3.41,
+    'cg_web_SAN_Traffic': 1.25 * MB,
+    'cg_web_Journal_Lag': 12.5 * MB,
+    'cg_web_Protection_Window': 135.0,
+    'cg_web_WAN_Traffic': 512.0 * 1024,
+    'cg_web_Lag_Writes': 3.0,
+    'cg_web_Lag_Data': 1.5 * MB,
+    'cg_web_Lag_Time': 0.25,
+    'cg_db_SAN_Traffic': 640.0 * 1024,
+    'cg_db_Journal_Lag': 0.0,
+    'cg_db_Protection_Window': 45.0,
+    'cg_db_WAN_Traffic': 1.04 * MB,
+    'cg_db_Lag_Writes': 0.0,
+    'cg_db_Lag_Data': 0.0,
+    'cg_db_Lag_Time': 0.0,
+}
+
+
+def legacy_load(rawdata):
+    import yaml
+    return yaml.safe_load(rawdata.replace(':N',': N').replace("Compression","\n      Compression"))
+
+
+if __name__ == '__main__':
+    try:
+        import paramiko
+    except ImportError:
+        # only the parsing is checked, nothing is sent over SSH
+        sys.modules['paramiko'] = types.ModuleType('paramiko')
+    import recoverpoint as rp
+
+    stats = rp.parse_stats(open(CORPUS))
+    failed = False
+
+    rp.query_stats = lambda: stats
+    descriptors = rp.define_metrics({'call_back': rp.get_metrics}, stats)
+    names = sorted([d['name'] for d in descriptors])
+    if names != sorted(EXPECTED):
+        print 'metrics defined: %s' % names
+        failed = True
+    for name in sorted(EXPECTED):
+        try:
+            value = rp.get_metrics(name)
+        except Exception, e:
+            value = e
+        if value != EXPECTED[name]:
+            print '%s = %r, expected %r' % (name, value, EXPECTED[name])
+            failed = True
+
+    try:
+        legacy = legacy_load(open(CORPUS).read())
+    except ImportError:
+        print 'yaml is not installed, not compared to yaml.safe_load'
+    else:
+        if legacy != stats:
+            print 'parse_stats and yaml.safe_load differ'
+            failed = True
+
+    if failed:
+        sys.exit(1)
+    print 'ok: %d metrics' % len(EXPECTED)
@@ -6,12 +6,12 @@
 # Compatibility note: Compatible with Recoverpoint version 3.5
 
 
-import yaml
 import warnings
 import pprint
 import time
 import threading
 import re
+import socket
 
 with warnings.catch_warnings():
     warnings.simplefilter("ignore")
@@ -25,9 +25,20 @@ NIMETRICS = {
 #This is the minimum interval between querying the RPA for metrics.
 #Each ssh query takes 1.6s so we limit the interval between getting metrics to this interval.
 NIMETRICS_CACHE_MAX = 10
-RAWDATA = ""
+STATS = {}
 
 ipaddr = ''
+#The SSH connection is kept open between queries, with keepalives so that
+#firewalls don't drop it while idle, and reopened if it has gone away.
+SSHCON = None
+SSH_KEEPALIVE = 30
+SSH_TIMEOUT = 10
+STATS_COMMAND = "get_system_statistics;get_group_statistics"
+#Some versions run "Compression" on from the previous value. It goes on a
+#line of its own at a 6 space indent, as the replace("Compression",
+#"\n      Compression") done before YAML parsing put it: next to
+#"Application (writes)" under Traffic, as in the example below
+COMPRESSION_INDENT = 6
 
 #Example of data structure:
 #{'RPA statistics': {'Site 1 RPA 1': {'Compression CPU usage': '0.00%',
@@ -121,14 +132,84 @@ def create_desc(skel, prop):
     return d
 
 
-def run_ssh_thread(foo,bar):
-    global RAWDATA
+def to_scalar(value):
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+def parse_stats(lines):
+    #Builds the nested dict of the statistics output from the indentation of
+    #each "key: value" line, as it arrives. Keys without a value open a new
+    #level, "Key:Value" (no space after the colon) is accepted as well.
+    stats = {}
+    stack = [(-1, stats)]
+    for line in lines:
+        text = line.strip()
+        if ':' not in text:
+            continue
+        indent = len(line) - len(line.lstrip(' '))
+        pieces = [(indent, text)]
+        glued = text.find('Compression', 1)
+        if glued > 0:
+            pieces = [(indent, text[:glued].rstrip()), (COMPRESSION_INDENT, text[glued:])]
+
+        for indent, text in pieces:
+            key, value = text.split(':', 1)
+            key = key.strip()
+            value = value.strip()
+            while stack[-1][0] >= indent:
+                stack.pop()
+            if value:
+                stack[-1][1][key] = to_scalar(value)
+            else:
+                level = {}
+                stack[-1][1][key] = level
+                stack.append((indent, level))
+    return stats
+
+def get_connection():
+    global SSHCON
+    if SSHCON is not None:
+        transport = SSHCON.get_transport()
+        if transport is not None and transport.is_active():
+            return SSHCON
+        close_connection()
     sshcon = paramiko.SSHClient()
     sshcon.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    sshcon.connect(ipaddr, username='monitor',password='monitor',look_for_keys='False')
-    stdin, stdout, sterr = sshcon.exec_command("get_system_statistics;get_group_statistics")
-    RAWDATA = stdout.read()
-    
+    sshcon.connect(ipaddr, username='monitor',password='monitor',look_for_keys='False',timeout=SSH_TIMEOUT)
+    sshcon.get_transport().set_keepalive(SSH_KEEPALIVE)
+    SSHCON = sshcon
+    return sshcon
+
+def close_connection():
+    global SSHCON
+    if SSHCON is not None:
+        try:
+            SSHCON.close()
+        except Exception:
+            pass
+        SSHCON = None
+
+def query_stats():
+    #Runs the statistics commands on a new channel of the open connection,
+    #if that fails the connection is reopened and the commands run once more
+    for attempt in (1, 2):
+        try:
+            sshcon = get_connection()
+            stdin, stdout, sterr = sshcon.exec_command(STATS_COMMAND, timeout=SSH_TIMEOUT)
+            return parse_stats(stdout)
+        except (paramiko.SSHException, socket.error, EOFError):
+            close_connection()
+            if attempt == 2:
+                raise
+
+def run_ssh_thread(foo,bar):
+    global STATS
+    STATS = query_stats()
 
     
 def get_metrics(name):
@@ -137,9 +218,7 @@ def get_metrics(name):
     metrics = {}
     if (time.time() - NIMETRICS['time']) > NIMETRICS_CACHE_MAX:
         threading.Thread(run_ssh_thread(1,1))
-        rawdata = RAWDATA
-        #Group stats don't leave a space after the colon in some places
-        rawmetrics = yaml.safe_load(rawdata.replace(':N',': N').replace("Compression","\n      Compression"))
+        rawmetrics = STATS
         #Get RPA metrics
         for rpa in rawmetrics['RPA statistics']:
             for metric in rawmetrics['RPA statistics'][rpa]:
@@ -238,11 +317,13 @@ def get_metrics(name):
     
 
 def metric_init(params):
-    global descriptors, Desc_Skel, ipaddr, RAWDATA
+    global descriptors, Desc_Skel, ipaddr, STATS, SSH_KEEPALIVE, SSH_TIMEOUT
     print '[recoverpoint] Recieved the following parameters'
     print params
     ipaddr = params['mgmtip']
     print ipaddr
+    SSH_KEEPALIVE = int(params.get('keepalive', SSH_KEEPALIVE))
+    SSH_TIMEOUT = float(params.get('ssh_timeout', SSH_TIMEOUT))
     spoof_string = ipaddr + ':recoverpoint'
     Desc_Skel = {
         'name'        : 'XXX',
@@ -257,20 +338,15 @@ def metric_init(params):
         'spoof_host'  : spoof_string
         }  
 
-    sshcon = paramiko.SSHClient()
-    sshcon.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    sshcon.connect(ipaddr, username='monitor',password='monitor',look_for_keys='False')
-    stdin, stdout, sterr = sshcon.exec_command("get_system_statistics;get_group_statistics")
-    rawdata = stdout.read()
-    RAWDATA = rawdata
-#    f = 
-    #Group stats don't leave a space after the colon in some places
-    statsDict = yaml.safe_load(rawdata.replace(':N',': N').replace("Compression","\n      Compression"))
-    sshcon.close()
+    statsDict = query_stats()
+    STATS = statsDict
     descriptors = define_metrics(Desc_Skel, statsDict)
 
     return descriptors
 
+def metric_cleanup():
+    close_connection()
+
 # For CLI Debuging:
 if __name__ == '__main__':
     params = {
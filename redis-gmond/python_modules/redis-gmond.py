@@ -1,120 +1,314 @@
 import socket
+import threading
 import time
 #import logging
 
 #logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s\t Thread-%(thread)d - %(message)s", filename='/tmp/gmond.log', filemode='w')
 #logging.debug('starting up')
 
-def metric_handler(name):
+# Redis instances polled, one Instance each: where it is, the prefix of its
+# metric names, the connection kept open to it and its previous counters
+INSTANCES = []
+
+# Metric name -> value, replaced as a whole after every refresh
+VALUES = {}
+
+# Counters reported as per second rates
+RATES = ("total_connections_received", "total_commands_processed")
+
+_Worker_Thread = None
+
+class RedisError(Exception):
+    pass
+
+def encode(*args):
+    return "*%d\r\n" % len(args) + "".join(["$%d\r\n%s\r\n" % (len(a), a) for a in args])
+
+def read_reply(f):
+    """Read one reply off the connection. Error replies are returned, not
+    raised, so the replies to the commands after it are still read."""
+    line = f.readline()
+    if not line.endswith("\r\n"):
+        raise socket.error("connection closed")
+    kind, body = line[0], line[1:-2]
+    if kind == "+":
+        return body
+    if kind == "-":
+        return RedisError(body)
+    if kind == ":":
+        return int(body)
+    if kind == "$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = f.read(length + 2)
+        if len(data) != length + 2:
+            raise socket.error("connection closed")
+        return data[:-2]
+    if kind == "*":
+        length = int(body)
+        if length < 0:
+            return None
+        return [read_reply(f) for i in range(length)]
+    raise socket.error("unexpected reply %r" % line)
+
+def parse_info(info):
+    values = {}
+    for line in info.splitlines():
+        if "" == line or "#" == line[0]:
+            continue
+        n, v = line.split(":", 1)
+        values[n] = v
+    return values
+
+def parse_keyspace(v):
+    # "keys=12,expires=3,avg_ttl=0"
+    return dict([f.split("=", 1) for f in v.split(",")])
+
+class Instance(object):
+
+    def __init__(self, host, port, prefix, auth, timeout):
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+        self.auth = auth
+        self.timeout = timeout
+        self.sock = None
+        self.file = None
+        self.prev = {}
+        self.info_section = "all"
+        # dbs and CONFIG GET parameters reported, set by metric_init
+        self.dbs = []
+        self.config = []
+
+    def commands(self):
+        info = self.info_section and encode("INFO", self.info_section) or encode("INFO")
+        return [info] + [encode("CONFIG", "GET", p) for p in self.config]
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port), self.timeout)
+        self.file = self.sock.makefile("rb")
+        if self.auth is not None:
+            self.sock.sendall(encode("AUTH", self.auth))
+            result = read_reply(self.file)
+            if isinstance(result, RedisError):
+                raise socket.error("AUTH to %s:%d failed: %s" % (self.host, self.port, result))
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.file.close()
+                self.sock.close()
+            except socket.error:
+                pass
+            self.sock = None
+            self.file = None
+
+    def send(self):
+        """Write the whole pipeline, the replies are read by receive()"""
+        if self.sock is None:
+            self.connect()
+        self.sock.sendall("".join(self.commands()))
+
+    def receive(self):
+        info = read_reply(self.file)
+        config = [read_reply(self.file) for p in self.config]
+        if isinstance(info, RedisError):
+            # before 2.6 INFO takes no section
+            if self.info_section:
+                self.info_section = ""
+                return self.send() or self.receive()
+            raise socket.error("INFO on %s:%d failed: %s" % (self.host, self.port, info))
+
+        values = parse_info(info)
+        for reply in config:
+            if isinstance(reply, list) and len(reply) == 2:
+                values["config_" + reply[0]] = reply[1]
+        return values
+
+    def metrics(self, values, now):
+        """Metric name -> value of the values read from this instance"""
+        metrics = {}
+        for n in METRICS:
+            if n == "db0":
+                # keys in db0, or none if db0 is empty
+                metrics[self.prefix + n] = int(parse_keyspace(values.get("db0", "keys=0"))["keys"])
+                continue
+            if n not in values:
+                continue
+            v = values[n]
+            if n == "master_link_status":
+                v = 1 if v == 'up' else 0
+            elif n == "used_memory":
+                v = int(int(v) / 1000)
+            elif n in RATES:
+                # first run, zero out and record the counter
+                v, (prev, then) = int(v), self.prev.get(n, (int(v), now))
+                self.prev[n] = (v, now)
+                v = now > then and max(v - prev, 0) / (now - then) or 0
+            metrics[self.prefix + n] = int(float(v))
+
+        for db in self.dbs:
+            keyspace = parse_keyspace(values.get(db, "keys=0,expires=0"))
+            metrics[self.prefix + db + "_keys"] = int(keyspace["keys"])
+            metrics[self.prefix + db + "_expires"] = int(keyspace["expires"])
+
+        for p in self.config:
+            try:
+                metrics[self.prefix + "config_" + p] = int(values["config_" + p])
+            except (KeyError, ValueError):
+                pass
+
+        return metrics
 
-    # Update from Redis.  Don't thrash.
-    if 15 < time.time() - metric_handler.timestamp:
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((metric_handler.host, metric_handler.port))
-        if metric_handler.auth is not None:
-            s.send("*2\r\n$4\r\nAUTH\r\n$%d\r\n%s\r\n" % (len(metric_handler.auth), metric_handler.auth))
-            result = s.recv(100)
-            if not 'OK' in result:
-                return 0
-        s.send("*1\r\n$4\r\nINFO\r\n")
-        #logging.debug("sent INFO")
-        info = s.recv(4096)
-        #logging.debug("rcvd INFO")
-        if "$" != info[0]:
-            return 0
-        msglen = int(info[1:info.find("\n")])
-        if 4096 < msglen:
-            info += s.recv(msglen - 4096)
-        metric_handler.info = {}
+def refresh():
+    """Read every instance into a new VALUES. The pipelines go out to all
+    instances before any reply is read, so they are served concurrently."""
+    global VALUES
+
+    now = time.time()
+    sent = []
+    for instance in INSTANCES:
+        try:
+            instance.send()
+            sent.append(instance)
+        except (socket.error, ValueError), e:
+            print "[redis-gmond] %s:%d: %s" % (instance.host, instance.port, e)
+            instance.close()
+
+    values = {}
+    for instance in sent:
         try:
-          for line in info.splitlines()[1:]:
-              #logging.debug("line is %s done" % line)
-              if "" == line:
-                  continue
-              if "#" == line[0]:
-                  continue
-              n, v = line.split(":")
-              if n in metric_handler.descriptors:
-                  if n == "master_sync_status":
-                      v = 1 if v == 'up' else 0
-                  if n == "db0":
-                      v = v.split('=')[1].split(',')[0]
-                  if n == "used_memory":
-                      v = int(int(v) / 1000)
-                  if n == "total_connections_received":
-                      # first run, zero out and record total connections
-                      if metric_handler.prev_total_connections == 0:
-                          metric_handler.prev_total_connections = int(v)
-                          v = 0
-                      else:
-                          # calculate connections per second
-                          cps = (int(v) - metric_handler.prev_total_connections) / (time.time() - metric_handler.timestamp)
-                          metric_handler.prev_total_connections = int(v)
-                          v = cps
-                  if n == "total_commands_processed":
-                      # first run, zero out and record total commands
-                      if metric_handler.prev_total_commands == 0:
-                          metric_handler.prev_total_commands = int(v)
-                          v = 0
-                      else:
-                          # calculate commands per second
-                          cps = (int(v) - metric_handler.prev_total_commands) / (time.time() - metric_handler.timestamp)
-                          metric_handler.prev_total_commands = int(v)
-                          v = cps
-                  #logging.debug("submittincg metric %s is %s" % (n, int(v)))
-                  metric_handler.info[n] = int(v) # TODO Use value_type.
-        except Exception, e:
-            #logging.debug("caught exception %s" % e)
-            pass
-        s.close()
-        metric_handler.timestamp = time.time()
-
-    #logging.debug("returning metric_handl: %s %s %s" % (metric_handler.info.get(name, 0), metric_handler.info, metric_handler))
-    return metric_handler.info.get(name, 0)
+            values.update(instance.metrics(instance.receive(), now))
+        except (socket.error, ValueError), e:
+            # a half read reply would be taken for the next one
+            print "[redis-gmond] %s:%d: %s" % (instance.host, instance.port, e)
+            instance.close()
+
+    VALUES = values
+
+class UpdateRedisThread(threading.Thread):
+
+    def __init__(self, refresh_rate):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.refresh_rate = refresh_rate
+        self.shuttingdown = False
+        self._wakeup = threading.Event()
+
+    def shutdown(self):
+        self.shuttingdown = True
+        self._wakeup.set()
+        self.join()
+
+    def run(self):
+        while not self.shuttingdown:
+            self._wakeup.wait(self.refresh_rate)
+            if not self.shuttingdown:
+                refresh()
+
+def metric_handler(name):
+    return VALUES.get(name, 0)
+
+METRICS = {
+    "connected_clients": {"units": "clients"},
+    "connected_slaves": {"units": "slaves"},
+    "blocked_clients": {"units": "clients"},
+    "used_memory": {"units": "KB"},
+    "rdb_changes_since_last_save": {"units": "changes"},
+    "rdb_bgsave_in_progress": {"units": "yes/no"},
+    "master_sync_in_progress": {"units": "yes/no"},
+    "master_link_status": {"units": "yes/no"},
+    #"aof_bgrewriteaof_in_progress": {"units": "yes/no"},
+    "total_connections_received": { "units": "connections/sec" },
+    "instantaneous_ops_per_sec": {"units": "ops"},
+    "total_commands_processed": { "units": "commands/sec" },
+    "expired_keys": {"units": "keys"},
+    "pubsub_channels": {"units": "channels"},
+    "pubsub_patterns": {"units": "patterns"},
+    #"vm_enabled": {"units": "yes/no"},
+    "master_last_io_seconds_ago": {"units": "seconds ago"},
+    "db0": {"units": "keys"},
+}
+
+def parse_instances(params):
+    """The instances param lists [<name>=][<host>:]<port> entries, comma
+    separated. Without it the one instance at host and port is polled, under
+    the plain metric names."""
+    if not params.get("instances"):
+        return [(params.get("host", "127.0.0.1"), int(params.get("port", 6379)), "")]
+
+    instances = []
+    for entry in params["instances"].split(","):
+        entry = entry.strip()
+        name = None
+        if "=" in entry:
+            name, entry = entry.split("=", 1)
+        host, port = "127.0.0.1", entry
+        if ":" in entry:
+            host, port = entry.rsplit(":", 1)
+        if name is None:
+            name = "redis_" + port
+            if host not in ("127.0.0.1", "localhost"):
+                name = "redis_%s_%s" % (host.replace(".", "_"), port)
+        instances.append((host, int(port), name + "_"))
+    return instances
 
 def metric_init(params={}):
-    metric_handler.host = params.get("host", "127.0.0.1")
-    metric_handler.port = int(params.get("port", 6379))
-    metric_handler.auth = params.get("auth", None)
-    metric_handler.timestamp = 0
-    metric_handler.prev_total_commands = 0
-    metric_handler.prev_total_connections = 0
-    metrics = {
-        "connected_clients": {"units": "clients"},
-        "connected_slaves": {"units": "slaves"},
-        "blocked_clients": {"units": "clients"},
-        "used_memory": {"units": "KB"},
-        "rdb_changes_since_last_save": {"units": "changes"},
-        "rdb_bgsave_in_progress": {"units": "yes/no"},
-        "master_sync_in_progress": {"units": "yes/no"},
-        "master_link_status": {"units": "yes/no"},
-        #"aof_bgrewriteaof_in_progress": {"units": "yes/no"},
-        "total_connections_received": { "units": "connections/sec" },
-        "instantaneous_ops_per_sec": {"units": "ops"},
-        "total_commands_processed": { "units": "commands/sec" },
-        "expired_keys": {"units": "keys"},
-        "pubsub_channels": {"units": "channels"},
-        "pubsub_patterns": {"units": "patterns"},
-        #"vm_enabled": {"units": "yes/no"},
-        "master_last_io_seconds_ago": {"units": "seconds ago"},
-        "db0": {"units": "keys"},
-    }
-    metric_handler.descriptors = {}
-    for name, updates in metrics.iteritems():
-        descriptor = {
+    global INSTANCES, VALUES, _Worker_Thread
+
+    auth = params.get("auth", None)
+    timeout = float(params.get("timeout", 2))
+    config = [p.strip() for p in params.get("config", "").split(",") if p.strip()]
+    keyspace = str(params.get("keyspace", "no")).lower() in ("yes", "true", "1")
+
+    INSTANCES = [Instance(host, port, prefix, auth, timeout)
+                 for (host, port, prefix) in parse_instances(params)]
+    for instance in INSTANCES:
+        instance.config = config
+
+    # the first refresh tells which dbs there are
+    VALUES = {}
+    if keyspace:
+        for instance in INSTANCES:
+            try:
+                instance.send()
+                instance.dbs = sorted([n for n in instance.receive() if n.startswith("db") and n[2:].isdigit()])
+            except (socket.error, ValueError), e:
+                print "[redis-gmond] %s:%d: %s" % (instance.host, instance.port, e)
+                instance.close()
+    refresh()
+
+    descriptors = []
+    def add(name, units, description="http://code.google.com/p/redis/wiki/InfoCommand"):
+        descriptors.append({
             "name": name,
             "call_back": metric_handler,
             "time_max": 90,
             "value_type": "int",
-            "units": "",
+            "units": units,
             "slope": "both",
             "format": "%d",
-            "description": "http://code.google.com/p/redis/wiki/InfoCommand",
+            "description": description,
             "groups": "redis",
-        }
-        descriptor.update(updates)
-        metric_handler.descriptors[name] = descriptor
-    return metric_handler.descriptors.values()
+        })
+
+    for instance in INSTANCES:
+        for name, updates in METRICS.iteritems():
+            add(instance.prefix + name, updates["units"])
+        for db in instance.dbs:
+            add(instance.prefix + db + "_keys", "keys", "Keys in %s" % db)
+            add(instance.prefix + db + "_expires", "keys", "Keys with an expiry in %s" % db)
+        for p in instance.config:
+            add(instance.prefix + "config_" + p, "", "CONFIG GET %s" % p)
+
+    _Worker_Thread = UpdateRedisThread(float(params.get("refresh_rate", 15)))
+    _Worker_Thread.start()
+
+    return descriptors
 
 def metric_cleanup():
-    pass
+    if _Worker_Thread is not None:
+        _Worker_Thread.shutdown()
+    for instance in INSTANCES:
+        instance.close()
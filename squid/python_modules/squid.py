@@ -7,6 +7,8 @@ This module will query an squid server via SNMP for metrics
 import sys
 import os
 import re
+import socket
+import httplib
 
 import time
 #import logging
@@ -20,6 +22,84 @@ squid_stats_last = {}
 
 MIN_UPDATE_INTERVAL = 30          # Minimum update interval in seconds
 
+# Where the cache manager is, and seconds it gets to connect and answer
+HOST = 'localhost'
+PORT = 3128
+TIMEOUT = 10
+PASSWD = None
+
+# Cache manager pages read every update, and what separates the key from
+# the value on their lines
+PAGES = ['info', 'counters', '5min']
+SEPARATORS = {'info': ':', 'counters': '=', '5min': '='}
+
+# page -> key -> [(metric, compiled regex extracting its value)], built
+# from stats_descriptions by metric_init
+HANDLERS = {}
+
+NUMBER = re.compile('([0-9.]+)')
+REVERSED = re.compile("(\d+)\s+(.*)$") # reversed "value key" line
+
+# Connection to the cache manager, kept open as long as squid does
+conn = None
+
+def fetch_page(page):
+    """Return the body of a cache manager page"""
+    global conn
+    url = 'cache_object://%s/%s' % (HOST, page)
+    if PASSWD:
+        url += '@' + PASSWD
+    for attempt in (0, 1):
+        reused = conn is not None
+        if not reused:
+            conn = httplib.HTTPConnection(HOST, PORT, timeout=TIMEOUT)
+        try:
+            conn.request('GET', url, headers={'Accept': '*/*', 'Connection': 'keep-alive'})
+            response = conn.getresponse()
+            data = response.read()
+            if response.will_close:
+                # squid 2 ends cache manager replies by closing
+                conn.close()
+                conn = None
+            if response.status != 200:
+                raise IOError('%s: HTTP status %d' % (url, response.status))
+            return data
+        except (httplib.HTTPException, socket.error):
+            if conn is not None:
+                conn.close()
+                conn = None
+            # squid may have closed an idle connection, retry once on a
+            # new one
+            if not reused or attempt:
+                raise
+
+def parse_page(page, data):
+    """Return {metric: raw value} of the lines of a page there are handlers for"""
+    handlers = HANDLERS.get(page, {})
+    separator = SEPARATORS[page]
+    rawstats = {}
+    for stat in data.splitlines():
+        stat = stat.strip()
+        if stat.find(separator) >= 0:
+            [key,value] = stat.split(separator,1)
+            key = key.strip()
+            value = value.lstrip()
+        else:
+            match = REVERSED.search(stat)
+            if not match:
+                continue
+            key, value = match.group(2), match.group(1)
+        if not value or key not in handlers:   # Toss things with no value
+            continue
+        for metric, extract in handlers[key]:
+            if extract is None:
+                rawstats[metric] = value
+            else:
+                match = extract.match(value)
+                if match:
+                    rawstats[metric] = match.group(1)
+    return rawstats
+
 def collect_stats():
     #logging.debug('collect_stats()')
     global last_update
@@ -34,63 +114,41 @@ def collect_stats():
         elapsed_time = now - last_update
         last_update = now
 
-    squid_stats = {}
-
-    # Run squidclient mgr:info to get stats
+    # Read the pages from the cache manager
+    rawstats = {}
     try:
-        stats = {}
-        squidclient = os.popen("squidclient mgr:info")
-    except IOError,e:
-        #logging.error('error running squidclient')
+        for page in PAGES:
+            if page in HANDLERS:
+                rawstats.update(parse_page(page, fetch_page(page)))
+    except (IOError, httplib.HTTPException, socket.error), e:
+        #logging.error('error reading the cache manager: %s' % e)
+        squid_stats = {}
         return False
 
-    # Parse output, splitting everything into key/value pairs
-    rawstats = {}
-    for stat in squidclient.readlines():
-        stat = stat.strip()
-        if stat.find(':') >= 0:
-            [key,value] = stat.split(':',1)
-            if value:     # Toss things with no value
-                value = value.lstrip()
-                rawstats[key] = value
-        else:
-            match = re.search("(\d+)\s+(.*)$",stat) # reversed "value key" line
-            if match:
-                rawstats[match.group(2)] = match.group(1)
-
-    # Use stats_descriptions to convert raw stats to real metrics
-    for metric in stats_descriptions:
-        if stats_descriptions[metric].has_key('key'):
-            if rawstats.has_key(stats_descriptions[metric]['key']):
-                rawstat = rawstats[stats_descriptions[metric]['key']]
-                if stats_descriptions[metric].has_key('match'):
-                    match = re.match(stats_descriptions[metric]['match'],rawstat)
-                    if match:
-                        rawstat = match.group(1)
-                        squid_stats[metric] = rawstat
-                else:
-                    squid_stats[metric] = rawstat
-        if squid_stats.has_key(metric): # Strip trailing non-num text
-            if metric != 'cacheVersionId': # version is special case
-                match = re.match('([0-9.]+)',squid_stats[metric]);
-                squid_stats[metric] = float(match.group(1))
-                if stats_descriptions[metric]['type'] == 'integer':
-                    squid_stats[metric] = int(squid_stats[metric])
+    # Convert raw stats to real metrics
+    stats = {}
+    for metric, rawstat in rawstats.iteritems():
+        if stats_descriptions[metric]['type'] == 'string':
+            stats[metric] = rawstat
+            continue
+        stats[metric] = float(rawstat)
+        if stats_descriptions[metric]['type'] == 'integer':
+            stats[metric] = int(stats[metric])
 
         # Calculate delta for counter stats
-        if metric in squid_stats_last:
-            if stats_descriptions[metric]['type'] == 'counter32':
-                current = squid_stats[metric]
-                squid_stats[metric] = (squid_stats[metric] - squid_stats_last[metric]) / float(elapsed_time)
-                squid_stats_last[metric] = current
+        if stats_descriptions[metric]['type'] == 'counter32':
+            current = stats[metric]
+            if metric in squid_stats_last:
+                stats[metric] = max(current - squid_stats_last[metric], 0) / float(elapsed_time)
             else:
-                squid_stats_last[metric] = squid_stats[metric]
-        else:
-            if metric in squid_stats:
-                squid_stats_last[metric] = squid_stats[metric]
+                stats[metric] = 0.0
+            squid_stats_last[metric] = current
+
+    squid_stats = stats
 
     #logging.debug('collect_stats done')
     #logging.debug('squid_stats: ' + str(squid_stats))
+    return True
 
 def get_stat(name):
     #logging.info("get_stat(%s)" % name)
@@ -102,7 +160,7 @@ def get_stat(name):
         if name.startswith('squid_'):
             label = name[6:]
         else:
-            lable = name
+            label = name
             
             #logging.debug("fetching %s" % label)
         try:
@@ -120,8 +178,15 @@ def metric_init(params):
     global descriptors
     global squid_stats
     global stats_descriptions   # needed for stats extraction in collect_stat()
+    global HOST, PORT, TIMEOUT, PASSWD, MIN_UPDATE_INTERVAL, HANDLERS
 
     #logging.debug("init: " + str(params))
+    params = params or {}
+    HOST = params.get('host', HOST)
+    PORT = int(params.get('port', PORT))
+    TIMEOUT = float(params.get('timeout', TIMEOUT))
+    PASSWD = params.get('cachemgr_passwd', PASSWD)
+    MIN_UPDATE_INTERVAL = float(params.get('refresh_rate', MIN_UPDATE_INTERVAL))
 
     stats_descriptions = dict(
         cacheVersionId = {
@@ -410,12 +475,111 @@ def metric_init(params):
             'key': 'Near Hits',
             'match': '[0-9.]+\s+([0-9.]+)',
             },
+        cacheHttpHits = {
+            'description': 'Number of HTTP hits',
+            'units': 'hits/s',
+            'type': 'counter32',
+            'page': 'counters',
+            'key': 'client_http.hits',
+            },
+        cacheHttpErrors = {
+            'description': 'Number of HTTP errors',
+            'units': 'errors/s',
+            'type': 'counter32',
+            'page': 'counters',
+            'key': 'client_http.errors',
+            },
+        cacheHttpInKb = {
+            'description': 'KB received from clients',
+            'units': 'KB/s',
+            'type': 'counter32',
+            'page': 'counters',
+            'key': 'client_http.kbytes_in',
+            },
+        cacheHttpOutKb = {
+            'description': 'KB sent to clients',
+            'units': 'KB/s',
+            'type': 'counter32',
+            'page': 'counters',
+            'key': 'client_http.kbytes_out',
+            },
+        cacheHttpHitOutKb = {
+            'description': 'KB sent to clients from the cache',
+            'units': 'KB/s',
+            'type': 'counter32',
+            'page': 'counters',
+            'key': 'client_http.hit_kbytes_out',
+            },
+        cacheServerRequests = {
+            'description': 'Number of requests sent to servers',
+            'units': 'requests/s',
+            'type': 'counter32',
+            'page': 'counters',
+            'key': 'server.all.requests',
+            },
+        cacheServerErrors = {
+            'description': 'Number of server errors',
+            'units': 'errors/s',
+            'type': 'counter32',
+            'page': 'counters',
+            'key': 'server.all.errors',
+            },
+        cacheServerInKb = {
+            'description': 'KB received from servers',
+            'units': 'KB/s',
+            'type': 'counter32',
+            'page': 'counters',
+            'key': 'server.all.kbytes_in',
+            },
+        cacheServerOutKb = {
+            'description': 'KB sent to servers',
+            'units': 'KB/s',
+            'type': 'counter32',
+            'page': 'counters',
+            'key': 'server.all.kbytes_out',
+            },
+        cacheHttpRequests_5 = {
+            'description': 'HTTP requests per second - 5 min',
+            'units': 'requests/s',
+            'type': 'float',
+            'page': '5min',
+            'key': 'client_http.requests',
+            },
+        cacheHttpHits_5 = {
+            'description': 'HTTP hits per second - 5 min',
+            'units': 'hits/s',
+            'type': 'float',
+            'page': '5min',
+            'key': 'client_http.hits',
+            },
+        cacheHttpOutKb_5 = {
+            'description': 'KB sent to clients per second - 5 min',
+            'units': 'KB/s',
+            'type': 'float',
+            'page': '5min',
+            'key': 'client_http.kbytes_out',
+            },
+        cacheServerRequests_5 = {
+            'description': 'Requests sent to servers per second - 5 min',
+            'units': 'requests/s',
+            'type': 'float',
+            'page': '5min',
+            'key': 'server.all.requests',
+            },
     )
 
-    descriptors = []
-    collect_stats()
+    # key -> handlers table of each page, every regex compiled once
+    HANDLERS = {}
+    for metric, desc in stats_descriptions.iteritems():
+        if metric == 'cacheVersionId': # version is special case
+            extract = None
+        elif 'match' in desc:
+            extract = re.compile(desc['match'])
+        else:
+            extract = NUMBER
+        HANDLERS.setdefault(desc.get('page', 'info'), {}).setdefault(desc['key'], []).append((metric, extract))
 
-    time.sleep(MIN_UPDATE_INTERVAL)
+    descriptors = []
     collect_stats()
 
     for label in stats_descriptions:
@@ -470,6 +634,7 @@ def metric_init(params):
                 }
             
             d.update(stats_descriptions[label])
+            d.pop('page', None)
             
             descriptors.append(d)
             
@@ -480,7 +645,8 @@ def metric_init(params):
 
 def metric_cleanup():
     #logging.shutdown()
-    pass
+    if conn is not None:
+        conn.close()
 
 #This code is for debugging and unit testing
 if __name__ == '__main__':
@@ -5,6 +5,8 @@ import re
 import time
 import copy
 
+import procfs_snapshot
+
 METRICS = {
     'time' : 0,
     'data' : {}
@@ -41,23 +43,16 @@ def get_metrics():
 
     if (time.time() - METRICS['time']) > METRICS_CACHE_MAX:
 
-	try:
-	    file = open(stat_file, 'r')
-    
-	except IOError:
-	    return 0
-
-        # convert to dict
-        metrics = {}
-        for line in file:
-            parts = re.split("\s+", line)
-            metrics[parts[0]] = list(parts[1:])
+        try:
+            snapshot = procfs_snapshot.get(stat_file)
+        except IOError:
+            return 0
 
-        # update cache
-        LAST_METRICS = copy.deepcopy(METRICS)
+        # update cache, snapshots are immutable so no copy is needed
+        LAST_METRICS = METRICS
         METRICS = {
-            'time': time.time(),
-            'data': metrics
+            'time': snapshot.time,
+            'data': snapshot.data
         }
 
     return [METRICS, LAST_METRICS]
@@ -2,7 +2,9 @@ import sys
 import traceback
 import os
 import re
+import time
 
+import procfs_snapshot
 
 ###############################################################################
 # Explanation of metrics in /proc/meminfo can be found here
@@ -16,25 +18,86 @@ import re
 
 meminfo_file = "/proc/meminfo"
 
-def metrics_handler(name):  
-    try:
-        file = open(meminfo_file, 'r')
+METRICS = {
+    'time' : 0,
+    'data' : {}
+}
+METRICS_CACHE_MAX = 5
+
+###############################################################################
+# Derived metrics. These get the parsed meminfo dict and return kBytes (or a
+# percentage) computed from the same read as every other metric.
+###############################################################################
+def derive_used(meminfo):
+    return meminfo.get('MemTotal', 0) - meminfo.get('MemFree', 0) - \
+        meminfo.get('Buffers', 0) - meminfo.get('Cached', 0)
+
+def derive_available(meminfo):
+    # MemAvailable only exists on kernels >= 3.14
+    if 'MemAvailable' in meminfo:
+        return meminfo['MemAvailable']
+    return meminfo.get('MemFree', 0) + meminfo.get('Buffers', 0) + meminfo.get('Cached', 0)
+
+def derive_used_percent(meminfo):
+    total = meminfo.get('MemTotal', 0)
+    if total == 0:
+        return 0
+    return 100.0 * derive_used(meminfo) / total
+
+def derive_swap_used(meminfo):
+    return meminfo.get('SwapTotal', 0) - meminfo.get('SwapFree', 0)
 
-    except IOError:
+def derive_swap_used_percent(meminfo):
+    total = meminfo.get('SwapTotal', 0)
+    if total == 0:
         return 0
+    return 100.0 * derive_swap_used(meminfo) / total
+
+# Metric name -> function deriving it. Kept out of the descriptors, gmond
+# can only take strings and numbers from those.
+DERIVED = {
+    'mem_used'              : derive_used,
+    'mem_available'         : derive_available,
+    'mem_used_percent'      : derive_used_percent,
+    'mem_swap_used'         : derive_swap_used,
+    'mem_swap_used_percent' : derive_swap_used_percent,
+}
+
+def get_metrics():
+    """Return all metrics, refreshed at most every METRICS_CACHE_MAX seconds"""
+
+    global METRICS
 
-    value = 0
-    for line in file:
-	parts = re.split("\s+", line)
-	if parts[0] == metric_map[name]['name'] + ":" :
-	    # All of the measurements are in kBytes. We want to change them over
-	    # to Bytes
-	    if metric_map[name]['units'] == "Bytes":
-		value = float(parts[1]) * 1024
-	    else:
-                value = parts[1]
-	
-    return float(value)
+    if (time.time() - METRICS['time']) > METRICS_CACHE_MAX:
+
+        meminfo = procfs_snapshot.get(meminfo_file).data
+
+        metrics = {}
+        for metric_name, metric in metric_map.iteritems():
+            if metric['derive'] is not None:
+                value = metric['derive'](meminfo)
+            else:
+                value = meminfo.get(metric['name'], 0)
+
+            # All of the measurements are in kBytes. We want to change them over
+            # to Bytes
+            if metric['units'] == "Bytes":
+                value = value * 1024
+
+            metrics[metric_name] = float(value)
+
+        METRICS = {
+            'time': time.time(),
+            'data': metrics
+        }
+
+    return METRICS
+
+def metrics_handler(name):  
+    try:
+        return get_metrics()['data'][name]
+    except (IOError, KeyError):
+        return 0
 
 def create_desc(skel, prop):
     d = skel.copy()
@@ -43,10 +106,13 @@ def create_desc(skel, prop):
     return d
 
 def metric_init(params):
-    global descriptors, metric_map, Desc_Skel
+    global descriptors, metric_map, Desc_Skel, METRICS_CACHE_MAX
 
     descriptors = []
 
+    if "refresh_rate" in params:
+        METRICS_CACHE_MAX = int(params["refresh_rate"])
+
     Desc_Skel = {
         'name'        : 'XXX',
         'orig_name'   : 'XXX',
@@ -347,12 +413,44 @@ def metric_init(params):
                 "description": "DirectMap2M",
                 }))
 
+    descriptors.append(create_desc(Desc_Skel, {
+                "name"       : "mem_used",
+                "units"      : "Bytes",
+                "description": "Memory used, excluding buffers and page cache (MemTotal - MemFree - Buffers - Cached)",
+                }))
+
+    descriptors.append(create_desc(Desc_Skel, {
+                "name"       : "mem_available",
+                "units"      : "Bytes",
+                "description": "Memory available for new applications without swapping (MemAvailable, or MemFree + Buffers + Cached on older kernels)",
+                }))
+
+    descriptors.append(create_desc(Desc_Skel, {
+                "name"       : "mem_used_percent",
+                "units"      : "%",
+                "format"     : "%.2f",
+                "description": "Percentage of total memory used, excluding buffers and page cache",
+                }))
+
+    descriptors.append(create_desc(Desc_Skel, {
+                "name"       : "mem_swap_used",
+                "units"      : "Bytes",
+                "description": "Amount of swap in use (SwapTotal - SwapFree)",
+                }))
+
+    descriptors.append(create_desc(Desc_Skel, {
+                "name"       : "mem_swap_used_percent",
+                "units"      : "%",
+                "format"     : "%.2f",
+                "description": "Percentage of swap in use",
+                }))
+
     # We need a metric_map that maps metric_name to the index in /proc/meminfo
     metric_map = {}
     
     for d in descriptors:
 	metric_name = d['name']
-        metric_map[metric_name] = { "name": d['orig_name'], "units": d['units'] }
+        metric_map[metric_name] = { "name": d['orig_name'], "units": d['units'], "derive": DERIVED.get(metric_name) }
         
     return descriptors
 
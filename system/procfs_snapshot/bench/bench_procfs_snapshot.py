@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+#  Compares the per tick cost of the old per-module /proc parsing with the
+#  shared procfs_snapshot layer.
+#
+#  One "tick" is what gmond does in one collection cycle with diskstat,
+#  cpu_stats, vm_stats, mem_stats and netstats loaded. The legacy side
+#  replays what those modules did before: mem_stats re-read meminfo for each
+#  of its ~40 metrics and diskstat re-read diskstats for every device.
+#
+#  Opens and bytes read are counted by wrapping open(). For exact syscall
+#  numbers run it under strace, e.g.
+#
+#    strace -c -f -e trace=open,openat,read,close python bench_procfs_snapshot.py
+
+import os
+import re
+import sys
+import time
+import __builtin__
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python_modules'))
+import procfs_snapshot
+
+MEMINFO_METRICS = 40
+
+counters = {'opens': 0, 'bytes': 0}
+_real_open = __builtin__.open
+
+
+class CountingFile(object):
+    def __init__(self, f):
+        self._f = f
+
+    def read(self, *args):
+        data = self._f.read(*args)
+        counters['bytes'] += len(data)
+        return data
+
+    def __iter__(self):
+        for line in self._f:
+            counters['bytes'] += len(line)
+            yield line
+
+    def readlines(self):
+        return list(iter(self))
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._f.close()
+
+
+def counting_open(path, *args):
+    counters['opens'] += 1
+    return CountingFile(_real_open(path, *args))
+
+
+def legacy_tick(devices):
+    # mem_stats: one full parse per metric
+    for i in range(MEMINFO_METRICS):
+        f = open(procfs_snapshot.MEMINFO_FILE, 'r')
+        for line in f:
+            parts = re.split("\s+", line)
+        f.close()
+
+    # cpu_stats and vm_stats: one parse each
+    for path in (procfs_snapshot.STAT_FILE, procfs_snapshot.VMSTAT_FILE):
+        f = open(path, 'r')
+        metrics = {}
+        for line in f:
+            parts = re.split("\s+", line)
+            metrics[parts[0]] = list(parts[1:])
+        f.close()
+
+    # diskstat: one full read per device
+    for dev in devices:
+        with open(procfs_snapshot.DISKSTATS_FILE, 'r') as f:
+            lines = f.readlines()
+        for line in lines:
+            if dev in line:
+                vals = line.split()
+
+    # netstats
+    for path in (procfs_snapshot.NETSTAT_FILE, procfs_snapshot.SNMP_FILE):
+        f = open(path, 'r')
+        for line in f:
+            if re.match("(.*): [0-9]", line):
+                metrics = re.split("\s+", line)
+        f.close()
+
+
+def snapshot_tick(devices):
+    procfs_snapshot.invalidate()
+
+    meminfo = procfs_snapshot.get(procfs_snapshot.MEMINFO_FILE).data
+    for i in range(MEMINFO_METRICS):
+        meminfo.get('MemFree')
+
+    procfs_snapshot.get(procfs_snapshot.STAT_FILE)
+    procfs_snapshot.get(procfs_snapshot.VMSTAT_FILE)
+
+    diskstats = procfs_snapshot.get(procfs_snapshot.DISKSTATS_FILE).data
+    for dev in devices:
+        diskstats.get(dev)
+
+    procfs_snapshot.get(procfs_snapshot.NETSTAT_FILE)
+    procfs_snapshot.get(procfs_snapshot.SNMP_FILE)
+
+
+def run(name, tick, devices, ticks):
+    counters['opens'] = counters['bytes'] = 0
+    start = os.times()
+    for i in range(ticks):
+        tick(devices)
+    end = os.times()
+    cpu = (end[0] - start[0]) + (end[1] - start[1])
+
+    print '%-9s opens/tick: %5d  bytes/tick: %8d  cpu/tick: %.3f ms' % \
+        (name, counters['opens'] / ticks, counters['bytes'] / ticks, cpu * 1000.0 / ticks)
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option('-n', '--ticks', dest='ticks', type='int', default=1000, help='number of ticks to run')
+    (options, args) = parser.parse_args()
+
+    devices = procfs_snapshot.parse_diskstats(procfs_snapshot.read_file(procfs_snapshot.DISKSTATS_FILE)).keys()
+
+    __builtin__.open = counting_open
+    try:
+        run('legacy', legacy_tick, devices, options.ticks)
+        run('snapshot', snapshot_tick, devices, options.ticks)
+    finally:
+        __builtin__.open = _real_open
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+#  Shared /proc snapshots for the gmond system modules.
+#
+#  Notes:
+#    gmond loads every python module into the same interpreter, so a module
+#    level cache here is shared by diskstat, cpu_stats, vm_stats, mem_stats
+#    and netstats. Each /proc file is read with a single open/read and parsed
+#    once per collection tick; every module asking for the same file within
+#    max_age seconds gets the same parsed snapshot back.
+#
+#    Snapshots are immutable: the data dicts refuse modification and all
+#    per-row values are tuples, so consumers can keep the previous snapshot
+#    around for delta calculations without copying it.
+#
+#    This is not a metric module and has no metric_init; it only needs to be
+#    present in the python modules directory next to the modules using it.
+#
+#  License to use, modify, and distribute under the GPL
+#  http://www.gnu.org/licenses/gpl.txt
+
+import threading
+import time
+from collections import namedtuple
+
+# Snapshots younger than this are handed out again instead of re-reading /proc
+SNAPSHOT_MAX_AGE = 1
+
+MEMINFO_FILE = '/proc/meminfo'
+STAT_FILE = '/proc/stat'
+VMSTAT_FILE = '/proc/vmstat'
+DISKSTATS_FILE = '/proc/diskstats'
+NETSTAT_FILE = '/proc/net/netstat'
+SNMP_FILE = '/proc/net/snmp'
+
+Snapshot = namedtuple('Snapshot', ['path', 'time', 'data'])
+
+
+class FrozenDict(dict):
+    """dict that refuses modification once built"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('procfs snapshots are read-only')
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+
+def parse_meminfo(text):
+    """'MemTotal:  16303504 kB' -> {'MemTotal': 16303504}, values in kB"""
+
+    data = {}
+    for line in text.splitlines():
+        key, _, rest = line.partition(':')
+        fields = rest.split()
+        if fields:
+            data[key] = int(fields[0])
+    return FrozenDict(data)
+
+
+def parse_stat(text):
+    """'cpu  1 2 3 ...' -> {'cpu': (1, 2, 3, ...)}"""
+
+    data = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if fields:
+            data[fields[0]] = tuple([int(v) for v in fields[1:]])
+    return FrozenDict(data)
+
+
+def parse_vmstat(text):
+    """'nr_free_pages 12345' -> {'nr_free_pages': 12345}"""
+
+    data = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) == 2:
+            data[fields[0]] = int(fields[1])
+    return FrozenDict(data)
+
+
+def parse_diskstats(text):
+    """'8 0 sda 1 2 3 ...' -> {'sda': (1, 2, 3, ...)}
+
+    The major, minor and name columns are dropped, so index 0 is the number
+    of reads completed."""
+
+    data = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) > 3:
+            data[fields[2]] = tuple([int(v) for v in fields[3:]])
+    return FrozenDict(data)
+
+
+def parse_netstat(text):
+    """Header/value line pairs as found in /proc/net/netstat and
+    /proc/net/snmp -> {'tcpext': {'tcploss': 0, ...}, 'tcp': {...}}
+
+    Group and counter names are lowercased."""
+
+    headers = {}
+    data = {}
+    for line in text.splitlines():
+        group, _, rest = line.partition(':')
+        fields = rest.split()
+        if group not in headers:
+            headers[group] = [name.lower() for name in fields]
+        else:
+            data[group.lower()] = FrozenDict(zip(headers.pop(group), [int(v) for v in fields]))
+    return FrozenDict(data)
+
+
+PARSERS = {
+    MEMINFO_FILE: parse_meminfo,
+    STAT_FILE: parse_stat,
+    VMSTAT_FILE: parse_vmstat,
+    DISKSTATS_FILE: parse_diskstats,
+    NETSTAT_FILE: parse_netstat,
+    SNMP_FILE: parse_netstat,
+}
+
+_snapshots = {}
+_lock = threading.Lock()
+
+
+def read_file(path):
+    """Return the whole contents of path using a single open and read"""
+
+    f = open(path, 'r')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def get(path, max_age=SNAPSHOT_MAX_AGE):
+    """Return the Snapshot for path, re-reading it if older than max_age.
+
+    Raises IOError if the file cannot be read and KeyError if there is no
+    parser registered for path."""
+
+    snapshot = _snapshots.get(path)
+    if snapshot is not None and time.time() - snapshot.time < max_age:
+        return snapshot
+
+    _lock.acquire()
+    try:
+        # another thread may have refreshed it while we were waiting
+        snapshot = _snapshots.get(path)
+        if snapshot is None or time.time() - snapshot.time >= max_age:
+            data = PARSERS[path](read_file(path))
+            snapshot = Snapshot(path, time.time(), data)
+            _snapshots[path] = snapshot
+    finally:
+        _lock.release()
+
+    return snapshot
+
+
+def invalidate(path=None):
+    """Drop the cached snapshot for path, or all of them"""
+
+    _lock.acquire()
+    try:
+        if path is None:
+            _snapshots.clear()
+        else:
+            _snapshots.pop(path, None)
+    finally:
+        _lock.release()
+
+
+#This code is for debugging and unit testing
+if __name__ == '__main__':
+    for path in sorted(PARSERS):
+        try:
+            snapshot = get(path)
+        except IOError, e:
+            print '%s: %s' % (path, e)
+            continue
+        print '%s: %d entries' % (path, len(snapshot.data))
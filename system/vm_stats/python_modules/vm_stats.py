@@ -3,6 +3,8 @@ import re
 import time
 import copy
 
+import procfs_snapshot
+
 PARAMS = {}
 
 NAME_PREFIX = 'vm_'
@@ -33,23 +35,16 @@ def get_metrics():
 
     if (time.time() - METRICS['time']) > METRICS_CACHE_MAX:
 
-	try:
-	    file = open(vminfo_file, 'r')
-    
-	except IOError:
-	    return 0
-
-        # convert to dict
-        metrics = {}
-        for line in file:
-            parts = re.split("\s+", line)
-            metrics[parts[0]] = parts[1]
+        try:
+            snapshot = procfs_snapshot.get(vminfo_file)
+        except IOError:
+            return 0
 
-        # update cache
-        LAST_METRICS = copy.deepcopy(METRICS)
+        # update cache, snapshots are immutable so no copy is needed
+        LAST_METRICS = METRICS
         METRICS = {
-            'time': time.time(),
-            'data': metrics
+            'time': snapshot.time,
+            'data': snapshot.data
         }
 
     return [METRICS, LAST_METRICS]
@@ -6,7 +6,7 @@
 # Copyright: GPL
 
 
-import json, os, pprint, re, requests, socket, sys, time
+import json, os, pprint, Queue, re, requests, socket, sys, threading, time
 
 descriptors = list()
 
@@ -58,117 +58,168 @@ POOL_METRICS_TO_POLL = [
     'BE_MB_WRITE_RATE',
     ]
 
-def get_metric(name):
-    global METRICS, LAST_METRICS, METRICS_CACHE_MAX, ARRAY_METRICS_TO_POLL, params
-    metrics = {}
-    if (time.time() - METRICS['time']) > METRICS_CACHE_MAX:
-        
-        #Get all metrics at once, Don't re-poll for 5 minutes because they're no more granular than that anyway.    
-        for key in vmax_dict:
-            ### Get the Array based metrics first
-            baseurl = 'https://' + vmax_dict[key]['unisphereIP'] + ':' + str(unispherePort) + '/univmax/restapi/performance/Array/metrics'
-            requestObj = {'arrayParam': 
-                          {'endDate': str(int(time.time()*1000)), #End time to specify is now.
-                           'startDate': str(int(time.time()*1000)-(300*1000)), #start time is 5 minutes before that
-                           'metrics': ARRAY_METRICS_TO_POLL,
-                           'symmetrixId': vmax_dict[key]['sid'] #symmetrix ID (full 12 digits)
-                           }
-                          }
-
-            requestJSON = json.dumps(requestObj, sort_keys=True, indent=4) #turn this into a JSON string
-            headers = {'content-type': 'application/json','accept':'application/json'} #set the headers for how we want the response
-
-                #make the actual request, specifying the URL, the JSON from above, standard basic auth, the headers and not to verify the SSL cert
-            r = requests.post(baseurl, requestJSON, auth=(vmax_dict[key]['user'], vmax_dict[key]['pass']), headers=headers, verify=False)
-            
-                #take the raw response text and deserialize it into a python object.
-            try:
-                responseObj = json.loads(r.text)
-            except:
-                print "Exception"
-                print r.text
-
-            if len(responseObj["iterator"]["resultList"]["result"]) > 0:
-
-                metrics[key + '_cache_hits'] = float(responseObj["iterator"]["resultList"]["result"][0]['HIT_PER_SEC'])
-                metrics[key + '_fe_reads'] = float(responseObj["iterator"]["resultList"]["result"][0]['READS'])
-                metrics[key + '_fe_writes'] = float(responseObj["iterator"]["resultList"]["result"][0]['WRITES'])
-                metrics[key + '_vol_iorate'] = float(responseObj["iterator"]["resultList"]["result"][0]['IO_RATE'])
-                metrics[key + '_megabytes_read'] = float(responseObj["iterator"]["resultList"]["result"][0]['MB_READ_PER_SEC'])
-                metrics[key + '_megabytes_written'] = float(responseObj["iterator"]["resultList"]["result"][0]['MB_WRITE_PER_SEC'])
-                metrics[key + '_response_time_read'] = float(responseObj["iterator"]["resultList"]["result"][0]['RESPONSE_TIME_READ'])
-                metrics[key + '_response_time_write'] = float(responseObj["iterator"]["resultList"]["result"][0]['RESPONSE_TIME_WRITE'])
-
-            else:
-                print "Short response"
-                pprint.pprint(responseObj) 
-
-            ### Now get the pool based metrics for each vmax.
-            #Start by getting the list of pools
-            baseurl = 'https://' + vmax_dict[key]['unisphereIP'] + ':' + str(unispherePort) + '/univmax/restapi/performance/ThinPool/keys'
-
-            requestObj = {'thinPoolKeyParam': 
-                          {
-                    'symmetrixId': vmax_dict[key]['sid'] #symmetrix ID (full 12 digits)
-                    }
-                          }
-
-            requestJSON = json.dumps(requestObj, sort_keys=True, indent=4) #turn this into a JSON string
-
-            headers = {'content-type': 'application/json','accept':'application/json'} #set the headers for how we want the response
-
-            #make the actual request, specifying the URL, the JSON from above, standard basic auth, the headers and not to verify the SSL cert.
-
-            r = requests.post(baseurl, requestJSON, auth=(vmax_dict[key]['user'], vmax_dict[key]['pass']), headers=headers, verify=False)
-
-
-            #take the raw response text and deserialize it into a python object.
-            try:
-                responseObj = json.loads(r.text)
-            except:
-                print "Exception"
-                print r.text
-                print json.dumps(responseObj, sort_keys=False, indent=4)
-
-            for pool in responseObj["poolKeyResult"]["poolInfo"]:
-                baseurl = 'https://' + vmax_dict[key]['unisphereIP'] + ':' + str(unispherePort) + '/univmax/restapi/performance/ThinPool/metrics'
-
-                requestObj = {'thinPoolParam': 
-                              {'endDate': str(int(time.time()*1000)), #End time to specify is now.
-                               'startDate': str(int(time.time()*1000)-(300*1000)), #start time is 5 minutes before that
-                               'metrics': POOL_METRICS_TO_POLL,
-                               'poolId': pool["poolId"],
-                               'symmetrixId': vmax_dict[key]['sid'] #symmetrix ID (full 12 digits)
-                               }
-                              }
-                requestJSON = json.dumps(requestObj, sort_keys=True, indent=4) #turn this into a JSON string
-
-                headers = {'content-type': 'application/json','accept':'application/json'} #set the headers for how we want the response
+#Each Unisphere endpoint gets one requests.Session, so its connections (and
+#TLS sessions) are reused by every request of every refresh.
+SESSIONS = {}
+SESSIONS_LOCK = threading.Lock()
+#Requests run in parallel over all arrays and pools, at most POLL_WORKERS
+#at a time, each giving up after REQUEST_TIMEOUT seconds.
+POLL_WORKERS = 8
+REQUEST_TIMEOUT = 60
+#Pool ids of each vmax, found at metric_init along with the descriptors
+POOLS = {}
+
+def get_session(key):
+    unisphere = (vmax_dict[key]['unisphereIP'], vmax_dict[key]['user'])
+    with SESSIONS_LOCK:
+        if unisphere not in SESSIONS:
+            session = requests.Session()
+            session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=POLL_WORKERS))
+            session.auth = (vmax_dict[key]['user'], vmax_dict[key]['pass'])
+            session.headers.update({'content-type': 'application/json','accept':'application/json'}) #set the headers for how we want the response
+            session.verify = False
+            SESSIONS[unisphere] = session
+        return SESSIONS[unisphere]
+
+def post(key, resource, requestObj):
+    baseurl = 'https://' + vmax_dict[key]['unisphereIP'] + ':' + str(unispherePort) + '/univmax/restapi/performance/' + resource
+    requestJSON = json.dumps(requestObj, sort_keys=True, indent=4) #turn this into a JSON string
 
-                #make the actual request, specifying the URL, the JSON from above, standard basic auth, the headers and not to verify the SSL cert.
-                r = requests.post(baseurl, requestJSON, auth=(vmax_dict[key]['user'], vmax_dict[key]['pass']), headers=headers, verify=False)
+    #make the actual request on the session of this unisphere, which has the auth, headers and not to verify the SSL cert
+    r = get_session(key).post(baseurl, requestJSON, timeout=REQUEST_TIMEOUT)
 
-                #take the raw response text and deserialize it into a python object.
-                try:
-                    responseObj = json.loads(r.text)
-                except:
-                    print "Exception"
-                    print r.text
-                    print json.dumps(responseObj, sort_keys=False, indent=4)
+    #take the raw response text and deserialize it into a python object.
+    try:
+        return json.loads(r.text)
+    except:
+        print "Exception"
+        print r.text
+        raise
 
-                if len(responseObj["iterator"]["resultList"]["result"]) > 0:
+def get_pools(key):
+    responseObj = post(key, 'ThinPool/keys', {'thinPoolKeyParam': 
+                                               {
+                'symmetrixId': vmax_dict[key]['sid'] #symmetrix ID (full 12 digits)
+                }
+                                               })
+    return [pool["poolId"] for pool in responseObj["poolKeyResult"]["poolInfo"]]
 
-                    metrics[key + '_' + pool["poolId"] + '_reads'] = float(responseObj["iterator"]["resultList"]["result"][0]['BE_READS'])
-                    metrics[key + '_' + pool["poolId"] + '_writes'] = float(responseObj["iterator"]["resultList"]["result"][0]['BE_WRITES'])
-                    metrics[key + '_' + pool["poolId"] + '_response_time_reads'] = float(responseObj["iterator"]["resultList"]["result"][0]['BE_RESPONSE_TIME_READ'])
-                    metrics[key + '_' + pool["poolId"] + '_response_time_writes'] = float(responseObj["iterator"]["resultList"]["result"][0]['BE_RESPONSE_TIME_WRITE'])
-                    metrics[key + '_' + pool["poolId"] + '_megabytes_read'] = float(responseObj["iterator"]["resultList"]["result"][0]['BE_MB_READ_RATE'])
-                    metrics[key + '_' + pool["poolId"] + '_megabytes_written'] = float(responseObj["iterator"]["resultList"]["result"][0]['BE_MB_WRITE_RATE'])
+def get_array_metrics(key, startDate, endDate):
+    metrics = {}
+    responseObj = post(key, 'Array/metrics', {'arrayParam': 
+                                               {'endDate': endDate,
+                                                'startDate': startDate,
+                                                'metrics': ARRAY_METRICS_TO_POLL,
+                                                'symmetrixId': vmax_dict[key]['sid'] #symmetrix ID (full 12 digits)
+                                                }
+                                               })
+
+    if len(responseObj["iterator"]["resultList"]["result"]) > 0:
+        result = responseObj["iterator"]["resultList"]["result"][0]
+        metrics[key + '_cache_hits'] = float(result['HIT_PER_SEC'])
+        metrics[key + '_fe_reads'] = float(result['READS'])
+        metrics[key + '_fe_writes'] = float(result['WRITES'])
+        metrics[key + '_vol_iorate'] = float(result['IO_RATE'])
+        metrics[key + '_megabytes_read'] = float(result['MB_READ_PER_SEC'])
+        metrics[key + '_megabytes_written'] = float(result['MB_WRITE_PER_SEC'])
+        metrics[key + '_response_time_read'] = float(result['RESPONSE_TIME_READ'])
+        metrics[key + '_response_time_write'] = float(result['RESPONSE_TIME_WRITE'])
+
+    else:
+        print "Short response"
+        pprint.pprint(responseObj) 
+
+    return metrics
+
+#The ThinPool/metrics resource only takes a single poolId, so there is one
+#request per pool; they go out in parallel with the array ones.
+def get_pool_metrics(key, poolId, startDate, endDate):
+    metrics = {}
+    responseObj = post(key, 'ThinPool/metrics', {'thinPoolParam': 
+                                                  {'endDate': endDate,
+                                                   'startDate': startDate,
+                                                   'metrics': POOL_METRICS_TO_POLL,
+                                                   'poolId': poolId,
+                                                   'symmetrixId': vmax_dict[key]['sid'] #symmetrix ID (full 12 digits)
+                                                   }
+                                                  })
+
+    if len(responseObj["iterator"]["resultList"]["result"]) > 0:
+        result = responseObj["iterator"]["resultList"]["result"][0]
+        metrics[key + '_' + poolId + '_reads'] = float(result['BE_READS'])
+        metrics[key + '_' + poolId + '_writes'] = float(result['BE_WRITES'])
+        metrics[key + '_' + poolId + '_response_time_reads'] = float(result['BE_RESPONSE_TIME_READ'])
+        metrics[key + '_' + poolId + '_response_time_writes'] = float(result['BE_RESPONSE_TIME_WRITE'])
+        metrics[key + '_' + poolId + '_megabytes_read'] = float(result['BE_MB_READ_RATE'])
+        metrics[key + '_' + poolId + '_megabytes_written'] = float(result['BE_MB_WRITE_RATE'])
+
+    else:
+        print "Short response"
+        pprint.pprint(responseObj) 
+
+    return metrics
+
+def pollWorker(jobs, done, startDate, endDate):
+    while True:
+        try:
+            key, poolId = jobs.get_nowait()
+        except Queue.Empty:
+            return
+        try:
+            if poolId is None:
+                metrics = get_array_metrics(key, startDate, endDate)
+            else:
+                metrics = get_pool_metrics(key, poolId, startDate, endDate)
+        except Exception, e:
+            print '[vmax] polling %s %s failed: %s' % (key, poolId or 'array', e)
+            metrics = {}
+        done.put((key, metrics, time.time()))
+
+# Polls the array and pool metrics of every vmax in parallel. Metrics that
+# could not be fetched keep their previous value. <vmax>_poll_latency is
+# the time until the last request of that vmax finished.
+def poll_arrays():
+    endDate = int(time.time()*1000) #End time to specify is now.
+    startDate = str(endDate-(300*1000)) #start time is 5 minutes before that
+    endDate = str(endDate)
+
+    jobs = Queue.Queue()
+    done = Queue.Queue()
+    for key in vmax_dict:
+        jobs.put((key, None))
+        for poolId in POOLS.get(key, []):
+            jobs.put((key, poolId))
+
+    start = time.time()
+    workers = []
+    for i in range(min(POLL_WORKERS, jobs.qsize())):
+        worker = threading.Thread(target=pollWorker, args=(jobs, done, startDate, endDate))
+        worker.setDaemon(True)
+        worker.start()
+        workers.append(worker)
+    for worker in workers:
+        worker.join()
+
+    metrics = dict(METRICS['data'])
+    finished = {}
+    while True:
+        try:
+            key, values, end = done.get_nowait()
+        except Queue.Empty:
+            break
+        metrics.update(values)
+        finished[key] = max(finished.get(key, start), end)
+    for key in vmax_dict:
+        metrics[key + '_poll_latency'] = finished.get(key, start) - start
 
-                else:
-                    print "Short response"
-                    pprint.pprint(responseObj) 
+    return metrics
 
+def get_metric(name):
+    global METRICS, LAST_METRICS, METRICS_CACHE_MAX, ARRAY_METRICS_TO_POLL, params
+    if (time.time() - METRICS['time']) > METRICS_CACHE_MAX:
+        
+        #Get all metrics at once, Don't re-poll for 5 minutes because they're no more granular than that anyway.    
+        metrics = poll_arrays()
             
         LAST_METRICS = dict(METRICS)
         METRICS = {
@@ -252,37 +303,24 @@ def define_metrics(Desc_Skel, unisphereIP, sid, site):
                 "spoof_host"  : spoof_string,
                 }))
 
-    ###Perform API query to get list of Thinpools
-
-    baseurl = 'https://' + unisphereIP + ':8443/univmax/restapi/performance/ThinPool/keys'
-
-    requestObj = {'thinPoolKeyParam': 
-                  {
-            'symmetrixId': sid
-            }
-                  }
-          
-    requestJSON = json.dumps(requestObj, sort_keys=True, indent=4) #turn this into a JSON string
-
-    headers = {'content-type': 'application/json','accept':'application/json'} #set the headers for how we want the response
-
-    #make the actual request, specifying the URL, the JSON from above, standard basic auth, the headers and not to verify the SSL cert.
-    r = requests.post(baseurl, requestJSON, auth=(vmax_dict[vmax_name]['user'], vmax_dict[vmax_name]['pass']), headers=headers, verify=False)
-
+    #Time the last refresh of this vmax took
+    descriptors.append(create_desc(Desc_Skel, {
+                "name"        : vmax_name + '_poll_latency',
+                "units"       : "seconds",
+                "format"      : "%.3f",
+                "description" : "Time taken to fetch the metrics of this array",
+                "groups"      : "Latency",
+                "spoof_host"  : spoof_string,
+                }))
 
-    #take the raw response text and deserialize it into a python object.
-    try:
-        responseObj = json.loads(r.text)
-    except:
-        print "Exception"
-        print r.text
-        print json.dumps(responseObj, sort_keys=False, indent=4)
+    ###Perform API query to get list of Thinpools
+    POOLS[vmax_name] = get_pools(vmax_name)
 
-    for pool in responseObj["poolKeyResult"]["poolInfo"]:
+    for poolId in POOLS[vmax_name]:
 
         #BE_READS
         descriptors.append(create_desc(Desc_Skel, {
-                    "name"        : str(vmax_name + '_' + pool["poolId"] + '_reads'),
+                    "name"        : str(vmax_name + '_' + poolId + '_reads'),
                     "units"       : "iops",
                     "description" : "Pool BE Read IOPs",
                     "groups"      : "iops",
@@ -291,7 +329,7 @@ def define_metrics(Desc_Skel, unisphereIP, sid, site):
 
         #BE_WRITES
         descriptors.append(create_desc(Desc_Skel, {
-                    "name"        : str(vmax_name + '_' + pool["poolId"] + '_writes'),
+                    "name"        : str(vmax_name + '_' + poolId + '_writes'),
                     "units"       : "iops",
                     "description" : "Pool BE Writes IOPs",
                     "groups"      : "iops",
@@ -300,7 +338,7 @@ def define_metrics(Desc_Skel, unisphereIP, sid, site):
 
         #BE_RESPONSE_TIME_READ
         descriptors.append(create_desc(Desc_Skel, {
-                    "name"        : str(vmax_name + '_' + pool["poolId"] + '_response_time_reads'),
+                    "name"        : str(vmax_name + '_' + poolId + '_response_time_reads'),
                     "units"       : "ms",
                     "description" : "Pool BE Read Latency",
                     "groups"      : "Latency",
@@ -309,7 +347,7 @@ def define_metrics(Desc_Skel, unisphereIP, sid, site):
 
         #BE_RESPONSE_TIME_WRITE
         descriptors.append(create_desc(Desc_Skel, {
-                    "name"        : str(vmax_name + '_' + pool["poolId"] + '_response_time_writes'),
+                    "name"        : str(vmax_name + '_' + poolId + '_response_time_writes'),
                     "units"       : "ms",
                     "description" : "Pool BE Write Latency",
                     "groups"      : "Latency",
@@ -317,7 +355,7 @@ def define_metrics(Desc_Skel, unisphereIP, sid, site):
                     }))
         #BE_MB_READ_RATE
         descriptors.append(create_desc(Desc_Skel, {
-                    "name"        : str(vmax_name + '_' + pool["poolId"] + '_megabytes_read'),
+                    "name"        : str(vmax_name + '_' + poolId + '_megabytes_read'),
                     "units"       : "MB/s",
                     "description" : "Pool BE MB/s read",
                     "groups"      : "Throughput",
@@ -325,7 +363,7 @@ def define_metrics(Desc_Skel, unisphereIP, sid, site):
                     }))
         #BE_MB_WRITE_RATE
         descriptors.append(create_desc(Desc_Skel, {
-                    "name"        : str(vmax_name + '_' + pool["poolId"] + '_megabytes_written'),
+                    "name"        : str(vmax_name + '_' + poolId + '_megabytes_written'),
                     "units"       : "MB/s",
                     "description" : "Pool BE MB/s writes",
                     "groups"      : "Throughput",
@@ -336,11 +374,14 @@ def define_metrics(Desc_Skel, unisphereIP, sid, site):
     return descriptors
 
 def metric_init(params):
-    global descriptors, Desc_Skel, _Worker_Thread, Debug, newdict, vmax_dict
+    global descriptors, Desc_Skel, _Worker_Thread, Debug, newdict, vmax_dict, POLL_WORKERS, REQUEST_TIMEOUT
 
     print '[switch] Received the following parameters'
     print params
 
+    POLL_WORKERS = int(params.get('poll_workers', POLL_WORKERS))
+    REQUEST_TIMEOUT = float(params.get('request_timeout', REQUEST_TIMEOUT))
+
     #Import the params into the global NIPARAMS
 
     Desc_Skel = {
@@ -371,7 +412,8 @@ def create_desc(skel, prop):
 
 def metric_cleanup():
     '''Clean up the metric module.'''
-    pass
+    for session in SESSIONS.values():
+        session.close()
 
 # For CLI Debuging:
 if __name__ == '__main__':
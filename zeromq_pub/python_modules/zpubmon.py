@@ -12,6 +12,11 @@
 
     $ python zpubmon.py system-events tcp://localhost:8006
 
+  To measure how many messages per second it can count, run it against
+  a local inproc publisher:
+
+    $ python zpubmon.py --bench [messages] [message size] [batch size]
+
   See README for more details.
 
   :copyright: (c) 2012 by Ori Livneh <ori@wikimedia.org>
@@ -29,8 +34,15 @@ import zmq
 
 logging.basicConfig(format='[ZMQ] %(asctime)s %(message)s', level=logging.INFO)
 
+# Most messages read from a socket in one go, before the counter is
+# updated and the other sockets get their turn.
+BATCH_SIZE = 1000
+
+# Suffix of the metric names of the byte counts.
+BYTES_SUFFIX = '-bytes'
 
-def zmq_pub_mon(endpoints, counter):
+
+def zmq_pub_mon(endpoints, counter, batch_size=BATCH_SIZE, count_bytes=False):
     """
     Measure throughput of ZeroMQ publishers.
 
@@ -38,9 +50,15 @@ def zmq_pub_mon(endpoints, counter):
     endpoint URIs. The names are used as metric names in Ganglia and
     as the ZMQ_IDENTITY of the underlying socket.
 
+    Each socket that has messages waiting is drained of up to
+    *batch_size* of them, and its count in *counter* is updated once
+    per batch. With *count_bytes*, the size of the messages is added
+    up under the endpoint name plus BYTES_SUFFIX as well.
+
     """
     ctx = zmq.Context.instance()
     poller = zmq.Poller()
+    names = {}
 
     for name, uri in endpoints.iteritems():
         logging.info('Registering %s (%s).', name, uri)
@@ -49,13 +67,26 @@ def zmq_pub_mon(endpoints, counter):
         sock.connect(uri)
         sock.setsockopt(zmq.SUBSCRIBE, '')
         poller.register(sock, zmq.POLLIN)
+        names[sock] = name
 
     while 1:
         try:
             for socket, _ in poller.poll():
-                socket.recv(zmq.NOBLOCK)
-                name = socket.getsockopt(zmq.IDENTITY)
-                counter[name] += 1
+                name = names[socket]
+                messages = 0
+                size = 0
+                try:
+                    while messages < batch_size:
+                        size += len(socket.recv(zmq.NOBLOCK))
+                        messages += 1
+                except zmq.ZMQError as e:
+                    # EAGAIN: the socket has been drained.
+                    if e.errno != errno.EAGAIN:
+                        raise
+                finally:
+                    counter[name] += messages
+                    if count_bytes:
+                        counter[name + BYTES_SUFFIX] += size
         except zmq.ZMQError as e:
             # Calls interrupted by EINTR should be re-tried.
             if e.errno == errno.EINTR:
@@ -70,21 +101,28 @@ def metric_init(params):
     Gmond invokes this method with a dict of arguments specified in
     zpubmon.py. If *params* contains a `groups` key, its value is used
     as the group name in Ganglia (in lieu of the default 'ZeroMQ').
-    Other items are interpreted as (name: URI) pairs of ZeroMQ endpoints
-    to monitor.
+    A `batch_size` key sets the most messages read from a socket at a
+    time, and a `count_bytes` key of 'yes' adds a NAME-bytes metric with
+    the bytes published for every endpoint. Other items are interpreted
+    as (name: URI) pairs of ZeroMQ endpoints to monitor.
 
     `metric_init` spawns a worker thread to monitor these endpoints and
     returns a list of metric descriptors.
 
     """
     groups = params.pop('groups', 'ZeroMQ')
+    batch_size = int(params.pop('batch_size', BATCH_SIZE))
+    count_bytes = params.pop('count_bytes', 'no').lower() in ('yes', 'true', '1')
     counter = {name: 0 for name in params}
+    if count_bytes:
+        counter.update({name + BYTES_SUFFIX: 0 for name in params})
 
-    thread = threading.Thread(target=zmq_pub_mon, args=(params, counter))
+    thread = threading.Thread(target=zmq_pub_mon,
+                              args=(params, counter, batch_size, count_bytes))
     thread.daemon = True
     thread.start()
 
-    return [{
+    descriptors = [{
         'name': name,
         'value_type': 'uint',
         'format': '%d',
@@ -95,6 +133,20 @@ def metric_init(params):
         'groups': groups,
         'call_back': counter.get,
     } for name in params]
+    if count_bytes:
+        # a uint would wrap after 4 GB
+        descriptors += [{
+            'name': name + BYTES_SUFFIX,
+            'value_type': 'double',
+            'format': '%.0f',
+            'units': 'bytes',
+            'slope': 'positive',
+            'time_max': 20,
+            'description': 'bytes published',
+            'groups': groups,
+            'call_back': counter.get,
+        } for name in params]
+    return descriptors
 
 
 def metric_cleanup():
@@ -136,5 +188,54 @@ def self_test():
         time.sleep(5)
 
 
+def self_bench():
+    """
+    Measure how fast messages are counted.
+
+    Publishes *messages* messages of *size* bytes as fast as possible
+    on an inproc PUB socket, counts them with a monitor thread reading
+    *batch_size* at a time, and reports the rate at which they were
+    counted. Messages the publisher had to drop because the monitor
+    fell behind show up as the difference between sent and counted.
+
+    """
+    args = sys.argv[2:]
+    messages = int(args[0]) if len(args) > 0 else 1000000
+    size = int(args[1]) if len(args) > 1 else 100
+    batch_size = args[2] if len(args) > 2 else str(BATCH_SIZE)
+
+    uri = 'inproc://zpubmon-bench'
+    pub = zmq.Context.instance().socket(zmq.PUB)
+    pub.bind(uri)
+
+    descriptors = metric_init({'bench': uri, 'batch_size': batch_size,
+                               'count_bytes': 'yes'})
+    counted = descriptors[0]['call_back']
+    # give the subscriber time to join, or the first messages are lost
+    time.sleep(1)
+
+    message = 'x' * size
+    start = time.time()
+    for i in xrange(messages):
+        pub.send(message)
+    sent = time.time() - start
+
+    # wait for the monitor to catch up
+    last = -1
+    while counted('bench') != last:
+        last = counted('bench')
+        time.sleep(0.2)
+    elapsed = time.time() - start - 0.2
+
+    print 'sent %d messages of %d bytes in %.2fs (%.0f msgs/s)' % (
+        messages, size, sent, messages / sent)
+    print 'counted %d messages, %d bytes in %.2fs (%.0f msgs/s), batch size %s' % (
+        counted('bench'), counted('bench' + BYTES_SUFFIX), elapsed,
+        counted('bench') / elapsed, batch_size)
+
+
 if __name__ == '__main__':
-    self_test()
+    if sys.argv[1:2] == ['--bench']:
+        self_bench()
+    else:
+        self_test()